@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Measure the cold start of the scripts: the wall time of "script --help" and of the import of each module.
+
+Every measure runs in a new Python process, and the heavy modules loaded by each import are listed.
+"""
+
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+heavy_modules = ['numpy', 'pandas', 'xlrd']
+modules = [
+    'ipp_tables_parsing',
+    'ipp_tables_aggregation',
+    'extract_ipp_parameters',
+    'ipp_tax_benefit_tables_to_openfisca_parameters',
+    'parse_ipp_tax_benefit_tables',
+    ]
+scripts = [
+    'diff_ipp_tax_benefit_tables.py',
+    'extract_ipp_parameters.py',
+    'ipp_tax_benefit_tables_to_openfisca_parameters.py',
+    'parse_ipp_tax_benefit_tables.py',
+    ]
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--runs', default = 10, type = int, help = 'number of runs of each measure')
+    args = parser.parse_args()
+
+    print 'Baseline (empty Python process): {}'.format(format_timings(time_command([sys.executable, '-c', 'pass'],
+        args.runs)))
+    for module in modules:
+        command = [sys.executable, '-c', 'import sys, {0}; print " ".join(name for name in {1} if name in sys.modules)'
+            .format(module, heavy_modules)]
+        loaded_modules = subprocess.check_output(command, cwd = script_dir).strip()
+        print 'import {}: {} (loads: {})'.format(module, format_timings(time_command(command, args.runs)),
+            loaded_modules or 'none')
+    for script in scripts:
+        print '{} --help: {}'.format(script, format_timings(time_command([sys.executable, script, '--help'],
+            args.runs)))
+    return 0
+
+
+def format_timings(timings):
+    timings = sorted(timings)
+    return 'min {:.1f} ms, median {:.1f} ms'.format(timings[0] * 1000, timings[len(timings) // 2] * 1000)
+
+
+def time_command(command, runs):
+    timings = []
+    with open(os.devnull, 'wb') as null_file:
+        for run in range(runs):
+            start = time.time()
+            subprocess.check_call(command, cwd = script_dir, stdout = null_file)
+            timings.append(time.time() - start)
+    return timings
+
+
+if __name__ == "__main__":
+    sys.exit(main())
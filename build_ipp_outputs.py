@@ -0,0 +1,392 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Build the outputs of IPP's tax benefit tables, rebuilding only the stale ones, like make.
+
+The targets are the aggregated CSV tables of each bareme (one per aggregation option, and per month for
+which_month_in_year), the OpenFisca XML parameters, the SQLite database of all the parameters rows and the report of
+the TAXIPP names defined several times.
+
+For each built target, the build state (.build_state.json in the output directory) records the fingerprints of the
+workbooks and of their sheets it was built from, and a fingerprint of its recipe (options and source code). A target
+is stale when it is missing or when its recipe or the content of one of its sheets has changed: a workbook saved again
+without any change of its sheets doesn't rebuild anything.
+
+The stale tables of a bareme are built together, from a single parsing of its workbook, and the independent targets
+are built in parallel.
+
+Example: python build_ipp_outputs.py -d Baremes_IPP -o outputs -j 4
+"""
+
+
+import argparse
+import collections
+import fnmatch
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+import traceback
+
+import xlrd
+
+from csv_table_writer import extension_by_compression, get_output_path
+from ipp_tables_parsing import (compute_file_fingerprint, compute_sheet_fingerprint, get_sheet_names,
+    iter_parameter_series, parse_sheet)
+import ipp_tax_benefit_tables_to_openfisca_parameters
+import parse_ipp_tax_benefit_tables
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+build_state_filename = '.build_state.json'
+duplicated_names_report_name = u'duplicated_names.csv'
+log = logging.getLogger(app_name)
+openfisca_parameters_name = u'openfisca_parameters.xml'
+options = ['all_months', 'mean_by_year', 'which_month_in_year']
+parameters_database_name = u'ipp_parameters.sqlite'
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sources_by_kind = dict(
+    duplicated_names = ['build_ipp_outputs.py', 'ipp_tables_parsing.py'],
+    openfisca_parameters = ['build_ipp_outputs.py', 'conversion_checkpoints.py', 'ipp_tables_parsing.py',
+        'ipp_tax_benefit_tables_to_openfisca_parameters.py'],
+    parameters_database = ['build_ipp_outputs.py', 'ipp_tables_parsing.py', 'sqlite_parameter_export.py'],
+    tables = ['build_ipp_outputs.py', 'csv_table_writer.py', 'ipp_tables_aggregation.py', 'ipp_tables_parsing.py'],
+    )
+
+
+def build_openfisca_parameters(directory, output_path, checkpoints_dir):
+    temporary_path = output_path + '.tmp'
+    with open(temporary_path, 'wb') as output_file:
+        subprocess.check_call([sys.executable, 'ipp_tax_benefit_tables_to_openfisca_parameters.py',
+            '--checkpoints-dir', checkpoints_dir, '-d', directory.encode('utf-8')], cwd = script_dir,
+            stdout = output_file)
+    os.rename(temporary_path, output_path)
+
+
+def build_parameters_database(directory, baremes, output_path):
+    from sqlite_parameter_export import write_parameter_database
+    write_parameter_database(output_path, iter_baremes_series(directory, baremes))
+
+
+def build_tables(directory, bareme, outputs, compression):
+    """Parse the workbook of a bareme once and write its tables, given as (option, month, output path) triples."""
+    # pandas & NumPy are loaded only by the processes building tables.
+    from ipp_tables_aggregation import convert_sheet_to_vectors, write_aggregated_tables
+
+    book = xlrd.open_workbook(filename = get_xls_path(directory, bareme), formatting_info = True, on_demand = True)
+    series_by_taxipp_name = collections.OrderedDict()
+    vector_by_taxipp_name = {}
+    for sheet_name in get_sheet_names(book, bareme):
+        sheet_series_list, sheet_vectors = convert_sheet_to_vectors(book, bareme, sheet_name)
+        for series in sheet_series_list:
+            series_by_taxipp_name[series['taxipp_name']] = series
+        for taxipp_name, vector in sheet_vectors:
+            vector_by_taxipp_name[taxipp_name] = vector
+    book.release_resources()
+    write_aggregated_tables(vector_by_taxipp_name, outputs, series_list = series_by_taxipp_name.values(),
+        compression = compression)
+
+
+def compute_recipe_fingerprint(kind, target_options):
+    fingerprint = hashlib.sha1()
+    fingerprint.update(repr((kind, sorted(target_options.iteritems()))))
+    for source in sources_by_kind[kind]:
+        fingerprint.update(compute_file_fingerprint(os.path.join(script_dir, source)))
+    return fingerprint.hexdigest()
+
+
+def compute_sheets_fingerprints(xls_path):
+    book = xlrd.open_workbook(filename = xls_path, formatting_info = True, on_demand = True)
+    sheets_fingerprints = {}
+    for sheet_name in book.sheet_names():
+        sheets_fingerprints[sheet_name] = compute_sheet_fingerprint(book, book.sheet_by_name(sheet_name))
+        book.unload_sheet(sheet_name)
+    book.release_resources()
+    return sheets_fingerprints
+
+
+def get_stale_reason(target, target_state, workbook_fingerprints):
+    """Return why a target must be rebuilt, or None when it is up to date.
+
+    workbook_fingerprints(xls_path, sheets) returns the file fingerprint of a workbook and, when sheets is True, the
+    fingerprints of its sheets.
+    """
+    if not os.path.exists(target['output_path']):
+        return u'missing output'
+    if target_state is None:
+        return u'never built'
+    if target_state['recipe'] != target['recipe']:
+        return u'options or source code changed'
+    if sorted(target_state['inputs']) != sorted(target['inputs']):
+        return u'inputs changed'
+    for xls_path, input_state in sorted(target_state['inputs'].iteritems()):
+        if workbook_fingerprints(xls_path, False)[0] == input_state['file']:
+            continue
+        sheets_fingerprints = workbook_fingerprints(xls_path, True)[1]
+        changed_sheets = sorted(
+            sheet_name
+            for sheet_name in set(sheets_fingerprints) | set(input_state['sheets'])
+            if sheets_fingerprints.get(sheet_name) != input_state['sheets'].get(sheet_name)
+            )
+        if changed_sheets:
+            return u'sheets changed in {}: {}'.format(os.path.basename(xls_path), u', '.join(changed_sheets))
+        # Same content in a new file: only the file fingerprint needs to be updated.
+        input_state['file'] = workbook_fingerprints(xls_path, False)[0]
+    return None
+
+
+def get_xls_path(directory, bareme):
+    return os.path.join(directory, u'Baremes IPP - {}.xls'.format(bareme))
+
+
+def iter_baremes_series(directory, baremes):
+    """Iterate over the parameter series of the workbooks of baremes, parsing one sheet at a time."""
+    for bareme in baremes:
+        book = xlrd.open_workbook(filename = get_xls_path(directory, bareme), formatting_info = True,
+            on_demand = True)
+        for sheet_name in get_sheet_names(book, bareme):
+            for series in iter_parameter_series(bareme, sheet_name, parse_sheet(book, sheet_name)):
+                yield series
+            book.unload_sheet(sheet_name)
+        book.release_resources()
+
+
+def iter_targets(directory, output_dir, target_options, months, compression):
+    """Iterate over the targets, as dicts whose job is a (function, arguments) couple."""
+    existing_baremes = [
+        bareme
+        for bareme in parse_ipp_tax_benefit_tables.baremes
+        if os.path.exists(get_xls_path(directory, bareme))
+        ]
+    for bareme in existing_baremes:
+        for option in target_options:
+            for month in (months if option == 'which_month_in_year' else [None]):
+                name = u'{}_{}{}.csv'.format(bareme, option, u'_{}'.format(month) if month is not None else u'')
+                yield dict(
+                    group = (u'tables', bareme),
+                    inputs = [get_xls_path(directory, bareme)],
+                    job = (build_tables, (directory, bareme, [(option, month or 1,
+                        os.path.join(output_dir, name))], compression)),
+                    name = name,
+                    output_path = get_output_path(os.path.join(output_dir, name), compression = compression),
+                    recipe = compute_recipe_fingerprint('tables', dict(compression = compression, month = month,
+                        option = option)),
+                    )
+    output_path = os.path.join(output_dir, openfisca_parameters_name)
+    yield dict(
+        group = None,
+        inputs = [
+            get_xls_path(directory, bareme)
+            for bareme in ipp_tax_benefit_tables_to_openfisca_parameters.baremes
+            if os.path.exists(get_xls_path(directory, bareme))
+            ],
+        job = (build_openfisca_parameters, (directory, output_path, os.path.join(output_dir, '.checkpoints'))),
+        name = openfisca_parameters_name,
+        output_path = output_path,
+        recipe = compute_recipe_fingerprint('openfisca_parameters', {}),
+        )
+    output_path = os.path.join(output_dir, parameters_database_name)
+    yield dict(
+        group = None,
+        inputs = [get_xls_path(directory, bareme) for bareme in existing_baremes],
+        job = (build_parameters_database, (directory, existing_baremes, output_path)),
+        name = parameters_database_name,
+        output_path = output_path,
+        recipe = compute_recipe_fingerprint('parameters_database', {}),
+        )
+    output_path = os.path.join(output_dir, duplicated_names_report_name)
+    yield dict(
+        group = None,
+        inputs = [get_xls_path(directory, bareme) for bareme in existing_baremes],
+        job = (write_duplicated_names_report, (directory, existing_baremes, output_path)),
+        name = duplicated_names_report_name,
+        output_path = output_path,
+        recipe = compute_recipe_fingerprint('duplicated_names', {}),
+        )
+
+
+def load_build_state(output_dir):
+    build_state_path = os.path.join(output_dir, build_state_filename)
+    if not os.path.exists(build_state_path):
+        return {}
+    with open(build_state_path) as build_state_file:
+        return json.load(build_state_file)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-B', '--always-make', action = 'store_true', default = False,
+        help = 'rebuild all the targets, even the up to date ones')
+    parser.add_argument('-c', '--compression', choices = sorted(extension_by_compression),
+        help = 'compress the CSV tables (zstd requires the zstandard package)')
+    parser.add_argument('-d', '--dir', default = 'Baremes_IPP', help = 'path of IPP XLS directory')
+    parser.add_argument('-j', '--jobs', default = 1, type = int, help = 'number of targets built in parallel')
+    parser.add_argument('-k', '--keep-going', action = 'store_true', default = False,
+        help = 'build all the targets that can be built, instead of stopping at the first failure')
+    parser.add_argument('-m', '--month', action = 'append', dest = 'months', type = int,
+        help = 'month of the which_month_in_year tables (can be repeated, default: every month)')
+    parser.add_argument('-n', '--dry-run', action = 'store_true', default = False,
+        help = 'print the stale targets and why, without building them')
+    parser.add_argument('-o', '--output-dir', default = 'outputs', help = 'path of the directory of the outputs')
+    parser.add_argument('-O', '--option', action = 'append', choices = options, dest = 'options',
+        help = 'aggregation option of the tables (can be repeated, default: {})'.format(u', '.join(options)))
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    parser.add_argument('targets', nargs = '*', help = 'names or glob patterns of the targets to build (default: all)')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stderr)
+
+    directory = os.path.abspath(args.dir).decode('utf-8')
+    output_dir = os.path.abspath(args.output_dir).decode('utf-8')
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    targets = [
+        target
+        for target in iter_targets(directory, output_dir, args.options or options, args.months or range(1, 13),
+            args.compression)
+        if not args.targets or any(fnmatch.fnmatchcase(target['name'], pattern.decode('utf-8'))
+            for pattern in args.targets)
+        ]
+
+    fingerprints_by_xls_path = {}
+
+    def workbook_fingerprints(xls_path, sheets):
+        file_fingerprint, sheets_fingerprints = fingerprints_by_xls_path.get(xls_path, (None, None))
+        if file_fingerprint is None:
+            file_fingerprint = compute_file_fingerprint(xls_path)
+        if sheets and sheets_fingerprints is None:
+            sheets_fingerprints = compute_sheets_fingerprints(xls_path)
+        fingerprints_by_xls_path[xls_path] = file_fingerprint, sheets_fingerprints
+        return file_fingerprint, sheets_fingerprints
+
+    build_state = load_build_state(output_dir)
+    stale_targets = []
+    for target in targets:
+        reason = u'forced' if args.always_make else get_stale_reason(target, build_state.get(target['name']),
+            workbook_fingerprints)
+        if reason is None:
+            log.info(u'{} is up to date'.format(target['name']))
+            continue
+        print u'{}: {}'.format(target['name'], reason).encode('utf-8')
+        stale_targets.append(target)
+    # Keep the file fingerprints updated by get_stale_reason for the unchanged sheets.
+    save_build_state(output_dir, build_state)
+    if args.dry_run or not stale_targets:
+        if not stale_targets:
+            print u'Every target is up to date.'
+        return 0
+
+    # The stale tables of a bareme share a single job, parsing its workbook once.
+    targets_by_job_key = collections.OrderedDict()
+    for target in stale_targets:
+        targets_by_job_key.setdefault(target['group'] or target['name'], []).append(target)
+    jobs = []
+    for job_targets in targets_by_job_key.itervalues():
+        function, function_args = job_targets[0]['job']
+        if function is build_tables:
+            function_args = function_args[:2] + ([
+                output
+                for target in job_targets
+                for output in target['job'][1][2]
+                ],) + function_args[3:]
+        jobs.append(([target['name'] for target in job_targets], function, function_args))
+
+    targets_by_name = dict((target['name'], target) for target in stale_targets)
+    failures = []
+    pool = multiprocessing.Pool(args.jobs) if args.jobs > 1 else None
+    try:
+        results = pool.imap_unordered(run_job, jobs) if pool is not None else (run_job(job) for job in jobs)
+        for names, error in results:
+            if error is not None:
+                log.error(u'Build of {} failed:\n{}'.format(u', '.join(names), error.decode('utf-8')))
+                failures.extend(names)
+                if not args.keep_going:
+                    break
+                continue
+            for name in names:
+                target = targets_by_name[name]
+                build_state[name] = dict(
+                    inputs = dict(
+                        (xls_path, dict(zip(('file', 'sheets'), workbook_fingerprints(xls_path, True))))
+                        for xls_path in target['inputs']
+                        ),
+                    recipe = target['recipe'],
+                    )
+                print u'Built {}'.format(name).encode('utf-8')
+            # The state is saved after each job, so that an interrupted build keeps the targets already built.
+            save_build_state(output_dir, build_state)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    if failures:
+        log.error(u'{} target(s) failed: {}'.format(len(failures), u', '.join(failures)))
+        return 1
+    return 0
+
+
+def run_job(job):
+    """Run a job and return the names of its targets with the traceback of its failure (or None)."""
+    names, function, function_args = job
+    try:
+        function(*function_args)
+    except Exception:
+        return names, traceback.format_exc()
+    return names, None
+
+
+def save_build_state(output_dir, build_state):
+    build_state_path = os.path.join(output_dir, build_state_filename)
+    temporary_path = build_state_path + '.tmp'
+    with open(temporary_path, 'w') as build_state_file:
+        json.dump(build_state, build_state_file, indent = 2, sort_keys = True)
+    os.rename(temporary_path, build_state_path)
+
+
+def write_duplicated_names_report(directory, baremes, output_path):
+    """Write the CSV report of the TAXIPP names defined in several sheets, of the same workbook or not."""
+    locations_by_taxipp_name = collections.OrderedDict()
+    for series in iter_baremes_series(directory, baremes):
+        locations_by_taxipp_name.setdefault(series['taxipp_name'], []).append((series['bareme'],
+            series['sheet_name']))
+    temporary_path = output_path + '.tmp'
+    with open(temporary_path, 'wb') as output_file:
+        output_file.write(b'taxipp_name,bareme,sheet_name\n')
+        for taxipp_name, locations in sorted(locations_by_taxipp_name.iteritems()):
+            if len(locations) > 1:
+                for bareme, sheet_name in locations:
+                    output_file.write(u','.join(
+                        u'"{}"'.format(field.replace(u'"', u'""'))
+                        for field in (taxipp_name, bareme, sheet_name)
+                        ).encode('utf-8') + b'\n')
+    os.rename(temporary_path, output_path)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
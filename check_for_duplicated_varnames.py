@@ -24,124 +24,146 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+"""Check IPP's tax benefit tables: duplicated TAXIPP names, dates, units and number formats.
+
+Every workbook is read once: the rows of each sheet are checked while they are parsed (see ipp_tables_validation),
+then the TAXIPP names of all the sheets of all the workbooks are compared. The same checks can be run during the
+conversion, with the --validation-report option of parse_ipp_tax_benefit_tables.
+
+The workbooks published only as .xlsx files (as "Barèmes IPP - Prestations.xlsx") are checked for duplicated TAXIPP
+names only: xlrd doesn't read the formats of their numbers. Only their sheets whose first row is a row of TAXIPP names
+(a "date" cell followed by identifiers) are checked: the first row of the other ones holds the labels of the columns.
+
+The exit status is 1 when a TAXIPP name is duplicated, the other issues being only reported.
+"""
+
+
 import argparse
-import datetime
-import math
+import collections
+import glob
+import logging
 import os
-
-import numpy as np
-import pandas as pd
-# Architecture :
-# un xlsx contient des sheets qui contiennent des variables, chaque sheet ayant un vecteur de dates
-
-
-def clean_date(date_time):
-    ''' Conversion des dates spécifiées en année au format year/01/01
-    Remise des jours au premier du mois '''
-    if len(str(date_time)) == 4 :
-        return datetime.date(date_time, 1, 1)
-    else:
-        return date_time.date().replace(day = 1)
-
-
-def clean_sheet(xls_file, sheet_name):
-    ''' Cleaning excel sheets and creating small database'''
-
-    sheet = xls_file.parse(sheet_name, index_col = None)
-
-    # Conserver les bonnes colonnes : on drop tous les "Unnamed"
-    for col in sheet.columns.values:
-        if col[0:7] == 'Unnamed':
-            sheet = sheet.drop([col], 1)
-
-    # Pour l'instant on drop également tous les ref_leg, jorf et notes
-    for var_to_drop in ['ref_leg', 'jorf', 'Notes', 'notes', 'date_ir'] :
-        if var_to_drop in sheet.columns.values:
-            sheet = sheet.drop(var_to_drop, axis = 1)
-
-
-    # Pour impôt sur le revenu, il y a date_IR et date_rev : on utilise date_rev, que l'on renome date pour plus de cohérence
-    if 'date_rev' in sheet.columns.values:
-            sheet = sheet.rename(columns={'date_rev':u'date'})
-
-    # Conserver les bonnes lignes : on drop s'il y a du texte ou du NaN dans la colonne des dates
-    def is_var_nan(row,col):
-        return isinstance(sheet.iloc[row, col], float) and math.isnan(sheet.iloc[row, col])
-
-    sheet['date_absente'] = False
-    for i in range(0,sheet.shape[0]):
-        sheet.loc[i,['date_absente']] = isinstance(sheet.iat[i,0], basestring) or is_var_nan(i,0)
-    sheet = sheet[sheet.date_absente == False]
-    sheet = sheet.drop(['date_absente'], axis = 1)
-
-    # S'il y a du texte au milieu du tableau (explications par exemple) => on le transforme en NaN
-    for col in range(0, sheet.shape[1]):
-        for row in range(0,sheet.shape[0]):
-            if isinstance(sheet.iloc[row,col], unicode):
-                sheet.iat[row,col] = np.nan
-
-    # Gérer la suppression et la création progressive de dispositifs
-
-    sheet.iloc[0, :].fillna('-', inplace = True)
-
-    assert 'date' in sheet.columns, "Aucune colonne date dans la feuille : {}".format(sheet)
-    sheet['date'] =[ clean_date(d) for d in  sheet['date']]
-
-    return sheet
-
-def dic_of_same_variable_names(xls_file, sheet_names):
-    dic = {}
-    all_variables = np.zeros(1)
-    multiple_names = []
-    for sheet_name in  sheet_names:
-        dic[sheet_name]= clean_sheet(xls_file, sheet_name)
-        sheet = clean_sheet(xls_file, sheet_name)
-        columns =  np.delete(sheet.columns.values,0)
-        all_variables = np.append(all_variables,columns)
-    for i in range(0,len(all_variables)):
-        var = all_variables[i]
-        new_variables = np.delete(all_variables,i)
-        if var in new_variables:
-            multiple_names.append(str(var))
-    multiple_names = list(set(multiple_names))
-    dic_var_to_sheet={}
-    for sheet_name in sheet_names:
-        sheet = clean_sheet(xls_file, sheet_name)
-        columns =  np.delete(sheet.columns.values,0)
-        for var in multiple_names:
-            if var in columns:
-                if var in dic_var_to_sheet.keys():
-                    dic_var_to_sheet[var].append(sheet_name)
-                else:
-                    dic_var_to_sheet[var] = [sheet_name]
-    return dic_var_to_sheet
-
-
-if __name__ == '__main__':
-    path = u"P:/Legislation/Barèmes IPP/"
+import re
+import sys
+
+from biryani import strings
+import xlrd
+
+from ipp_tables_parsing import (conv, get_column_roles, get_merged_cells_tree, get_sheet_names,
+    get_unmerged_cell_coordinates, iter_sheet_events, label_cell_to_date_or_year, transform_xls_cell_to_json)
+from ipp_tables_validation import (create_sheet_validation, get_validation_issues, iter_validated_sheet_events,
+    write_validation_report)
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+log = logging.getLogger(app_name)
+taxipp_name_re = re.compile(ur'[A-Za-z_][0-9A-Za-z_]*$')
+xls_prefix = u'Baremes IPP - '
+xlsx_prefix = u'Barèmes IPP - '
+
+
+def get_path_by_bareme(directory, prefix, extension):
+    path_by_bareme = {}
+    for path in glob.glob(os.path.join(directory, prefix + u'*' + extension)):
+        path_by_bareme[os.path.splitext(os.path.basename(path))[0][len(prefix):]] = path
+    return path_by_bareme
+
+
+def get_sheet_taxipp_names(book, sheet_name):
+    """Return the TAXIPP names of the parameters of a sheet, read from its TAXIPP names row and its first labels row
+    only, whose cells are texts: the numbers of the workbooks read without formatting informations can't be decoded.
+
+    Return None when the first row of the sheet is not a row of TAXIPP names (see is_taxipp_names_row).
+    """
+    sheet = book.sheet_by_name(sheet_name)
+    merged_cells_tree = get_merged_cells_tree(sheet)
+
+    def get_texts_row(row_index):
+        texts_row = []
+        for column_index in range(sheet.row_len(row_index)):
+            cell_type = sheet.cell_type(*get_unmerged_cell_coordinates(row_index, column_index, merged_cells_tree))
+            texts_row.append(transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, column_index)
+                if cell_type == xlrd.XL_CELL_TEXT else None)
+        return texts_row
+
+    if sheet.nrows < 2:
+        return []
+    taxipp_names_row = get_texts_row(0)
+    if not is_taxipp_names_row(taxipp_names_row):
+        return None
+    labels_rows = []
+    labels_row = get_texts_row(1)
+    # As in iter_rows_roles_by_date, the row following the TAXIPP names is a labels row unless it begins with a date.
+    if labels_row and labels_row[0] is not None \
+            and label_cell_to_date_or_year(labels_row[0], state = conv.default_state)[1] is not None:
+        labels_rows.append(labels_row)
+    return [
+        taxipp_names_row[column_index]
+        for column_index, role in enumerate(get_column_roles(dict(
+            labels_rows = labels_rows,
+            taxipp_names_row = taxipp_names_row,
+            )))
+        if role == u'parameter'
+        ]
+
+
+def is_taxipp_names_row(row):
+    """Tell whether a row is a row of TAXIPP names: a "date" cell followed by identifiers (or empty cells)."""
+    return bool(row) and row[0] is not None and row[0].strip() == u'date' and all(
+        taxipp_name_re.match(cell.strip())
+        for cell in row[1:]
+        if cell is not None and cell.strip()
+        ) and any(cell is not None and cell.strip() for cell in row[1:])
+
+
+def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-d', '--dir', default = path, help = 'path of IPP XLS directory')
+    parser.add_argument('-d', '--dir', default = 'Baremes_IPP', help = 'path of IPP XLS directory')
+    parser.add_argument('-o', '--output', help = 'path of the CSV report of the issues')
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
     args = parser.parse_args()
-
-    baremes = [u'Prestations', u'prélèvements sociaux', u'Impôt Revenu']
-    forbiden_sheets = {u'Impôt Revenu' : (u'Barème IGR',),
-                       u'prélèvements sociaux' : (u'Abréviations', u'ASSIETTE PU', u'AUBRYI')}
-    for bareme in baremes :
-        xls_path = os.path.join(args.dir, u"Barèmes IPP - {0}.xlsx".format(bareme))
-        xls_file = pd.ExcelFile(xls_path)
-
-        # Retrait des onglets qu'on ne souhaite pas importer
-        sheets_to_remove = (u'Sommaire', u'Outline')
-        if bareme in forbiden_sheets.keys():
-            sheets_to_remove += forbiden_sheets[bareme]
-
-        sheet_names = [
-            sheet_name
-            for sheet_name in xls_file.sheet_names
-            if not sheet_name.startswith(sheets_to_remove)
-            ]
-
-        # Test si deux variables ont le même nom
-        test_duplicate = dic_of_same_variable_names(xls_file, sheet_names)
-        assert not test_duplicate, u'Au moins deux variables ont le même nom dans le classeur {} : u{}'.format(
-            bareme,test_duplicate)
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stderr)
+
+    directory = args.dir.decode('utf-8')
+    sheet_validation_by_key = collections.OrderedDict()
+    xls_path_by_bareme = get_path_by_bareme(directory, xls_prefix, u'.xls')
+    for bareme, xls_path in sorted(xls_path_by_bareme.iteritems()):
+        log.info(u'Checking file {}'.format(bareme))
+        book = xlrd.open_workbook(filename = xls_path, formatting_info = True, on_demand = True)
+        for sheet_name in get_sheet_names(book, bareme):
+            sheet_validation = sheet_validation_by_key[(bareme, sheet_name)] = create_sheet_validation()
+            for event in iter_validated_sheet_events(sheet_validation, bareme, sheet_name,
+                    iter_sheet_events(book, sheet_name, strict_formats = False)):
+                pass
+            book.unload_sheet(sheet_name)
+        book.release_resources()
+    xls_baremes_slugs = set(strings.slugify(bareme) for bareme in xls_path_by_bareme)
+    for bareme, xlsx_path in sorted(get_path_by_bareme(directory, xlsx_prefix, u'.xlsx').iteritems()):
+        if strings.slugify(bareme) in xls_baremes_slugs:
+            continue
+        log.info(u'Checking the TAXIPP names of file {}'.format(bareme))
+        book = xlrd.open_workbook(filename = xlsx_path, on_demand = True)
+        for sheet_name in get_sheet_names(book, bareme):
+            taxipp_names = get_sheet_taxipp_names(book, sheet_name)
+            book.unload_sheet(sheet_name)
+            if taxipp_names is None:
+                log.info(u'  Skipping sheet {}, without TAXIPP names row'.format(sheet_name))
+                continue
+            sheet_validation = sheet_validation_by_key[(bareme, sheet_name)] = create_sheet_validation()
+            sheet_validation['taxipp_names'].extend(taxipp_names)
+        book.release_resources()
+
+    issues = get_validation_issues(sheet_validation_by_key)
+    if args.output is not None:
+        write_validation_report(issues, args.output)
+    for issue in issues:
+        print u'{} / {}{}{} [{}]: {}'.format(issue['bareme'], issue['sheet_name'],
+            u', row {}'.format(issue['row']) if issue['row'] is not None else u'',
+            u', {}'.format(issue['taxipp_name']) if issue['taxipp_name'] is not None else u'', issue['kind'],
+            issue['message']).encode('utf-8')
+    print u'{} issue(s) in {} sheet(s)'.format(len(issues), len(sheet_validation_by_key))
+    return 1 if any(issue['kind'] == u'duplicated_taxipp_name' for issue in issues) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
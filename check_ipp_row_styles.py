@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Cross-check the classification of the rows of IPP's tax benefit tables by content and by style.
+
+The rows of every sheet are classified both from the dates of their first cells (iter_rows_roles_by_date) and from
+the background colours of their first cells (iter_rows_roles_by_style). The sheets where the two classifications
+differ are reported with their inconsistent rows: usually a values row without its light blue background, or a
+label row coloured like a values row.
+"""
+
+
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+
+import xlrd
+
+from ipp_tables_parsing import (get_merged_cells_tree, get_sheet_names, iter_rows_roles_by_date,
+    iter_rows_roles_by_style)
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+log = logging.getLogger(app_name)
+
+
+def compare_rows_roles(book, sheet_name, durations):
+    """Return the (row index, role by date, role by style) triples of the rows classified differently.
+
+    The durations of the classifications are added to the durations dict, by classifier.
+    """
+    sheet = book.sheet_by_name(sheet_name)
+    merged_cells_tree = get_merged_cells_tree(sheet)
+    role_by_row_index_by_classifier = {}
+    for classifier in (iter_rows_roles_by_date, iter_rows_roles_by_style):
+        start_time = time.time()
+        role_by_row_index_by_classifier[classifier] = dict(
+            (row_index, role)
+            for role, row_index in classifier(book, sheet, merged_cells_tree)
+            )
+        durations[classifier.__name__] = durations.get(classifier.__name__, 0) + time.time() - start_time
+    role_by_row_index_by_date = role_by_row_index_by_classifier[iter_rows_roles_by_date]
+    role_by_row_index_by_style = role_by_row_index_by_classifier[iter_rows_roles_by_style]
+    book.unload_sheet(sheet_name)
+    return [
+        (row_index, role_by_row_index_by_date.get(row_index), role_by_row_index_by_style.get(row_index))
+        for row_index in sorted(set(role_by_row_index_by_date) | set(role_by_row_index_by_style))
+        if role_by_row_index_by_date.get(row_index) != role_by_row_index_by_style.get(row_index)
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--dir', default = 'Baremes_IPP', help = 'path of IPP XLS directory')
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stderr)
+
+    durations = {}
+    inconsistent_sheets_count = 0
+    sheets_count = 0
+    for xls_path in sorted(glob.glob(os.path.join(args.dir.decode('utf-8'), u'Baremes IPP - *.xls'))):
+        bareme = os.path.splitext(os.path.basename(xls_path))[0].split(u' - ', 1)[1]
+        log.info(u'Checking file {}'.format(bareme))
+        book = xlrd.open_workbook(filename = xls_path, formatting_info = True, on_demand = True)
+        for sheet_name in get_sheet_names(book, bareme):
+            sheets_count += 1
+            inconsistent_rows = compare_rows_roles(book, sheet_name, durations)
+            if not inconsistent_rows:
+                continue
+            inconsistent_sheets_count += 1
+            print u'{} / {}: {} inconsistent row(s)'.format(bareme, sheet_name, len(inconsistent_rows)).encode('utf-8')
+            for row_index, role_by_date, role_by_style in inconsistent_rows:
+                print u'  row {}: {} by date, {} by style'.format(row_index + 1, role_by_date or u'skipped',
+                    role_by_style or u'skipped').encode('utf-8')
+        book.release_resources()
+
+    print u'{} inconsistent sheet(s) out of {}'.format(inconsistent_sheets_count, sheets_count)
+    for classifier_name, duration in sorted(durations.iteritems()):
+        print u'{}: {:.3f} s'.format(classifier_name, duration)
+    return 1 if inconsistent_sheets_count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
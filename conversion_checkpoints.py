@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Per-sheet checkpoints of the conversion runs, to resume a run at the sheet that failed.
+
+Each checkpoint is the pickled result of the conversion of a sheet, stamped with the size and modification time of
+its workbook, so that the checkpoints of a modified workbook are ignored. The checkpoints are only needed to resume a
+failed run: they are removed at the end of a run without errors (see end_run).
+"""
+
+
+import cPickle as pickle
+import hashlib
+import logging
+import os
+import traceback
+
+
+log = logging.getLogger(__name__)
+
+
+def add_arguments(parser):
+    parser.add_argument('--checkpoints-dir',
+        help = 'path of the directory of the per-sheet checkpoints, removed after a run without errors (default: '
+            '.checkpoints in IPP XLS directory)')
+    parser.add_argument('-k', '--keep-going', action = 'store_true', default = False,
+        help = 'convert all the sheets and report all the errors, instead of stopping at the first error')
+    parser.add_argument('-r', '--resume', action = 'store_true', default = False,
+        help = 'reuse the checkpoints of the sheets converted by a previous run')
+
+
+def end_run(checkpoints_dir, keys, errors):
+    """Report the errors of a run and return its exit status.
+
+    When the run has no errors, the checkpoints of its steps (whose keys are given as a set) are removed.
+    """
+    status = report_errors(errors)
+    if not status:
+        remove_checkpoints(checkpoints_dir, keys)
+        keys.clear()
+    return status
+
+
+def get_checkpoint_path(checkpoints_dir, key):
+    return os.path.join(checkpoints_dir, hashlib.sha1(repr(key)).hexdigest() + '.pickle')
+
+
+def get_checkpoints_dir(args):
+    if args.checkpoints_dir is not None:
+        return args.checkpoints_dir
+    return os.path.join(args.dir, '.checkpoints')
+
+
+def get_file_stamp(file_path):
+    file_stat = os.stat(file_path)
+    return file_stat.st_size, file_stat.st_mtime
+
+
+def load_checkpoint(checkpoints_dir, key, stamp):
+    """Return a couple (found, result)."""
+    checkpoint_path = get_checkpoint_path(checkpoints_dir, key)
+    if not os.path.exists(checkpoint_path):
+        return False, None
+    with open(checkpoint_path, 'rb') as checkpoint_file:
+        checkpoint = pickle.load(checkpoint_file)
+    if checkpoint['key'] != key or checkpoint['stamp'] != stamp:
+        return False, None
+    return True, checkpoint['result']
+
+
+def remove_checkpoints(checkpoints_dir, keys):
+    """Remove the checkpoints of the given keys, and the checkpoints directory when it is left empty."""
+    for key in keys:
+        checkpoint_path = get_checkpoint_path(checkpoints_dir, key)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+    if os.path.isdir(checkpoints_dir) and not os.listdir(checkpoints_dir):
+        os.rmdir(checkpoints_dir)
+
+
+def report_errors(errors):
+    """Log the errors collected in keep-going mode and return the exit status of the run."""
+    for key, error in errors:
+        log.error(u'Conversion of {} failed:\n{}'.format(u' / '.join(key), error.decode('utf-8')))
+    if errors:
+        log.error(u'{} sheet(s) failed: {}'.format(len(errors), u', '.join(u' / '.join(key) for key, error in errors)))
+        return 1
+    return 0
+
+
+def run_step(checkpoints_dir, key, stamp, resume, errors, function, *args, **kwargs):
+    """Run the conversion of a sheet, or reuse its checkpoint when resuming.
+
+    When errors is a list (keep-going mode), an exception is added to it, instead of being raised, and the step
+    returns None.
+    """
+    if resume:
+        found, result = load_checkpoint(checkpoints_dir, key, stamp)
+        if found:
+            log.info(u'  Reusing checkpoint of {}'.format(u' / '.join(key)))
+            return result
+    try:
+        result = function(*args, **kwargs)
+    except Exception:
+        if errors is None:
+            raise
+        errors.append((key, traceback.format_exc()))
+        return None
+    save_checkpoint(checkpoints_dir, key, stamp, result)
+    return result
+
+
+def save_checkpoint(checkpoints_dir, key, stamp, result):
+    if not os.path.isdir(checkpoints_dir):
+        os.makedirs(checkpoints_dir)
+    checkpoint_path = get_checkpoint_path(checkpoints_dir, key)
+    # Write to a temporary file first, so that an interrupted run never leaves a truncated checkpoint.
+    temporary_path = checkpoint_path + '.tmp'
+    with open(temporary_path, 'wb') as checkpoint_file:
+        pickle.dump(dict(key = key, result = result, stamp = stamp), checkpoint_file, pickle.HIGHEST_PROTOCOL)
+    os.rename(temporary_path, checkpoint_path)
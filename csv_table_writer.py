@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Streaming CSV export of the aggregated tables, optionally compressed with gzip or zstd.
+
+The tables are rendered and written by chunks of rows, so that the CSV text of a whole table is never held in memory,
+whatever its horizon or its frequency. write_tables_csv writes tables whose chunks are themselves computed on the fly
+(see ipp_tables_aggregation.write_aggregated_tables).
+"""
+
+
+import contextlib
+import gzip
+import os
+
+
+default_chunk_rows = 240
+extension_by_compression = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+    }
+
+
+def get_output_path(file_path, compression = None):
+    return file_path + extension_by_compression[compression] if compression is not None else file_path
+
+
+@contextlib.contextmanager
+def open_csv_stream(file_path, compression = None):
+    """Open a binary stream writing to file_path, compressed with gzip or zstd when requested.
+
+    The gzip stream has no timestamp, so that the same content always gives the same file.
+    """
+    with open(file_path, 'wb') as output_file:
+        if compression is None:
+            yield output_file
+        elif compression == 'gzip':
+            with gzip.GzipFile(filename = os.path.basename(file_path), mode = 'wb', fileobj = output_file,
+                    mtime = 0) as gzip_file:
+                yield gzip_file
+        elif compression == 'zstd':
+            # zstandard is an optional dependency, needed only by this compression.
+            import zstandard
+            with zstandard.ZstdCompressor().stream_writer(output_file) as zstd_file:
+                yield zstd_file
+        else:
+            raise ValueError(u'Unknown compression: {}'.format(compression))
+
+
+@contextlib.contextmanager
+def open_csv_streams(file_paths, compression = None):
+    """Open the binary streams writing to several files (see open_csv_stream), as a list."""
+    if not file_paths:
+        yield []
+        return
+    with open_csv_stream(file_paths[0], compression = compression) as output_file:
+        with open_csv_streams(file_paths[1:], compression = compression) as other_output_files:
+            yield [output_file] + other_output_files
+
+
+def write_table_csv(data_frame, file_path, compression = None, chunk_rows = default_chunk_rows):
+    """Write a table to a CSV file, by chunks of rows, and return the path of the written file.
+
+    Without compression, the file is the same as the one written by data_frame.to_csv(file_path, encoding = 'utf-8').
+    """
+    output_path = get_output_path(file_path, compression = compression)
+    with open_csv_stream(output_path, compression = compression) as output_file:
+        write_table_chunks(data_frame, output_file, chunk_rows)
+    return output_path
+
+
+def write_table_chunks(data_frame, output_file, chunk_rows, header = True):
+    # Each chunk is rendered to UTF-8 text before being written, because pandas accepts only some kinds of streams.
+    for start in range(0, max(len(data_frame.index), 1), chunk_rows):
+        output_file.write(data_frame.iloc[start:start + chunk_rows].to_csv(None, encoding = 'utf-8',
+            header = header and start == 0))
+
+
+def write_tables_csv(tables_chunks, file_paths, compression = None, chunk_rows = default_chunk_rows):
+    """Write several tables to CSV files, from the chunks of rows of all the tables, and return the paths of the written
+    files.
+
+    tables_chunks is an iterable of lists of data frames, giving for each chunk its rows in every table (in the order
+    of file_paths). The chunks are written as soon as they are produced, so that the tables are never held in memory
+    whole.
+    """
+    output_paths = [get_output_path(file_path, compression = compression) for file_path in file_paths]
+    with open_csv_streams(output_paths, compression = compression) as output_files:
+        for chunk_index, tables_chunk in enumerate(tables_chunks):
+            for table_chunk, output_file in zip(tables_chunk, output_files):
+                write_table_chunks(table_chunk, output_file, chunk_rows, header = chunk_index == 0)
+    return output_paths
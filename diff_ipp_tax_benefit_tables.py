@@ -0,0 +1,233 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compare two releases (snapshot directories) of IPP's tax benefit tables.
+
+The comparison is done parameter by parameter (TAXIPP name), on the dated values and on their legislative references
+and JO publication dates. Identical workbooks and sheets are detected by their fingerprints and skipped without being
+parsed.
+"""
+
+
+import argparse
+import collections
+import glob
+import io
+import json
+import logging
+import os
+import sys
+
+import xlrd
+
+from ipp_tables_parsing import (compute_file_fingerprint, compute_series_fingerprint, compute_sheet_fingerprint,
+    get_sheet_names, iter_parameter_series, parse_sheet)
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+log = logging.getLogger(app_name)
+row_fields = (u'start_date', u'value', u'unit', u'law_reference', u'publication_date', u'notes')
+xls_prefix = u'Baremes IPP - '
+
+
+def diff_rows(old_rows, new_rows):
+    """Compare two lists of series rows, matching rows on their effective date."""
+    old_rows_by_key = index_rows(old_rows)
+    new_rows_by_key = index_rows(new_rows)
+    rows_diff = dict(
+        added = [
+            new_row
+            for key, new_row in new_rows_by_key.iteritems()
+            if key not in old_rows_by_key
+            ],
+        changed = [
+            (old_rows_by_key[key], new_row)
+            for key, new_row in new_rows_by_key.iteritems()
+            if key in old_rows_by_key and old_rows_by_key[key] != new_row
+            ],
+        removed = [
+            old_row
+            for key, old_row in old_rows_by_key.iteritems()
+            if key not in new_rows_by_key
+            ],
+        )
+    return rows_diff
+
+
+def diff_sheet_series(old_series_by_name, new_series_by_name):
+    changes = []
+    for taxipp_name in sorted(set(old_series_by_name) | set(new_series_by_name)):
+        old_series = old_series_by_name.get(taxipp_name)
+        new_series = new_series_by_name.get(taxipp_name)
+        if old_series is None:
+            changes.append(dict(status = u'added', rows = dict(added = new_series['rows']), series = new_series))
+        elif new_series is None:
+            changes.append(dict(status = u'removed', rows = dict(removed = old_series['rows']), series = old_series))
+        elif compute_series_fingerprint(old_series) != compute_series_fingerprint(new_series):
+            changes.append(dict(status = u'changed', rows = diff_rows(old_series['rows'], new_series['rows']),
+                series = new_series))
+    return changes
+
+
+def diff_snapshots(old_dir, new_dir):
+    """Compare two directories of IPP XLS files and return the list of changed parameters."""
+    old_xls_path_by_bareme = get_xls_path_by_bareme(old_dir)
+    new_xls_path_by_bareme = get_xls_path_by_bareme(new_dir)
+    changes = []
+    for bareme in sorted(set(old_xls_path_by_bareme) | set(new_xls_path_by_bareme)):
+        old_xls_path = old_xls_path_by_bareme.get(bareme)
+        new_xls_path = new_xls_path_by_bareme.get(bareme)
+        if old_xls_path is not None and new_xls_path is not None \
+                and compute_file_fingerprint(old_xls_path) == compute_file_fingerprint(new_xls_path):
+            log.info(u'Skipping unchanged file {}'.format(bareme))
+            continue
+        log.info(u'Comparing file {}'.format(bareme))
+        old_book = xlrd.open_workbook(filename = old_xls_path, formatting_info = True) \
+            if old_xls_path is not None else None
+        new_book = xlrd.open_workbook(filename = new_xls_path, formatting_info = True) \
+            if new_xls_path is not None else None
+        old_sheet_names = get_sheet_names(old_book, bareme) if old_book is not None else []
+        new_sheet_names = get_sheet_names(new_book, bareme) if new_book is not None else []
+        for sheet_name in old_sheet_names + [
+                sheet_name
+                for sheet_name in new_sheet_names
+                if sheet_name not in old_sheet_names
+                ]:
+            if sheet_name in old_sheet_names and sheet_name in new_sheet_names and compute_sheet_fingerprint(
+                    old_book, old_book.sheet_by_name(sheet_name)) == compute_sheet_fingerprint(
+                    new_book, new_book.sheet_by_name(sheet_name)):
+                log.info(u'  Skipping unchanged sheet {}'.format(sheet_name))
+                continue
+            log.info(u'  Comparing sheet {}'.format(sheet_name))
+            changes.extend(diff_sheet_series(
+                get_series_by_name(old_book, bareme, sheet_name) if sheet_name in old_sheet_names else {},
+                get_series_by_name(new_book, bareme, sheet_name) if sheet_name in new_sheet_names else {},
+                ))
+    return changes
+
+
+def get_series_by_name(book, bareme, sheet_name):
+    return collections.OrderedDict(
+        (series['taxipp_name'], series)
+        for series in iter_parameter_series(bareme, sheet_name, parse_sheet(book, sheet_name))
+        )
+
+
+def get_xls_path_by_bareme(directory):
+    xls_path_by_bareme = {}
+    for xls_path in glob.glob(os.path.join(directory, u'{}*.xls'.format(xls_prefix))):
+        bareme = os.path.splitext(os.path.basename(xls_path))[0][len(xls_prefix):]
+        xls_path_by_bareme[bareme] = xls_path
+    return xls_path_by_bareme
+
+
+def index_rows(rows):
+    """Key rows by effective date, numbering the rows that share the same effective date."""
+    row_by_key = collections.OrderedDict()
+    occurrences_by_date = collections.Counter()
+    for row in rows:
+        start_date = row[0]
+        row_by_key[(start_date, occurrences_by_date[start_date])] = row
+        occurrences_by_date[start_date] += 1
+    return row_by_key
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('old_dir', help = 'path of the IPP XLS directory of the old release')
+    parser.add_argument('new_dir', help = 'path of the IPP XLS directory of the new release')
+    parser.add_argument('-j', '--json', help = 'path of a JSON file where to write the differences')
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stdout)
+
+    changes = diff_snapshots(args.old_dir.decode('utf-8'), args.new_dir.decode('utf-8'))
+    for change in changes:
+        series = change['series']
+        print u'{} {} / {} / {}'.format(
+            {u'added': u'+', u'changed': u'~', u'removed': u'-'}[change['status']],
+            series['bareme'],
+            series['sheet_name'],
+            series['taxipp_name'],
+            ).encode('utf-8')
+        if change['status'] != u'changed':
+            continue
+        for old_row, new_row in change['rows']['changed']:
+            print u'    ~ {} -> {}'.format(row_to_unicode(old_row), row_to_unicode(new_row)).encode('utf-8')
+        for row in change['rows']['added']:
+            print u'    + {}'.format(row_to_unicode(row)).encode('utf-8')
+        for row in change['rows']['removed']:
+            print u'    - {}'.format(row_to_unicode(row)).encode('utf-8')
+
+    if args.json is not None:
+        with io.open(args.json, 'w', encoding = 'utf-8') as json_file:
+            json_file.write(unicode(json.dumps(
+                [
+                    collections.OrderedDict((
+                        (u'bareme', change['series']['bareme']),
+                        (u'sheet_name', change['series']['sheet_name']),
+                        (u'taxipp_name', change['series']['taxipp_name']),
+                        (u'status', change['status']),
+                        (u'rows', collections.OrderedDict(
+                            (key, [
+                                [row_to_json(row) for row in row_or_couple]
+                                    if key == u'changed'
+                                    else row_to_json(row_or_couple)
+                                for row_or_couple in rows
+                                ])
+                            for key, rows in sorted(change['rows'].iteritems())
+                            )),
+                        ))
+                    for change in changes
+                    ],
+                ensure_ascii = False,
+                indent = 2,
+                )))
+
+    return 0
+
+
+def row_to_json(row):
+    return collections.OrderedDict(
+        (field, value.isoformat() if field == u'start_date' else value)
+        for field, value in zip(row_fields, row)
+        )
+
+
+def row_to_unicode(row):
+    start_date, value, unit, law_reference, publication_date, notes = row
+    return u'{} {}{}{}{}{}'.format(
+        start_date.isoformat(),
+        value,
+        u' {}'.format(unit) if unit is not None else u'',
+        u' ({})'.format(law_reference) if law_reference is not None else u'',
+        u' [JO {}]'.format(publication_date) if publication_date not in (None, u'') else u'',
+        u' [notes: {}]'.format(notes) if notes not in (None, u'') else u'',
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Watch a directory for saved files, with inotify on Linux and by polling elsewhere.
+
+The changes are debounced: a batch of changed files is given only once no file has been saved during the debounce
+delay, so that the several writes of a single save (or of a burst of saves) trigger a single conversion.
+"""
+
+
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import logging
+import os
+import select
+import struct
+import time
+
+
+event_header_format = 'iIII'
+event_header_size = struct.calcsize(event_header_format)
+# inotify events of a file written & closed, or moved into the directory (editors saving to a temporary file first).
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+log = logging.getLogger(__name__)
+
+
+def get_files_stamps(directory, patterns):
+    files_stamps = {}
+    for filename in os.listdir(directory):
+        if any(fnmatch.fnmatch(filename, pattern) for pattern in patterns):
+            try:
+                file_stat = os.stat(os.path.join(directory, filename))
+            except OSError:
+                continue
+            files_stamps[filename] = file_stat.st_size, file_stat.st_mtime
+    return files_stamps
+
+
+def iter_changed_files(directory, patterns, debounce = 0.2):
+    """Iterate forever over the sets of the names of the files of directory matching patterns that have been saved.
+
+    inotify is used when available, otherwise the modification times of the files are polled every debounce delay.
+    """
+    inotify_fd = open_inotify(directory)
+    if inotify_fd is None:
+        log.info(u'inotify is not available: polling {}'.format(directory))
+        return iter_polled_changed_files(directory, patterns, debounce)
+    return iter_inotify_changed_files(inotify_fd, patterns, debounce)
+
+
+def iter_inotify_changed_files(inotify_fd, patterns, debounce):
+    try:
+        while True:
+            changed_filenames = set()
+            # Wait for a first event, then until no event occurs during the debounce delay.
+            timeout = None
+            while select.select([inotify_fd], [], [], timeout)[0]:
+                changed_filenames.update(
+                    filename
+                    for filename in read_inotify_filenames(inotify_fd)
+                    if any(fnmatch.fnmatch(filename, pattern) for pattern in patterns)
+                    )
+                if changed_filenames:
+                    timeout = debounce
+            yield changed_filenames
+    finally:
+        os.close(inotify_fd)
+
+
+def iter_polled_changed_files(directory, patterns, debounce):
+    files_stamps = get_files_stamps(directory, patterns)
+    changed_filenames = set()
+    while True:
+        time.sleep(debounce)
+        new_files_stamps = get_files_stamps(directory, patterns)
+        new_changed_filenames = set(
+            filename
+            for filename, stamp in new_files_stamps.iteritems()
+            if files_stamps.get(filename) != stamp
+            )
+        files_stamps = new_files_stamps
+        if new_changed_filenames:
+            changed_filenames.update(new_changed_filenames)
+        elif changed_filenames:
+            yield changed_filenames
+            changed_filenames = set()
+
+
+def open_inotify(directory):
+    """Return a file descriptor of the inotify events of directory, or None when inotify is not available."""
+    library_path = ctypes.util.find_library('c')
+    if library_path is None:
+        return None
+    libc = ctypes.CDLL(library_path, use_errno = True)
+    if not hasattr(libc, 'inotify_init'):
+        return None
+    inotify_fd = libc.inotify_init()
+    if inotify_fd < 0:
+        return None
+    if libc.inotify_add_watch(inotify_fd, os.path.abspath(directory).encode('utf-8') if isinstance(directory,
+            unicode) else os.path.abspath(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        os.close(inotify_fd)
+        raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), directory)
+    return inotify_fd
+
+
+def read_inotify_filenames(inotify_fd):
+    try:
+        buffer = os.read(inotify_fd, 64 * 1024)
+    except OSError as error:
+        if error.errno == errno.EINTR:
+            return []
+        raise
+    filenames = []
+    offset = 0
+    while offset < len(buffer):
+        watch_descriptor, mask, cookie, name_length = struct.unpack_from(event_header_format, buffer, offset)
+        offset += event_header_size
+        filenames.append(buffer[offset:offset + name_length].rstrip(b'\0').decode('utf-8'))
+        offset += name_length
+    return filenames
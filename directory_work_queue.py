@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Queue of work units in a directory, shared by worker processes running on any host that mounts it.
+
+The queue directory contains:
+- units/: a JSON file per published unit (its kind, key, arguments and the keys of the units it depends on), named by
+  the fingerprint of its key, so that publishing the same unit again is harmless (except that a failed unit is then
+  run again);
+- locks/: a lock file per unit being run, created exclusively (O_CREAT | O_EXCL) by the worker claiming the unit and
+  containing its id. The worker refreshes the modification time of the lock while it runs the unit;
+- results/: the pickled result of each unit done;
+- failures/: the traceback of each unit that failed.
+
+A unit is run once the units it depends on are done. A lock not refreshed for the lock timeout is considered left by a
+dead worker and is broken: the unit is then run again, so the units must be idempotent (their results are written to
+temporary files, then renamed).
+"""
+
+
+import cPickle as pickle
+import errno
+import glob
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+
+
+log = logging.getLogger(__name__)
+
+
+def acquire_lock(queue_dir, unit_id, worker_id, lock_timeout):
+    """Create the lock file of a unit and return True, or return False when the unit is locked by another worker."""
+    lock_path = os.path.join(queue_dir, 'locks', unit_id + '.lock')
+    try:
+        lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+        try:
+            lock_age = time.time() - os.stat(lock_path).st_mtime
+        except OSError:
+            # Lock released in the meantime: the unit will be claimed at the next scan.
+            return False
+        if lock_age < lock_timeout:
+            return False
+        # Break the stale lock. The rename fails for all the workers breaking it at the same time, but one.
+        stale_lock_path = u'{}.{}.stale'.format(lock_path, worker_id)
+        try:
+            os.rename(lock_path, stale_lock_path)
+        except OSError:
+            return False
+        # Between the stat and the rename, the lock may have been broken by another worker and created again: the lock
+        # actually renamed is checked again, and restored when it is alive.
+        if time.time() - os.stat(stale_lock_path).st_mtime < lock_timeout:
+            try:
+                os.link(stale_lock_path, lock_path)
+            except OSError as error:
+                # The unit has been locked again in the meantime.
+                if error.errno != errno.EEXIST:
+                    raise
+            os.remove(stale_lock_path)
+            return False
+        os.remove(stale_lock_path)
+        log.warning(u'Broke the lock of unit {}, left {:.0f} s ago'.format(unit_id, lock_age))
+        return acquire_lock(queue_dir, unit_id, worker_id, lock_timeout)
+    with os.fdopen(lock_fd, 'w') as lock_file:
+        lock_file.write(worker_id.encode('utf-8'))
+    return True
+
+
+def get_lock_owner(lock_path):
+    """Return the id of the worker holding a lock, or None when the lock doesn't exist."""
+    try:
+        with open(lock_path, 'rb') as lock_file:
+            return lock_file.read().decode('utf-8')
+    except IOError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return None
+
+
+def get_queue_status(queue_dir):
+    """Return the numbers of units done, failed, running and waiting."""
+    units_ids = set(iter_files_ids(queue_dir, 'units', '.json'))
+    done_ids = set(iter_files_ids(queue_dir, 'results', '.pickle')) & units_ids
+    failed_ids = (set(iter_files_ids(queue_dir, 'failures', '.txt')) & units_ids) - done_ids
+    running_ids = (set(iter_files_ids(queue_dir, 'locks', '.lock')) & units_ids) - done_ids - failed_ids
+    return dict(
+        done = len(done_ids),
+        failed = len(failed_ids),
+        running = len(running_ids),
+        waiting = len(units_ids - done_ids - failed_ids - running_ids),
+        )
+
+
+def get_unit_id(key):
+    return hashlib.sha1(json.dumps(key, sort_keys = True)).hexdigest()
+
+
+def iter_files_ids(queue_dir, subdir, extension):
+    for file_path in glob.iglob(os.path.join(queue_dir, subdir, '*' + extension)):
+        yield os.path.basename(file_path)[:-len(extension)]
+
+
+def load_result(queue_dir, unit_id):
+    with open(os.path.join(queue_dir, 'results', unit_id + '.pickle'), 'rb') as result_file:
+        return pickle.load(result_file)
+
+
+def load_units(queue_dir):
+    """Return the published units by id, sorted by key."""
+    units = []
+    for unit_path in glob.iglob(os.path.join(queue_dir, 'units', '*.json')):
+        with open(unit_path) as unit_file:
+            units.append(json.load(unit_file))
+    units.sort(key = lambda unit: json.dumps(unit['key'], sort_keys = True))
+    return [(get_unit_id(unit['key']), unit) for unit in units]
+
+
+def publish_units(queue_dir, units):
+    """Publish units, given as dicts with a kind, a key, the arguments of the unit and the keys of its dependencies
+    (after), and return their ids.
+    """
+    for subdir in ('failures', 'locks', 'results', 'units'):
+        if not os.path.isdir(os.path.join(queue_dir, subdir)):
+            os.makedirs(os.path.join(queue_dir, subdir))
+    units_ids = []
+    for unit in units:
+        unit_id = get_unit_id(unit['key'])
+        write_file_atomically(os.path.join(queue_dir, 'units', unit_id + '.json'),
+            json.dumps(unit, sort_keys = True))
+        # A unit that failed is run again when it is published again.
+        remove_file(os.path.join(queue_dir, 'failures', unit_id + '.txt'))
+        units_ids.append(unit_id)
+    return units_ids
+
+
+def refresh_lock(lock_path, worker_id, interval, stop):
+    """Refresh the modification time of a lock every interval seconds, until stop is set or the lock is lost."""
+    while not stop.wait(interval):
+        if get_lock_owner(lock_path) != worker_id:
+            log.warning(u'{} lost lock {}'.format(worker_id, lock_path))
+            return
+        try:
+            os.utime(lock_path, None)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            return
+
+
+def release_lock(lock_path, worker_id):
+    """Remove a lock, unless it has been broken and is now held by another worker."""
+    if get_lock_owner(lock_path) == worker_id:
+        remove_file(lock_path)
+
+
+def remove_file(file_path):
+    """Remove a file, if it exists."""
+    try:
+        os.remove(file_path)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+
+
+def remove_units(queue_dir, units_ids):
+    """Remove units from the queue, with their results & failures."""
+    for unit_id in units_ids:
+        for subdir, extension in (('units', '.json'), ('results', '.pickle'), ('failures', '.txt')):
+            file_path = os.path.join(queue_dir, subdir, unit_id + extension)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+
+def run_worker(queue_dir, run_unit, lock_timeout = 600, poll_interval = 1, worker_id = None):
+    """Run the units of a queue until all of them are done or failed, and return the numbers of units run by this
+    worker, as a (done, failed) couple.
+
+    run_unit(queue_dir, unit) returns the result of a unit.
+    """
+    if worker_id is None:
+        worker_id = u'{}-{}'.format(socket.gethostname().decode('utf-8'), os.getpid())
+    # Each worker scans the units from its own starting point, so that the workers start with different units (for
+    # example with the sheets of different workbooks) instead of contending for the same ones.
+    start = int(hashlib.sha1(worker_id.encode('utf-8')).hexdigest()[:8], 16)
+    done_count = 0
+    failed_count = 0
+    while True:
+        done_ids = set(iter_files_ids(queue_dir, 'results', '.pickle'))
+        failed_ids = set(iter_files_ids(queue_dir, 'failures', '.txt'))
+        remaining = False
+        progressed = False
+        units = load_units(queue_dir)
+        if units:
+            units = units[start % len(units):] + units[:start % len(units)]
+        for unit_id, unit in units:
+            if unit_id in done_ids or unit_id in failed_ids:
+                continue
+            dependencies_ids = [get_unit_id(key) for key in unit['after']]
+            if any(dependency_id in failed_ids for dependency_id in dependencies_ids):
+                write_file_atomically(os.path.join(queue_dir, 'failures', unit_id + '.txt'),
+                    b'A unit it depends on failed.\n')
+                failed_ids.add(unit_id)
+                continue
+            remaining = True
+            if not all(dependency_id in done_ids for dependency_id in dependencies_ids):
+                continue
+            if not acquire_lock(queue_dir, unit_id, worker_id, lock_timeout):
+                continue
+            lock_path = os.path.join(queue_dir, 'locks', unit_id + '.lock')
+            # The lock is refreshed while the unit runs, so that it is never broken because the unit runs longer than
+            # the lock timeout.
+            stop_refresh = threading.Event()
+            refresh_thread = threading.Thread(target = refresh_lock,
+                args = (lock_path, worker_id, lock_timeout / 4., stop_refresh))
+            refresh_thread.daemon = True
+            refresh_thread.start()
+            try:
+                # The unit may have been run by another worker between the scan and the lock.
+                if os.path.exists(os.path.join(queue_dir, 'results', unit_id + '.pickle')) \
+                        or os.path.exists(os.path.join(queue_dir, 'failures', unit_id + '.txt')):
+                    continue
+                log.info(u'{} runs unit {}'.format(worker_id, json.dumps(unit['key'])))
+                try:
+                    result = run_unit(queue_dir, unit)
+                except Exception:
+                    log.exception(u'Unit {} failed'.format(json.dumps(unit['key'])))
+                    write_file_atomically(os.path.join(queue_dir, 'failures', unit_id + '.txt'),
+                        traceback.format_exc())
+                    failed_ids.add(unit_id)
+                    failed_count += 1
+                else:
+                    write_file_atomically(os.path.join(queue_dir, 'results', unit_id + '.pickle'),
+                        pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+                    done_ids.add(unit_id)
+                    done_count += 1
+                progressed = True
+            finally:
+                stop_refresh.set()
+                refresh_thread.join()
+                release_lock(lock_path, worker_id)
+        if not remaining:
+            return done_count, failed_count
+        if not progressed:
+            # The remaining units are running or wait for running units.
+            time.sleep(poll_interval)
+
+
+def write_file_atomically(file_path, data):
+    temporary_path = u'{}.{}-{}.tmp'.format(file_path, socket.gethostname().decode('utf-8'), os.getpid())
+    with open(temporary_path, 'wb') as temporary_file:
+        temporary_file.write(data)
+    os.rename(temporary_path, file_path)
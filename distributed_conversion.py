@@ -0,0 +1,242 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Convert IPP's tax benefit tables of many releases with workers on several hosts, through a queue in a shared
+directory (see directory_work_queue).
+
+The work is split into units:
+- a unit per sheet of each workbook of each release (IPP XLS directory), converting the sheet to vectors;
+- a unit per workbook of each release, depending on the units of its sheets, writing its aggregated tables (one per
+  aggregation option, and per month for which_month_in_year) from a single aggregation cube. It merges the results of
+  the sheets in the order of the sheets of the workbook, whatever the workers that converted them, so that the tables
+  are the same as the ones of parse_ipp_tax_benefit_tables.
+
+The tables are written to <output dir>/<release directory name>/<bareme>_<option>[_<month>].csv.
+
+Examples:
+    # Publish the units of two releases, then run 4 workers on this host (and as many on other hosts).
+    python distributed_conversion.py -q /shared/queue -o /shared/outputs -p /shared/2015_03 -p /shared/2015_06 -w 0
+    python distributed_conversion.py -q /shared/queue -w 4
+"""
+
+
+import argparse
+import collections
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+
+import xlrd
+
+import conversion_checkpoints
+from csv_table_writer import extension_by_compression, get_output_path
+from directory_work_queue import (get_queue_status, get_unit_id, load_result, load_units, publish_units, remove_units,
+    run_worker)
+from ipp_tables_parsing import get_sheet_names
+import parse_ipp_tax_benefit_tables
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+# The workbooks opened by the sheet units of this process, with their stamps: a worker usually converts several
+# sheets of the same workbook in a row.
+book_and_stamp_by_xls_path = {}
+log = logging.getLogger(app_name)
+options = ['all_months', 'mean_by_year', 'which_month_in_year']
+
+
+def get_book(xls_path):
+    stamp = conversion_checkpoints.get_file_stamp(xls_path)
+    book, book_stamp = book_and_stamp_by_xls_path.get(xls_path, (None, None))
+    if book is None or book_stamp != stamp:
+        for other_book, other_stamp in book_and_stamp_by_xls_path.itervalues():
+            other_book.release_resources()
+        book_and_stamp_by_xls_path.clear()
+        book = xlrd.open_workbook(filename = xls_path, formatting_info = True, on_demand = True)
+        book_and_stamp_by_xls_path[xls_path] = book, stamp
+    return book
+
+
+def iter_release_units(directory, output_dir, target_options, months, compression):
+    """Iterate over the units converting a release (IPP XLS directory)."""
+    release_output_dir = os.path.join(output_dir, os.path.basename(os.path.normpath(directory)))
+    for bareme in parse_ipp_tax_benefit_tables.baremes:
+        xls_path = parse_ipp_tax_benefit_tables.get_xls_path(directory, bareme)
+        if not os.path.exists(xls_path):
+            continue
+        # The stamp of the workbook is a part of the keys, so that a modified workbook is converted again.
+        stamp = conversion_checkpoints.get_file_stamp(xls_path)
+        book = xlrd.open_workbook(filename = xls_path, on_demand = True)
+        sheets_keys = [
+            [u'sheet', directory, bareme, sheet_name, stamp]
+            for sheet_name in get_sheet_names(book, bareme)
+            ]
+        book.release_resources()
+        for sheet_key in sheets_keys:
+            yield dict(
+                after = [],
+                args = dict(bareme = bareme, sheet_name = sheet_key[3], stamp = stamp, xls_path = xls_path),
+                key = sheet_key,
+                kind = u'sheet',
+                )
+        outputs = [
+            [option, month or 1, os.path.join(release_output_dir, u'{}_{}{}.csv'.format(bareme, option,
+                u'_{}'.format(month) if month is not None else u''))]
+            for option in target_options
+            for month in (months if option == 'which_month_in_year' else [None])
+            ]
+        yield dict(
+            after = sheets_keys,
+            args = dict(compression = compression, outputs = outputs),
+            key = [u'tables', directory, bareme, stamp, compression, outputs],
+            kind = u'tables',
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--compression', choices = sorted(extension_by_compression),
+        help = 'compress the CSV tables (zstd requires the zstandard package)')
+    parser.add_argument('--lock-timeout', default = 600, type = float,
+        help = 'age of a lock after which its worker is considered dead and its unit run again (in seconds)')
+    parser.add_argument('-m', '--month', action = 'append', dest = 'months', type = int,
+        help = 'month of the which_month_in_year tables (can be repeated, default: every month)')
+    parser.add_argument('-o', '--output-dir', default = 'outputs', help = 'path of the directory of the tables')
+    parser.add_argument('-O', '--option', action = 'append', choices = options, dest = 'options',
+        help = 'aggregation option of the tables (can be repeated, default: {})'.format(u', '.join(options)))
+    parser.add_argument('-p', '--publish', action = 'append', default = [],
+        help = 'path of an IPP XLS directory (release) whose conversion units are added to the queue (can be '
+            'repeated)')
+    parser.add_argument('-q', '--queue-dir', default = 'ipp_work_queue',
+        help = 'path of the queue directory, shared by the workers of all the hosts')
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    parser.add_argument('-w', '--workers', default = 1, type = int,
+        help = 'number of worker processes to run on this host (0 to only publish units)')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stderr)
+
+    queue_dir = os.path.abspath(args.queue_dir).decode('utf-8')
+    for directory in args.publish:
+        directory = os.path.abspath(directory).decode('utf-8')
+        units = list(iter_release_units(directory, os.path.abspath(args.output_dir).decode('utf-8'),
+            args.options or options, args.months or range(1, 13), args.compression))
+        units_ids = publish_units(queue_dir, units)
+        # The units of a previous publication of the release (for example before a workbook was modified) are replaced.
+        remove_units(queue_dir, [
+            unit_id
+            for unit_id, unit in load_units(queue_dir)
+            if unit['key'][1] == directory and unit_id not in units_ids
+            ])
+        print u'{} unit(s) published for {}'.format(len(units), directory).encode('utf-8')
+
+    if not os.path.isdir(queue_dir):
+        print >> sys.stderr, u'No queue in {}'.format(queue_dir).encode('utf-8')
+        return 1
+    if args.workers > 0:
+        worker_args = (queue_dir, args.lock_timeout)
+        if args.workers == 1:
+            counts = [run_worker_process(worker_args)]
+        else:
+            pool = multiprocessing.Pool(args.workers)
+            try:
+                counts = pool.map(run_worker_process, [worker_args] * args.workers)
+            finally:
+                pool.terminate()
+                pool.join()
+        print u'{} unit(s) done and {} failed by {} worker(s) on this host'.format(
+            sum(done_count for done_count, failed_count in counts),
+            sum(failed_count for done_count, failed_count in counts),
+            args.workers,
+            )
+
+    status = get_queue_status(queue_dir)
+    print u'Queue: {done} done, {failed} failed, {running} running, {waiting} waiting'.format(**status)
+    return 1 if status['failed'] else 0
+
+
+def run_tables_unit(queue_dir, unit):
+    """Merge the results of the sheets of a workbook, in the order of its sheets, and write its aggregated tables."""
+    from ipp_tables_aggregation import write_aggregated_tables
+
+    series_by_taxipp_name = collections.OrderedDict()
+    vector_by_taxipp_name = {}
+    for sheet_key in unit['after']:
+        sheet_series_list, sheet_vectors = load_result(queue_dir, get_unit_id(sheet_key))
+        for series in sheet_series_list:
+            series_by_taxipp_name[series['taxipp_name']] = series
+        for taxipp_name, vector in sheet_vectors:
+            vector_by_taxipp_name[taxipp_name] = vector
+    compression = unit['args']['compression']
+    outputs = unit['args']['outputs']
+    for output_dir in set(os.path.dirname(file_path) for option, month, file_path in outputs):
+        if not os.path.isdir(output_dir):
+            try:
+                os.makedirs(output_dir)
+            except OSError:
+                # Created by another worker in the meantime.
+                if not os.path.isdir(output_dir):
+                    raise
+    # The tables are written to temporary files, then renamed, in case a worker breaking a stale lock writes them too.
+    # As in write_file_atomically, the temporary files are named after the host and the process, the workers of several
+    # hosts sharing the output directory.
+    worker_suffix = u'{}-{}'.format(socket.gethostname().decode('utf-8'), os.getpid())
+    temporary_paths = write_aggregated_tables(
+        vector_by_taxipp_name,
+        [
+            (option, month, u'{}.{}.tmp'.format(file_path, worker_suffix))
+            for option, month, file_path in outputs
+            ],
+        series_list = series_by_taxipp_name.values(),
+        compression = compression,
+        )
+    output_paths = []
+    for temporary_path, (option, month, file_path) in zip(temporary_paths, outputs):
+        output_path = get_output_path(file_path, compression = compression)
+        os.rename(temporary_path, output_path)
+        output_paths.append(output_path)
+    return output_paths
+
+
+def run_unit(queue_dir, unit):
+    if unit['kind'] == u'sheet':
+        from ipp_tables_aggregation import convert_sheet_to_vectors
+        args = unit['args']
+        if list(conversion_checkpoints.get_file_stamp(args['xls_path'])) != list(args['stamp']):
+            raise ValueError(u'Workbook {} modified since its units were published'.format(args['xls_path']))
+        return convert_sheet_to_vectors(get_book(args['xls_path']), args['bareme'], args['sheet_name'])
+    if unit['kind'] == u'tables':
+        return run_tables_unit(queue_dir, unit)
+    raise ValueError(u'Unknown kind of unit: {}'.format(unit['kind']))
+
+
+def run_worker_process(worker_args):
+    queue_dir, lock_timeout = worker_args
+    return run_worker(queue_dir, run_unit, lock_timeout = lock_timeout)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Enrich a microdata CSV file with the parameters of IPP's tax benefit tables in effect at the date of each row.
+
+The file is read and written by chunks of rows, so that files of any size can be enriched with a bounded memory. For
+each row, the value of each selected parameter is the one in effect at the date of the row (an "as-of" lookup on the
+exact effective dates of the parameter series, not on a monthly grid), or empty before the first known value.
+
+Example: python enrich_microdata.py -d Baremes_IPP -p 'txmarg*' -i survey.csv.gz -o enriched.csv.gz -c gzip
+"""
+
+
+import argparse
+import collections
+import datetime
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from csv_table_writer import extension_by_compression, open_csv_stream
+from extract_ipp_parameters import extract_parameter_series
+from ipp_tables_aggregation import get_series_change_points, get_values_as_of
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+epoch_ordinal = datetime.date(1970, 1, 1).toordinal()
+log = logging.getLogger(app_name)
+
+
+def enrich_chunk(chunk, date_column, change_points_by_name):
+    """Add to a chunk of microdata a column for each parameter, with its value at the date of each row."""
+    dates = pd.to_datetime(chunk[date_column], errors = 'coerce')
+    known = dates.notnull().values
+    # Days since 1970-01-01 of the NaT dates are meaningless: their lookups are masked below.
+    ordinals = dates.values.astype('datetime64[D]').astype(np.int64) + epoch_ordinal
+    for taxipp_name, (change_ordinals, change_values) in change_points_by_name.iteritems():
+        chunk[taxipp_name.encode('utf-8')] = np.where(known,
+            get_values_as_of(change_ordinals, change_values, ordinals), np.nan)
+    return chunk
+
+
+def get_change_points_by_name(series_list):
+    change_points_by_name = collections.OrderedDict()
+    for series in series_list:
+        taxipp_name = series['taxipp_name']
+        if taxipp_name in change_points_by_name:
+            log.warning(u'Parameter {} is defined several times: using the one of {} / {}'.format(taxipp_name,
+                series['bareme'], series['sheet_name']))
+        change_points_by_name[taxipp_name] = get_series_change_points(series)
+    return change_points_by_name
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--compression', choices = sorted(extension_by_compression),
+        help = 'compress the enriched CSV file (zstd requires the zstandard package)')
+    parser.add_argument('--chunk-rows', default = 100000, type = int, help = 'number of rows read & written at once')
+    parser.add_argument('-d', '--dir', default = 'Baremes_IPP', help = 'path of IPP XLS directory')
+    parser.add_argument('--date-column', default = 'date', help = 'name of the column giving the date of each row')
+    parser.add_argument('-i', '--input', required = True,
+        help = 'path of the microdata CSV file (compression inferred from its extension)')
+    parser.add_argument('-o', '--output', required = True, help = 'path of the enriched CSV file to write')
+    parser.add_argument('-p', '--params', action = 'append', default = [], required = True,
+        help = 'TAXIPP name or glob pattern of the parameters to add (can be repeated)')
+    parser.add_argument('-s', '--sheets', action = 'append', default = [],
+        help = 'name or glob pattern of the sheets of the parameters (can be repeated)')
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stderr)
+
+    series_list = extract_parameter_series(
+        args.dir.decode('utf-8'),
+        params = [pattern.decode('utf-8') for pattern in args.params],
+        sheets = [pattern.decode('utf-8') for pattern in args.sheets],
+        )
+    change_points_by_name = get_change_points_by_name(series_list)
+    if not change_points_by_name:
+        log.error(u'No parameter matches {}'.format(u', '.join(pattern.decode('utf-8') for pattern in args.params)))
+        return 1
+
+    rows_count = 0
+    start_time = time.time()
+    with open_csv_stream(args.output, compression = args.compression) as output_file:
+        # The cells are kept as UTF-8 byte strings, from reading to writing: decoding them would only slow the run.
+        for chunk_index, chunk in enumerate(pd.read_csv(args.input, chunksize = args.chunk_rows,
+                compression = 'infer')):
+            enrich_chunk(chunk, args.date_column, change_points_by_name)
+            output_file.write(chunk.to_csv(None, header = chunk_index == 0, index = False))
+            rows_count += len(chunk.index)
+            log.info(u'{} rows enriched'.format(rows_count))
+    duration = time.time() - start_time
+    print >> sys.stderr, u'{} rows enriched with {} parameters in {:.1f} s ({:.0f} rows/s)'.format(rows_count,
+        len(change_points_by_name), duration, rows_count / duration if duration > 0 else 0).encode('utf-8')
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Extract a selection of parameters from IPP's tax benefit tables, without parsing whole workbooks.
+
+The selection is done by TAXIPP names and/or sheet names (glob patterns are accepted). It relies on an index
+(TAXIPP name -> workbook, sheet, column), persisted in the IPP XLS directory and rebuilt only for the workbooks that
+changed, to open only the needed sheets and decode only the needed columns.
+
+Examples:
+    python extract_ipp_parameters.py -d Baremes_IPP -p 'txmarg*' -p 'plaf_qf_*'
+    python extract_ipp_parameters.py -d Baremes_IPP -f sqlite -o ipp_parameters.sqlite
+"""
+
+
+import argparse
+import collections
+import csv
+import fnmatch
+import glob
+import io
+import json
+import logging
+import os
+import sys
+
+import xlrd
+
+from ipp_tables_parsing import (compute_file_fingerprint, get_column_roles, get_sheet_names, iter_parameter_series,
+    parse_sheet)
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+index_file_name = u'ipp_parameters_index.json'
+log = logging.getLogger(app_name)
+xls_prefix = u'Baremes IPP - '
+
+
+def build_workbook_index(xls_path, bareme):
+    book = xlrd.open_workbook(filename = xls_path, formatting_info = True, on_demand = True)
+    sheet_index_by_name = collections.OrderedDict()
+    for sheet_name in get_sheet_names(book, bareme):
+        parsed_sheet = parse_sheet(book, sheet_name, column_indexes = ())
+        sheet_index_by_name[sheet_name] = dict(
+            roles = get_column_roles(parsed_sheet),
+            taxipp_names = parsed_sheet['taxipp_names_row'] or [],
+            )
+        book.unload_sheet(sheet_name)
+    book.release_resources()
+    return sheet_index_by_name
+
+
+def extract_parameter_series(directory, params = None, sheets = None):
+    """Extract the parameter series matching TAXIPP name patterns and/or sheet name patterns."""
+    index = load_index(directory)
+    series_list = []
+    for bareme, workbook_index in sorted(index['workbooks'].iteritems()):
+        selected_column_indexes_by_sheet_name = collections.OrderedDict()
+        for sheet_name, sheet_index in workbook_index['sheets'].iteritems():
+            if sheets and not matches_any(sheet_name, sheets):
+                continue
+            selected_column_indexes = set(
+                column_index
+                for column_index, (taxipp_name, role) in enumerate(zip(sheet_index['taxipp_names'],
+                    sheet_index['roles']))
+                if role == u'parameter' and (not params or matches_any(taxipp_name, params))
+                )
+            if selected_column_indexes:
+                selected_column_indexes_by_sheet_name[sheet_name] = selected_column_indexes
+        if not selected_column_indexes_by_sheet_name:
+            continue
+        log.info(u'Opening file {}'.format(bareme))
+        book = xlrd.open_workbook(filename = workbook_index['xls_path'], formatting_info = True, on_demand = True)
+        for sheet_name, selected_column_indexes in selected_column_indexes_by_sheet_name.iteritems():
+            log.info(u'  Parsing sheet {}'.format(sheet_name))
+            roles = workbook_index['sheets'][sheet_name]['roles']
+            # Effective dates are in the first two columns, references, JO dates & notes in the metadata columns.
+            column_indexes = selected_column_indexes | set([0, 1]) | set(
+                column_index
+                for column_index, role in enumerate(roles)
+                if role not in (None, u'parameter')
+                )
+            parsed_sheet = parse_sheet(book, sheet_name, column_indexes = column_indexes)
+            taxipp_names = set(
+                workbook_index['sheets'][sheet_name]['taxipp_names'][column_index]
+                for column_index in selected_column_indexes
+                )
+            series_list.extend(
+                series
+                for series in iter_parameter_series(bareme, sheet_name, parsed_sheet)
+                if series['taxipp_name'] in taxipp_names
+                )
+            book.unload_sheet(sheet_name)
+        book.release_resources()
+    return series_list
+
+
+def load_index(directory, rebuild = False):
+    """Load the index of the IPP XLS directory, updating the entries of the workbooks that changed."""
+    index_path = os.path.join(directory, index_file_name)
+    index = None
+    if not rebuild and os.path.exists(index_path):
+        with io.open(index_path, encoding = 'utf-8') as index_file:
+            index = json.load(index_file, object_pairs_hook = collections.OrderedDict)
+    if index is None:
+        index = dict(workbooks = {})
+    changed = False
+    xls_path_by_bareme = dict(
+        (os.path.splitext(os.path.basename(xls_path))[0][len(xls_prefix):], xls_path)
+        for xls_path in glob.glob(os.path.join(directory, u'{}*.xls'.format(xls_prefix)))
+        )
+    for bareme in list(index['workbooks']):
+        if bareme not in xls_path_by_bareme:
+            del index['workbooks'][bareme]
+            changed = True
+    for bareme, xls_path in sorted(xls_path_by_bareme.iteritems()):
+        fingerprint = compute_file_fingerprint(xls_path)
+        workbook_index = index['workbooks'].get(bareme)
+        if workbook_index is not None and workbook_index['fingerprint'] == fingerprint:
+            workbook_index['xls_path'] = xls_path
+            continue
+        log.info(u'Indexing file {}'.format(bareme))
+        index['workbooks'][bareme] = dict(
+            fingerprint = fingerprint,
+            sheets = build_workbook_index(xls_path, bareme),
+            xls_path = xls_path,
+            )
+        changed = True
+    if changed:
+        with io.open(index_path, 'w', encoding = 'utf-8') as index_file:
+            index_file.write(unicode(json.dumps(index, ensure_ascii = False, indent = 2)))
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--dir', default = 'Baremes_IPP', help = 'path of IPP XLS directory')
+    parser.add_argument('-f', '--format', choices = ['csv', 'sqlite'], default = 'csv',
+        help = 'format of the output: CSV, or an indexed SQLite database (see sqlite_parameter_export)')
+    parser.add_argument('-o', '--output',
+        help = 'path of the file to write (default: standard output, for the CSV format only)')
+    parser.add_argument('-p', '--params', action = 'append', default = [],
+        help = 'TAXIPP name or glob pattern of the parameters to extract (can be repeated)')
+    parser.add_argument('-r', '--rebuild-index', action = 'store_true', default = False,
+        help = 'rebuild the index of the parameters from scratch')
+    parser.add_argument('-s', '--sheets', action = 'append', default = [],
+        help = 'name or glob pattern of the sheets to extract (can be repeated)')
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stderr)
+
+    directory = args.dir.decode('utf-8')
+    if args.rebuild_index:
+        load_index(directory, rebuild = True)
+    series_list = extract_parameter_series(
+        directory,
+        params = [pattern.decode('utf-8') for pattern in args.params],
+        sheets = [pattern.decode('utf-8') for pattern in args.sheets],
+        )
+    if args.format == 'sqlite':
+        if args.output is None:
+            parser.error(u'Option --output is required by the SQLite format')
+        from sqlite_parameter_export import write_parameter_database
+        write_parameter_database(args.output, series_list)
+        return 0
+    output_file = open(args.output, 'wb') if args.output is not None else sys.stdout
+    try:
+        write_series_csv(output_file, series_list)
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    return 0
+
+
+def matches_any(name, patterns):
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def write_series_csv(output_file, series_list):
+    writer = csv.writer(output_file)
+    writer.writerow(['bareme', 'sheet', 'taxipp_name', 'start_date', 'value', 'unit', 'law_reference',
+        'publication_date', 'notes'])
+    for series in series_list:
+        for start_date, value, unit, law_reference, publication_date, notes in series['rows']:
+            writer.writerow([
+                (cell.isoformat() if hasattr(cell, 'isoformat') else unicode(cell) if cell is not None else u'').encode(
+                    'utf-8')
+                for cell in (series['bareme'], series['sheet_name'], series['taxipp_name'], start_date, value, unit,
+                    law_reference, publication_date, notes)
+                ])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compiled schedules of the income tax, from the bracket parameters of the "Impot Revenu" table.
+
+The thresholds (tranche1, tranche2...), the marginal rates (txmarg1, txmarg2...) and the number of brackets
+(ntranche) of the "Barème IR" sheet are compiled once into a schedule per period, where the tax due at each threshold
+is precomputed. Evaluating the tax of an array of incomes is then a single searchsorted followed by array arithmetic.
+
+The décote and quotient familial cap parameters (param_decote, plaf_qf...) are compiled per period with the schedules,
+but their rules, which change with the years, are left to the callers.
+
+Amounts in FRF are converted to euros.
+"""
+
+
+import argparse
+import collections
+import datetime
+import logging
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+from extract_ipp_parameters import extract_parameter_series
+from ipp_tables_aggregation import get_series_change_points, get_values_as_of
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+bracket_name_re = re.compile(ur'(?P<kind>tranche|txmarg)(?P<number>\d+)$')
+log = logging.getLogger(app_name)
+schedule_params = [u'ntranche', u'tranche*', u'txmarg*', u'param_decote', u'plaf_qf*']
+schedule_sheets = [u'Barème IR', u'plaf_qf']
+
+
+def compile_income_tax_schedules(series_list):
+    """Compile the parameter series of the income tax into schedules by period.
+
+    The returned schedules contain:
+    - starts: the sorted start dates of the periods, as ordinals; a period lasts until the start of the next one;
+    - brackets_counts: the number of brackets of each period;
+    - thresholds, rates & base_taxes: arrays of shape (periods count, brackets count max) giving for each bracket its
+      lower threshold, its marginal rate and the tax due at its lower threshold. The unused brackets of a period have
+      an infinite threshold;
+    - parameters: the values by period of the other parameters (param_decote, plaf_qf...), by TAXIPP name.
+    """
+    change_points_by_bracket_by_kind = dict(tranche = {}, txmarg = {})
+    brackets_count_change_points = None
+    change_points_by_name = collections.OrderedDict()
+    for series in series_list:
+        taxipp_name = series['taxipp_name']
+        match = bracket_name_re.match(taxipp_name)
+        if match is not None:
+            change_points_by_bracket_by_kind[match.group('kind')][int(match.group('number'))] = \
+                get_series_change_points(series)
+        elif taxipp_name == u'ntranche':
+            brackets_count_change_points = get_series_change_points(series)
+        else:
+            change_points_by_name[taxipp_name] = get_series_change_points(series)
+    assert change_points_by_bracket_by_kind['tranche'] and change_points_by_bracket_by_kind['txmarg'], \
+        u'Missing thresholds or rates of the income tax brackets'
+    brackets_numbers = sorted(set(change_points_by_bracket_by_kind['tranche']) & set(
+        change_points_by_bracket_by_kind['txmarg']))
+
+    brackets_ordinals = np.concatenate([
+        ordinals
+        for change_points_by_bracket in change_points_by_bracket_by_kind.itervalues()
+        for ordinals, values in change_points_by_bracket.itervalues()
+        ])
+    # A period starts whenever a parameter of the schedules changes, including the number of brackets and the other
+    # parameters, from the first brackets on.
+    changes_ordinals = [brackets_ordinals]
+    changes_ordinals.extend(ordinals for ordinals, values in change_points_by_name.itervalues())
+    if brackets_count_change_points is not None:
+        changes_ordinals.append(brackets_count_change_points[0])
+    starts = np.unique(np.concatenate(changes_ordinals))
+    starts = starts[starts >= brackets_ordinals.min()]
+
+    def get_values_at_starts(change_points):
+        ordinals, values = change_points
+        return get_values_as_of(ordinals, values, starts)
+
+    thresholds = np.column_stack([
+        get_values_at_starts(change_points_by_bracket_by_kind['tranche'][number])
+        for number in brackets_numbers
+        ])
+    rates = np.column_stack([
+        get_values_at_starts(change_points_by_bracket_by_kind['txmarg'][number])
+        for number in brackets_numbers
+        ])
+    if brackets_count_change_points is not None:
+        brackets_counts = get_values_at_starts(brackets_count_change_points)
+    else:
+        brackets_counts = np.full(len(starts), np.nan)
+    # Without a number of brackets, the brackets are the leading ones with increasing thresholds.
+    increasing = np.cumprod(np.concatenate([
+        ~np.isnan(thresholds[:, :1]),
+        thresholds[:, 1:] > thresholds[:, :-1],
+        ], axis = 1), axis = 1)
+    brackets_counts = np.where(np.isnan(brackets_counts), increasing.sum(axis = 1), brackets_counts).astype(np.int64)
+    brackets_counts = np.minimum(brackets_counts, len(brackets_numbers))
+
+    used = np.arange(len(brackets_numbers)) < brackets_counts[:, np.newaxis]
+    brackets_widths = np.where(used[:, 1:], np.nan_to_num(thresholds[:, 1:] - thresholds[:, :-1]), 0.)
+    thresholds = np.where(used, thresholds, np.inf)
+    rates = np.where(used, np.nan_to_num(rates), 0.)
+    # Tax due at the lower threshold of each bracket: sum of the full lower brackets.
+    base_taxes = np.concatenate([
+        np.zeros((len(starts), 1)),
+        np.cumsum(rates[:, :-1] * brackets_widths, axis = 1),
+        ], axis = 1)
+
+    return dict(
+        base_taxes = base_taxes,
+        brackets_counts = brackets_counts,
+        parameters = collections.OrderedDict(
+            (taxipp_name, get_values_at_starts(change_points))
+            for taxipp_name, change_points in change_points_by_name.iteritems()
+            ),
+        rates = rates,
+        starts = starts,
+        thresholds = thresholds,
+        )
+
+
+def compute_income_tax(schedules, incomes, date, parts = None):
+    """Compute the income tax of an array of taxable incomes, with the schedule in effect at a date.
+
+    When parts (number of parts of quotient familial, scalar or array) is given, the tax is the tax of the income by
+    part, multiplied by the number of parts.
+    """
+    period_index = get_period_index(schedules, date)
+    brackets_count = schedules['brackets_counts'][period_index]
+    thresholds = schedules['thresholds'][period_index, :brackets_count]
+    incomes = np.asarray(incomes, dtype = float)
+    if parts is not None:
+        incomes = incomes / parts
+    indexes = np.maximum(np.searchsorted(thresholds, incomes, side = 'right') - 1, 0)
+    taxes = schedules['base_taxes'][period_index, indexes] + schedules['rates'][period_index, indexes] * np.maximum(
+        incomes - thresholds[indexes], 0.)
+    return taxes * parts if parts is not None else taxes
+
+
+def compute_income_tax_at_dates(schedules, incomes, dates, parts = None):
+    """Compute the income tax of an array of taxable incomes, each one with the schedule in effect at its date.
+
+    dates is an array of ordinals. The brackets of the incomes are found by comparing them to all the thresholds of
+    their periods at once, instead of running a searchsorted per period.
+    """
+    period_indexes = np.searchsorted(schedules['starts'], dates, side = 'right') - 1
+    assert (period_indexes >= 0).all(), u'No income tax schedule before {}'.format(
+        datetime.date.fromordinal(schedules['starts'][0]))
+    thresholds = schedules['thresholds'][period_indexes]
+    incomes = np.asarray(incomes, dtype = float)
+    if parts is not None:
+        incomes = incomes / parts
+    indexes = np.maximum((thresholds <= incomes[:, np.newaxis]).sum(axis = 1) - 1, 0)
+    taxes = schedules['base_taxes'][period_indexes, indexes] + schedules['rates'][period_indexes, indexes] \
+        * np.maximum(incomes - thresholds[np.arange(len(incomes)), indexes], 0.)
+    return taxes * parts if parts is not None else taxes
+
+
+def get_period_index(schedules, date):
+    period_index = np.searchsorted(schedules['starts'], date.toordinal(), side = 'right') - 1
+    assert period_index >= 0, u'No income tax schedule at {}'.format(date)
+    return period_index
+
+
+def load_income_tax_schedules(directory):
+    return compile_income_tax_schedules(extract_parameter_series(directory, params = schedule_params,
+        sheets = schedule_sheets))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--dir', default = 'Baremes_IPP', help = 'path of IPP XLS directory')
+    parser.add_argument('-n', '--incomes-count', default = 1000000, type = int,
+        help = 'number of random incomes whose tax is computed, to measure the evaluation speed')
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    parser.add_argument('date', help = 'date of the schedule (YYYY-MM-DD)')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stderr)
+
+    date = datetime.datetime.strptime(args.date, '%Y-%m-%d').date()
+    schedules = load_income_tax_schedules(args.dir.decode('utf-8'))
+    period_index = get_period_index(schedules, date)
+    print u'Income tax schedule from {}:'.format(datetime.date.fromordinal(schedules['starts'][period_index]))
+    for threshold, rate, base_tax in zip(
+            *(schedules[key][period_index, :schedules['brackets_counts'][period_index]]
+                for key in ('thresholds', 'rates', 'base_taxes'))):
+        print u'  from {:>12.2f} EUR: {:6.2%} (tax due at threshold: {:.2f} EUR)'.format(threshold, rate, base_tax)
+    for taxipp_name, values in schedules['parameters'].iteritems():
+        print u'  {}: {}'.format(taxipp_name, values[period_index])
+
+    incomes = np.random.RandomState(0).lognormal(10, 1, args.incomes_count)
+    start_time = time.time()
+    compute_income_tax(schedules, incomes, date, parts = 1.)
+    duration = time.time() - start_time
+    print u'Tax of {} incomes computed in {:.3f} s'.format(args.incomes_count, duration)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Store of the successive releases (snapshot directories) of IPP's tax benefit tables, to query the value of a
+parameter at an effective date, as given by a past release.
+
+The store is a directory:
+- objects/: the rows of the parameter series, as JSON files named by the fingerprints of the series (see
+  compute_series_fingerprint). A series unchanged between releases is stored once.
+- releases/: a manifest per release, named by the release date. It gives, for each workbook and sheet, its
+  fingerprint and the (TAXIPP name, series fingerprint, title) of its parameters.
+
+When a release is ingested, the workbooks and the sheets whose fingerprints are found in the manifest of a previous
+release are not parsed. The queries read only the manifests and the objects of the requested series.
+
+Examples:
+    python ipp_releases_store.py -s releases_store -i Baremes_IPP -r 2015-03-01
+    python ipp_releases_store.py -s releases_store -p plaf_qf -e 2014-06-01 -a 2015-04-01
+"""
+
+
+import argparse
+import bisect
+import collections
+import datetime
+import glob
+import io
+import json
+import logging
+import os
+import sys
+
+import xlrd
+
+from diff_ipp_tax_benefit_tables import row_fields, row_to_json
+from ipp_tables_parsing import (compute_file_fingerprint, compute_series_fingerprint, compute_sheet_fingerprint,
+    get_sheet_names, iter_parameter_series, parse_sheet)
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+log = logging.getLogger(app_name)
+xls_prefix = u'Baremes IPP - '
+
+
+def get_release(store, as_of = None):
+    """Return the manifest of the latest release published at as_of (a date), or of the latest release."""
+    releases = store['releases']
+    if as_of is None:
+        return releases[-1] if releases else None
+    release_index = bisect.bisect_right(store['release_dates'], as_of.isoformat())
+    return releases[release_index - 1] if release_index > 0 else None
+
+
+def get_row_at(rows, effective_date):
+    """Return the row of a series in force at effective_date, or None.
+
+    When a date is repeated, the last row of the sheet wins, as in the aggregated tables.
+    """
+    row_at = None
+    for row in rows:
+        if row[0] <= effective_date and (row_at is None or row[0] >= row_at[0]):
+            row_at = row
+    return row_at
+
+
+def ingest_release(store_dir, directory, release_date):
+    """Add the IPP XLS directory of the release published at release_date (a date) to the store.
+
+    An existing release with the same date is replaced.
+    """
+    store = load_store(store_dir)
+    # The workbooks & sheets of the previous releases, by fingerprint.
+    known_workbook_by_key = {}
+    known_sheet_by_key = {}
+    for release in store['releases']:
+        for bareme, workbook in release['workbooks'].iteritems():
+            known_workbook_by_key[(bareme, workbook['fingerprint'])] = workbook
+            for sheet_name, sheet in workbook['sheets'].iteritems():
+                known_sheet_by_key[(bareme, sheet_name, sheet['fingerprint'])] = sheet
+
+    workbook_by_bareme = collections.OrderedDict()
+    for xls_path in sorted(glob.glob(os.path.join(directory, u'{}*.xls'.format(xls_prefix)))):
+        bareme = os.path.splitext(os.path.basename(xls_path))[0][len(xls_prefix):]
+        fingerprint = compute_file_fingerprint(xls_path)
+        workbook = known_workbook_by_key.get((bareme, fingerprint))
+        if workbook is not None:
+            log.info(u'Reusing unchanged file {}'.format(bareme))
+            workbook_by_bareme[bareme] = workbook
+            continue
+        log.info(u'Ingesting file {}'.format(bareme))
+        book = xlrd.open_workbook(filename = xls_path, formatting_info = True, on_demand = True)
+        sheet_by_name = collections.OrderedDict()
+        for sheet_name in get_sheet_names(book, bareme):
+            sheet_fingerprint = compute_sheet_fingerprint(book, book.sheet_by_name(sheet_name))
+            sheet = known_sheet_by_key.get((bareme, sheet_name, sheet_fingerprint))
+            if sheet is None:
+                log.info(u'  Parsing sheet {}'.format(sheet_name))
+                sheet = dict(
+                    fingerprint = sheet_fingerprint,
+                    series = [
+                        [series['taxipp_name'], save_series_rows(store_dir, series), series['title']]
+                        for series in iter_parameter_series(bareme, sheet_name, parse_sheet(book, sheet_name))
+                        ],
+                    )
+            sheet_by_name[sheet_name] = sheet
+            book.unload_sheet(sheet_name)
+        book.release_resources()
+        workbook_by_bareme[bareme] = dict(
+            fingerprint = fingerprint,
+            sheets = sheet_by_name,
+            )
+
+    release = collections.OrderedDict((
+        (u'release_date', release_date.isoformat()),
+        (u'workbooks', workbook_by_bareme),
+        ))
+    releases_dir = os.path.join(store_dir, u'releases')
+    if not os.path.isdir(releases_dir):
+        os.makedirs(releases_dir)
+    write_json_file(os.path.join(releases_dir, u'{}.json'.format(release['release_date'])), release)
+    return release
+
+
+def iter_parameter_history(store, taxipp_name, effective_date):
+    """Iterate over the releases, as (release date, bareme, sheet name, row in force at effective_date) tuples.
+
+    A parameter missing from a release is given with None as bareme, sheet name & row.
+    """
+    for release in store['releases']:
+        locations = release['locations_by_taxipp_name'].get(taxipp_name)
+        if not locations:
+            yield release['release_date'], None, None, None
+            continue
+        for bareme, sheet_name, series_fingerprint in locations:
+            yield release['release_date'], bareme, sheet_name, get_row_at(load_series_rows(store,
+                series_fingerprint), effective_date)
+
+
+def load_series_rows(store, series_fingerprint):
+    rows = store['rows_by_fingerprint'].get(series_fingerprint)
+    if rows is None:
+        with io.open(os.path.join(store['dir'], u'objects', series_fingerprint[:2], series_fingerprint + u'.json'),
+                encoding = 'utf-8') as object_file:
+            rows = store['rows_by_fingerprint'][series_fingerprint] = [
+                (datetime.datetime.strptime(row[u'start_date'], '%Y-%m-%d').date(),) + tuple(
+                    row[field]
+                    for field in row_fields[1:]
+                    )
+                for row in json.load(object_file)
+                ]
+    return rows
+
+
+def load_store(store_dir):
+    """Load the manifests of the releases of a store, sorted by release date. The series are loaded on demand."""
+    releases = []
+    for manifest_path in sorted(glob.glob(os.path.join(store_dir, u'releases', u'*.json'))):
+        with io.open(manifest_path, encoding = 'utf-8') as manifest_file:
+            release = json.load(manifest_file, object_pairs_hook = collections.OrderedDict)
+        locations_by_taxipp_name = {}
+        for bareme, workbook in release['workbooks'].iteritems():
+            for sheet_name, sheet in workbook['sheets'].iteritems():
+                for taxipp_name, series_fingerprint, title in sheet['series']:
+                    locations_by_taxipp_name.setdefault(taxipp_name, []).append(
+                        (bareme, sheet_name, series_fingerprint))
+        release['locations_by_taxipp_name'] = locations_by_taxipp_name
+        releases.append(release)
+    return dict(
+        dir = store_dir,
+        release_dates = [loaded_release['release_date'] for loaded_release in releases],
+        releases = releases,
+        rows_by_fingerprint = {},
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-a', '--as-of',
+        help = 'date of the query in release time (YYYY-MM-DD): the latest release published at this date is used '
+            '(default: the value in every release)')
+    parser.add_argument('-e', '--effective-date', help = 'effective date of the queried value (YYYY-MM-DD)')
+    parser.add_argument('-i', '--ingest', help = 'path of an IPP XLS directory to add to the store')
+    parser.add_argument('-p', '--param', help = 'TAXIPP name of the queried parameter')
+    parser.add_argument('-r', '--release-date', help = 'publication date of the ingested release (YYYY-MM-DD)')
+    parser.add_argument('-s', '--store', default = 'ipp_releases_store', help = 'path of the store directory')
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stderr)
+
+    store_dir = args.store.decode('utf-8')
+    if args.ingest is not None:
+        if args.release_date is None:
+            parser.error(u'Option --release-date is required to ingest a release')
+        release = ingest_release(store_dir, args.ingest.decode('utf-8'),
+            datetime.datetime.strptime(args.release_date, '%Y-%m-%d').date())
+        print u'Release {}: {} parameter(s)'.format(release['release_date'], sum(
+            len(sheet['series'])
+            for workbook in release['workbooks'].itervalues()
+            for sheet in workbook['sheets'].itervalues()
+            )).encode('utf-8')
+    if args.param is None:
+        return 0
+    if args.effective_date is None:
+        parser.error(u'Option --effective-date is required to query a parameter')
+
+    store = load_store(store_dir)
+    taxipp_name = args.param.decode('utf-8')
+    effective_date = datetime.datetime.strptime(args.effective_date, '%Y-%m-%d').date()
+    if args.as_of is None:
+        history = list(iter_parameter_history(store, taxipp_name, effective_date))
+    else:
+        release = get_release(store, datetime.datetime.strptime(args.as_of, '%Y-%m-%d').date())
+        if release is None:
+            print >> sys.stderr, u'No release published at {}'.format(args.as_of).encode('utf-8')
+            return 1
+        history = list(iter_parameter_history(dict(store, releases = [release]), taxipp_name, effective_date))
+    for release_date, bareme, sheet_name, row in history:
+        if bareme is None:
+            print u'{}: {} missing'.format(release_date, taxipp_name).encode('utf-8')
+        elif row is None:
+            print u'{} ({} / {}): not in force at {}'.format(release_date, bareme, sheet_name,
+                effective_date).encode('utf-8')
+        else:
+            start_date, value, unit, law_reference, publication_date, notes = row
+            print u'{} ({} / {}): {}{} since {}{}'.format(release_date, bareme, sheet_name, value,
+                u' {}'.format(unit) if unit is not None else u'', start_date,
+                u' ({})'.format(law_reference) if law_reference else u'').encode('utf-8')
+
+    return 0
+
+
+def save_series_rows(store_dir, series):
+    """Save the rows of a series, unless an identical series is already stored, and return its fingerprint."""
+    series_fingerprint = compute_series_fingerprint(series)
+    object_dir = os.path.join(store_dir, u'objects', series_fingerprint[:2])
+    object_path = os.path.join(object_dir, series_fingerprint + u'.json')
+    if not os.path.exists(object_path):
+        if not os.path.isdir(object_dir):
+            os.makedirs(object_dir)
+        write_json_file(object_path, [row_to_json(row) for row in series['rows']])
+    return series_fingerprint
+
+
+def write_json_file(file_path, data):
+    temporary_path = file_path + u'.tmp'
+    with io.open(temporary_path, 'w', encoding = 'utf-8') as json_file:
+        json_file.write(unicode(json.dumps(data, ensure_ascii = False, separators = (',', ':'))))
+    os.rename(temporary_path, file_path)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Aggregation of the parameters of IPP's tax benefit tables into monthly and yearly tables, using pandas & NumPy."""
+
+
+import collections
+import datetime
+
+from biryani import strings
+import numpy as np
+import pandas as pd
+
+from csv_table_writer import write_tables_csv
+from ipp_tables_parsing import (get_values_rows_dates, iter_parameter_series, iter_sheet_events, parse_sheet_events,
+    transform_cell_value)
+
+
+# The horizon of the monthly tables
+first_year = 1914
+last_year = 2020
+# The aggregation options whose tables have columns typed by pandas from their values
+options_with_inferred_types = ('mean_by_year', 'year_end')
+
+
+def build_aggregation_cube(data_frame, series_list = None):
+    """Return the cube of the tables served by the aggregation options, computed lazily by get_aggregated_table.
+
+    data_frame is the forward-filled monthly table of a bareme and series_list the parameter series it was built from
+    (see iter_parameter_series). A table is computed at its first request and kept in the cube, so that several options
+    share the same monthly table without paying for the tables no option asks for.
+    """
+    return dict(
+        monthly = data_frame,
+        series_list = series_list,
+        table_by_key = {},
+        )
+
+
+def build_monthly_table(vector_by_taxipp_name):
+    """Build the forward-filled monthly table of a bareme from the vectors of its parameters."""
+    return pd.concat(list(iter_monthly_table_chunks(vector_by_taxipp_name)))
+
+
+def compute_annual_mean(data_frame):
+    """Compute the annual means of the monthly values (a "-" counting as 0)."""
+    numeric_data_frame = data_frame.replace('-', 0).apply(pd.to_numeric, errors = 'coerce')
+    annual_mean = numeric_data_frame.groupby(data_frame.index.year).mean()
+    annual_mean.index = [datetime.datetime(year, 1, 1) for year in annual_mean.index]
+    return annual_mean
+
+
+def compute_changes_count_by_year(data_frame):
+    """Count, for each year, the months where a value differs from the previous month."""
+    changed = data_frame.ne(data_frame.shift()) & data_frame.notnull()
+    changed.iloc[:1] = False
+    changes_count_by_year = changed.groupby(data_frame.index.year).sum().astype(int)
+    changes_count_by_year.index = [datetime.datetime(year, 1, 1) for year in changes_count_by_year.index]
+    return changes_count_by_year
+
+
+def compute_time_weighted_annual_mean(data_frame, series_list):
+    """Compute the annual means weighted by the number of days each value is in effect, from the exact effective
+    dates of the parameter series.
+    """
+    table_first_year = data_frame.index[0].year if len(data_frame.index) else first_year
+    table_last_year = data_frame.index[-1].year if len(data_frame.index) else last_year
+    time_weighted_annual_mean = compute_time_weighted_means(
+        series_list,
+        [datetime.date(year, 1, 1) for year in range(table_first_year, table_last_year + 2)],
+        ).reindex(columns = data_frame.columns)
+    time_weighted_annual_mean.index = [
+        datetime.datetime(date.year, date.month, date.day)
+        for date in time_weighted_annual_mean.index
+        ]
+    return time_weighted_annual_mean
+
+
+def compute_time_weighted_means(series_list, period_starts):
+    """Compute the exact time-weighted means of parameter series over consecutive periods.
+
+    period_starts is a sorted list of dates: period i starts at period_starts[i] (included) and ends at
+    period_starts[i + 1] (excluded). Each value is weighted by the number of days it is in effect in the period,
+    from its effective date to the next change point. Days before the first known value are not counted.
+
+    Instead of resampling a monthly grid, all the series are evaluated only at their change points and at the
+    periods bounds, then reduced per period in a single vectorized pass.
+    """
+    period_ordinals = np.array([date.toordinal() for date in period_starts], dtype = np.int64)
+    change_points_list = [get_series_change_points(series) for series in series_list]
+    breakpoints = np.unique(np.concatenate([period_ordinals] + [
+        ordinals[(ordinals > period_ordinals[0]) & (ordinals < period_ordinals[-1])]
+        for ordinals, values in change_points_list
+        ]))
+    segment_starts = breakpoints[:-1]
+    segment_lengths = np.diff(breakpoints).astype(float)
+    values = np.empty((len(segment_starts), len(change_points_list)))
+    for variable_index, (ordinals, variable_values) in enumerate(change_points_list):
+        values[:, variable_index] = get_values_as_of(ordinals, variable_values, segment_starts)
+    known = ~np.isnan(values)
+    period_first_segments = np.searchsorted(segment_starts, period_ordinals[:-1])
+    weighted_sums = np.add.reduceat(np.where(known, values, 0.) * segment_lengths[:, np.newaxis],
+        period_first_segments, axis = 0)
+    known_days = np.add.reduceat(known * segment_lengths[:, np.newaxis], period_first_segments, axis = 0)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        means = np.where(known_days > 0, weighted_sums / known_days, np.nan)
+    return pd.DataFrame(
+        means,
+        columns = [series['taxipp_name'] for series in series_list],
+        index = period_starts[:-1],
+        )
+
+
+def compute_year_end(data_frame):
+    """Return the value of each year at its last month."""
+    year_end = data_frame.groupby(data_frame.index.year).last()
+    year_end.index = [datetime.datetime(year, 12, 1) for year in year_end.index]
+    return year_end
+
+
+def convert_sheet_to_vectors(book, bareme, sheet_name, sheet_validation = None):
+    """Parse a sheet and return its parameter series and the (TAXIPP name, vector) couples of the aggregated table.
+
+    When a sheet validation is given (see ipp_tables_validation), the rows are checked while they are parsed. The
+    cells are decoded the same way with or without validation: a number with an unknown format fails the conversion.
+    """
+    events = iter_sheet_events(book, sheet_name)
+    if sheet_validation is not None:
+        from ipp_tables_validation import iter_validated_sheet_events
+        events = iter_validated_sheet_events(sheet_validation, bareme, sheet_name, events)
+    parsed_sheet = parse_sheet_events(events)
+    series_list = list(iter_parameter_series(bareme, sheet_name, parsed_sheet))
+    taxipp_names_row = parsed_sheet['taxipp_names_row']
+    values_rows = parsed_sheet['values_rows']
+
+    dates = [
+        date.replace(day = 1)
+        for date in get_values_rows_dates(bareme, values_rows)
+        ]
+    vectors = []
+    for column_index, taxipp_name in enumerate(taxipp_names_row):
+        if taxipp_name and strings.slugify(taxipp_name) not in ('date', 'date-ir', 'date-rev', 'note', 'ref-leg', 'notes') :
+            vector = [
+                transform_cell_value(date, row[column_index])
+                for date, row in zip(dates, values_rows)
+                ]
+            vector = [
+                cell if not isinstance(cell, basestring) or cell == u'nc' else '-'
+                for cell in vector
+                ]
+            vectors.append((taxipp_name, pd.Series(vector, index = dates)))
+    book.unload_sheet(sheet_name)
+    return series_list, vectors
+
+
+def get_aggregated_table(cube, option, month = 1):
+    """Return the table of an aggregation option, computing it at its first request (see build_aggregation_cube)."""
+    data_frame = cube['monthly']
+    if option == 'all_months':
+        return data_frame
+    if option == 'which_month_in_year':
+        key = (option, month)
+    elif option in ('changes_by_year', 'mean_by_year', 'time_weighted_mean_by_year', 'year_end'):
+        key = option
+    else:
+        raise ValueError(u'Unknown aggregation option: {}'.format(option))
+    table = cube['table_by_key'].get(key)
+    if table is not None:
+        return table
+    if option == 'changes_by_year':
+        table = compute_changes_count_by_year(data_frame)
+    elif option == 'mean_by_year':
+        table = compute_annual_mean(data_frame)
+    elif option == 'time_weighted_mean_by_year':
+        assert cube['series_list'] is not None, u'Cube built without parameter series'
+        table = compute_time_weighted_annual_mean(data_frame, cube['series_list'])
+    elif option == 'which_month_in_year':
+        table = data_frame[data_frame.index.month == month]
+    else:
+        table = compute_year_end(data_frame)
+    cube['table_by_key'][key] = table
+    return table
+
+
+def get_monthly_change_points(vector):
+    """Return the months (as positions in the monthly table) where the value of a vector changes and the
+    forward-filled values at these months.
+
+    The values have the type of the column of the vector in the monthly table: like DataFrame.replace, the columns
+    whose only texts were "nc" are converted back to numbers.
+    """
+    months_count = (last_year - first_year + 1) * 12
+    positions = np.array([(date.year - first_year) * 12 + date.month - 1 for date in vector.index], dtype = np.int64)
+    if any(
+            not 0 <= position < months_count or date.day != 1
+            for date, position in zip(vector.index, positions)
+            ):
+        raise KeyError(u'{} not in index'.format([
+            date
+            for date, position in zip(vector.index, positions)
+            if not 0 <= position < months_count or date.day != 1
+            ]))
+    values = vector.values
+    if values.dtype == object:
+        values = np.array([np.nan if value == u'nc' else value for value in values], dtype = object)
+        # The type of the column, inferred like for the whole column, whose months without a value are NaN.
+        dtype = pd.Series(np.append(values, [np.nan] if len(set(positions)) < months_count else []),
+            dtype = object).infer_objects().dtype
+        if dtype != object:
+            values = values.astype(dtype)
+    else:
+        values = values.astype(float)
+    if not len(positions):
+        return positions, np.array([], dtype = float)
+    # When a month is repeated, the last row of the sheet wins.
+    order = np.argsort(positions, kind = 'mergesort')
+    positions = positions[order]
+    values = values[order]
+    is_last = np.append(positions[1:] != positions[:-1], True)
+    positions = positions[is_last]
+    values = pd.Series(values[is_last], dtype = values.dtype).fillna(method = 'pad').values
+    return positions, values
+
+
+def get_series_change_points(series):
+    """Return the sorted effective dates (as ordinals) and the numeric values of a parameter series.
+
+    The values follow the conventions of the aggregated tables: amounts in FRF are converted to euros, empty and "nc"
+    cells continue the previous value and other strings (including blank cells) count as 0.
+    """
+    value_by_ordinal = {}
+    for row in series['rows']:
+        date, value, unit = row[:3]
+        if value is None or value == u'nc':
+            continue
+        value = transform_cell_value(date, (value, unit)) if unit is not None else value
+        if isinstance(value, basestring):
+            value = 0
+        # When a date is repeated, the last row of the sheet wins, as in the monthly table.
+        value_by_ordinal[date.toordinal()] = float(value)
+    ordinals = np.array(sorted(value_by_ordinal), dtype = np.int64)
+    return ordinals, np.array([value_by_ordinal[ordinal] for ordinal in ordinals], dtype = float)
+
+
+def get_values_as_of(ordinals, values, query_ordinals):
+    """Return, for each query date, the value in effect at this date (NaN before the first change point).
+
+    ordinals & values are the change points of a series (see get_series_change_points) and query_ordinals an array of
+    dates as ordinals, in any order.
+    """
+    if not len(ordinals):
+        return np.full(len(query_ordinals), np.nan)
+    indexes = np.searchsorted(ordinals, query_ordinals, side = 'right') - 1
+    return np.where(indexes >= 0, values[np.maximum(indexes, 0)], np.nan)
+
+
+def iter_aggregated_tables_chunks(vector_by_taxipp_name, options_and_months, series_list = None):
+    """Iterate over the chunks of the aggregated tables of (option, month) couples, computed from the chunks of whole
+    years of the monthly table (see iter_monthly_table_chunks), as lists of data frames (one per couple).
+
+    pandas infers the types of the columns of some tables from their values (for example, a column of year_end is a
+    column of numbers unless one of its values is a "-"): the types of these columns in the whole tables are found by a
+    first pass over the chunks, then the chunks are converted to these types, so that the tables are written exactly as
+    when they are computed at once.
+    """
+    dtypes_by_couple_index = {}
+    for monthly_chunk in iter_monthly_table_chunks(vector_by_taxipp_name):
+        cube = build_aggregation_cube(monthly_chunk, series_list = series_list)
+        for couple_index, (option, month) in enumerate(options_and_months):
+            if option not in options_with_inferred_types:
+                continue
+            table_chunk = get_aggregated_table(cube, option, month)
+            if not len(table_chunk.index):
+                continue
+            dtypes = dtypes_by_couple_index.get(couple_index)
+            dtypes_by_couple_index[couple_index] = list(table_chunk.dtypes) if dtypes is None else [
+                merge_dtypes(dtype, chunk_dtype)
+                for dtype, chunk_dtype in zip(dtypes, table_chunk.dtypes)
+                ]
+
+    previous_row = None
+    for monthly_chunk in iter_monthly_table_chunks(vector_by_taxipp_name):
+        cube = build_aggregation_cube(monthly_chunk, series_list = series_list)
+        tables_chunk = []
+        for couple_index, (option, month) in enumerate(options_and_months):
+            if option == 'changes_by_year' and previous_row is not None:
+                # The first month of the chunk is compared with the last month of the previous chunk, whose year is
+                # then dropped.
+                table_chunk = compute_changes_count_by_year(pd.concat([previous_row, monthly_chunk])).iloc[1:]
+            elif option == 'year_end':
+                # The monthly table being forward-filled, the last value of a year is the one of its last month. Its
+                # values are taken as they are in the monthly table, then typed like in the whole table: the types
+                # inferred by pandas for a chunk would have converted its integers to floats.
+                table_chunk = monthly_chunk[~monthly_chunk.index.year.duplicated(keep = 'last')]
+                table_chunk.index = [datetime.datetime(year, 12, 1) for year in table_chunk.index.year]
+            else:
+                table_chunk = get_aggregated_table(cube, option, month)
+            dtypes = dtypes_by_couple_index.get(couple_index)
+            if dtypes is not None and list(table_chunk.dtypes) != dtypes:
+                table_chunk = table_chunk.astype(dict(zip(table_chunk.columns, dtypes)))
+            tables_chunk.append(table_chunk)
+        yield tables_chunk
+        if len(monthly_chunk.index):
+            previous_row = monthly_chunk.iloc[-1:]
+
+
+def iter_monthly_table_chunks(vector_by_taxipp_name, years_per_chunk = 50):
+    """Iterate over the forward-filled monthly table of a bareme (from first_year to last_year, without its leading
+    months where all the parameters are unknown), by chunks of whole years.
+
+    Each vector is reduced to its change points, then evaluated at the months of each chunk only, so that the memory
+    used by a chunk doesn't depend on the horizon of the table. At least a chunk is given, even when it is empty.
+    """
+    months_count = (last_year - first_year + 1) * 12
+    change_points_by_taxipp_name = collections.OrderedDict(
+        (taxipp_name, get_monthly_change_points(vector))
+        for taxipp_name, vector in vector_by_taxipp_name.iteritems()
+        )
+    start = min([months_count] + [
+        positions[known_indexes[0]]
+        for positions, known_indexes in (
+            (positions, np.flatnonzero(pd.notnull(values)))
+            for positions, values in change_points_by_taxipp_name.itervalues()
+            )
+        if len(known_indexes)
+        ])
+    chunk_months = years_per_chunk * 12
+    chunks_bounds = [
+        (max(chunk_start, start), min(chunk_start + chunk_months, months_count))
+        for chunk_start in range(start - start % chunk_months, months_count, chunk_months)
+        ] or [(months_count, months_count)]
+    for chunk_start, chunk_stop in chunks_bounds:
+        chunk_positions = np.arange(chunk_start, chunk_stop)
+        column_by_taxipp_name = collections.OrderedDict()
+        for taxipp_name, (positions, values) in change_points_by_taxipp_name.iteritems():
+            if not len(positions):
+                column_by_taxipp_name[taxipp_name] = np.full(len(chunk_positions), np.nan)
+                continue
+            indexes = np.searchsorted(positions, chunk_positions, side = 'right') - 1
+            column = values[np.maximum(indexes, 0)]
+            column[indexes < 0] = np.nan
+            column_by_taxipp_name[taxipp_name] = column
+        yield pd.DataFrame(
+            column_by_taxipp_name,
+            columns = list(column_by_taxipp_name),
+            index = pd.DatetimeIndex((np.datetime64(u'{}-01'.format(first_year), 'M') + chunk_positions).astype(
+                'datetime64[ns]')),
+            )
+
+
+def merge_dtypes(dtype, other_dtype):
+    """Return the type of a column concatenating columns of two types, like pandas."""
+    if dtype == other_dtype:
+        return dtype
+    if dtype.kind in 'fiu' and other_dtype.kind in 'fiu':
+        return np.result_type(dtype, other_dtype)
+    return np.dtype(object)
+
+
+def write_aggregated_tables(vector_by_taxipp_name, outputs, series_list = None, compression = None):
+    """Write the aggregated tables of a bareme, given as (option, month, file path) triples, and return the paths of
+    the written files.
+
+    The tables are computed and written by chunks of whole years, in a single pass over the monthly table: neither
+    the monthly table nor the aggregated tables are held in memory whole, whatever the horizon.
+    """
+    return write_tables_csv(
+        iter_aggregated_tables_chunks(vector_by_taxipp_name, [(option, month) for option, month, file_path in outputs],
+            series_list = series_list),
+        [file_path for option, month, file_path in outputs],
+        compression = compression,
+        )
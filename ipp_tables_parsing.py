@@ -0,0 +1,640 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Parsing core of IPP's tax benefit tables: split the sheets into rows and decode their cells and dates.
+
+This module depends only on Biryani and xlrd, so that the scripts that only read the sheets start quickly: pandas and
+NumPy are loaded by the aggregation stages only (see ipp_tables_aggregation). The converter pipelines are built at
+their first use.
+"""
+
+
+import collections
+import datetime
+import hashlib
+import re
+import weakref
+
+from biryani import baseconv, custom_conv, datetimeconv, states
+from biryani import strings
+import xlrd
+
+
+conv = custom_conv(baseconv, datetimeconv, states)
+forbiden_sheets = {
+    u'Impot Revenu': (u'Barème IGR',),
+    u'prelevements sociaux': (u'Abréviations', u'ASSIETTE PU', u'AUBRYI',  u'AUBRYII'),
+    u'Taxation indirecte': (u'TVA par produit',),
+    }
+french_date_re = re.compile(ur'(?P<day>0?[1-9]|[12]\d|3[01])/(?P<month>0?[1-9]|1[0-2])/(?P<year>[12]\d{3})$')
+# Background colours of the rows of the IPP sheets, by index in the palette of the workbooks: dark blue (49) or blue
+# (44) for the labels rows, light blue (27) for the values rows. The other rows are white (64, no fill).
+label_colour_indexes = (44, 49)
+# Role of the metadata columns of a values row, by slugified TAXIPP name or by slugified label.
+metadata_role_by_slug = {
+    u'date': u'date',
+    u'date-d-effet': u'date',
+    u'date-d-entree-en-vigueur': u'date',
+    u'date-d-entree-en-vigeur': u'date',
+    u'date-ir': u'date',
+    u'date-rev': u'date',
+    u'jorf': u'publication_date',
+    u'note': u'notes',
+    u'notes': u'notes',
+    u'parution-au-jo': u'publication_date',
+    u'parution-au-jorf': u'publication_date',
+    u'publication-au-jo': u'publication_date',
+    u'publication-au-jorf': u'publication_date',
+    u'publication-jo': u'publication_date',
+    u'ref-leg': u'law_reference',
+    u'reference': u'law_reference',
+    u'reference-legislative': u'law_reference',
+    u'references-legislatives': u'law_reference',
+    u'references-legislatives-ou-boi': u'law_reference',
+    u'remarques': u'notes',
+    }
+N_ = lambda message: message
+# Key of the rows of each event type in a parsed sheet (see parse_sheet).
+rows_key_by_event_type = {
+    u'description': 'descriptions_rows',
+    u'label': 'labels_rows',
+    u'note': 'notes_rows',
+    u'value': 'values_rows',
+    }
+value_colour_index = 27
+# Role of the rows by XF index (cell style), computed once per workbook (see get_xf_roles).
+xf_roles_by_book = weakref.WeakKeyDictionary()
+year_re = re.compile(ur'[12]\d{3}$')
+
+
+def lazy_converter(build_converter):
+    """Return a converter building its pipeline with build_converter at its first call only.
+
+    This keeps the import of the module cheap: most runs use only a few of the converters.
+    """
+    converters = []
+
+    def converter(value, state = None):
+        if not converters:
+            converters.append(build_converter())
+        return converters[0](value, state = state)
+
+    converter.__name__ = build_converter.__name__
+    return converter
+
+
+def input_to_french_date(value, state = None):
+    if value is None:
+        return None, None
+    if state is None:
+        state = conv.default_state
+    match = french_date_re.match(value)
+    if match is None:
+        return value, state._(u'Invalid french date')
+    return datetime.date(int(match.group('year')), int(match.group('month')), int(match.group('day'))), None
+
+
+@lazy_converter
+def cell_to_date_or_year():
+    return conv.condition(
+        conv.test_isinstance(int),
+        conv.pipe(
+            conv.test_between(1914, 2020),
+            conv.function(lambda year: datetime.date(year, 1, 1)),
+            ),
+        conv.pipe(
+            conv.test_isinstance(basestring),
+            conv.first_match(
+                conv.pipe(
+                    conv.test(lambda date: year_re.match(date), error = 'Not a valid year'),
+                    conv.function(lambda year: datetime.date(year, 1, 1)),
+                    ),
+                input_to_french_date,
+                conv.iso8601_input_to_date,
+                ),
+            ),
+        )
+
+
+@lazy_converter
+def label_cell_to_date_or_year():
+    # A row is a labels row as long as its first cell is not a date or a year.
+    return conv.pipe(
+        conv.test_isinstance((int, basestring)),
+        cell_to_date_or_year,
+        conv.not_none,
+        )
+
+
+@lazy_converter
+def currency_converter():
+    return conv.first_match(
+        conv.pipe(
+            conv.test_isinstance(basestring),
+            conv.cleanup_line,
+            conv.test_none(),
+            ),
+        conv.pipe(
+            conv.test_isinstance(tuple),
+            conv.test(lambda couple: len(couple) == 2, error = N_(u"Invalid couple length")),
+            conv.struct(
+                (
+                    conv.pipe(
+                        conv.test_isinstance((float, int)),
+                        conv.not_none,
+                        ),
+                    conv.pipe(
+                        conv.test_isinstance(basestring),
+                        conv.test_in([
+                            u'EUR',
+                            u'FRF',
+                            ]),
+                        ),
+                    ),
+                ),
+            ),
+        )
+
+
+# Converters of the values rows of the sheet of the "Plafond de la Sécurité sociale", by label.
+pss_converters = collections.OrderedDict((
+    (u"Date d'entrée en vigueur", lazy_converter(lambda: conv.pipe(
+        conv.test_isinstance(basestring),
+        conv.iso8601_input_to_date,
+        conv.not_none,
+        ))),
+    (u'Plafond de la Sécurité sociale (mensuel)', currency_converter),
+    (u'Plafond de la Sécurité sociale (annuel)', currency_converter),
+    (u'Références législatives', lazy_converter(lambda: conv.pipe(
+        conv.test_isinstance(basestring),
+        conv.cleanup_line,
+        ))),
+    (u'Parution au JO', lazy_converter(lambda: conv.pipe(
+        conv.test_isinstance(basestring),
+        conv.iso8601_input_to_date,
+        conv.date_to_iso8601_str,
+        ))),
+    (u'Notes', lazy_converter(lambda: conv.pipe(
+        conv.test_isinstance(basestring),
+        conv.cleanup_line,
+        ))),
+    (None, lazy_converter(lambda: conv.pipe(
+        conv.test_isinstance(basestring),
+        conv.cleanup_line,
+        conv.test_none(),
+        ))),
+    ))
+
+
+def get_unmerged_cell_coordinates(row_index, column_index, merged_cells_tree):
+    unmerged_cell_coordinates = merged_cells_tree.get(row_index, {}).get(column_index)
+    if unmerged_cell_coordinates is None:
+        return row_index, column_index
+    return unmerged_cell_coordinates
+
+
+def compute_file_fingerprint(file_path):
+    fingerprint = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            fingerprint.update(chunk)
+    return fingerprint.hexdigest()
+
+
+def compute_series_fingerprint(series):
+    fingerprint = hashlib.sha1()
+    for row in series['rows']:
+        fingerprint.update(repr(row))
+        fingerprint.update(b'\n')
+    return fingerprint.hexdigest()
+
+
+def compute_sheet_fingerprint(book, sheet):
+    """Hash the raw content of a sheet (cell types, values & number formats), without running any converter."""
+    fingerprint = hashlib.sha1()
+    fingerprint.update(repr(sorted(sheet.merged_cells)))
+    for row_index in range(sheet.nrows):
+        for column_index, (type, value) in enumerate(zip(sheet.row_types(row_index), sheet.row_values(row_index))):
+            if type == 2:
+                xf = book.xf_list[sheet.cell_xf_index(row_index, column_index)]
+                value = (value, book.format_map[xf.format_key].format_str)
+            fingerprint.update(repr((column_index, type, value)))
+        fingerprint.update(b'\n')
+    return fingerprint.hexdigest()
+
+
+def get_column_roles(parsed_sheet):
+    """Give the role of each column of a values row: u'parameter', u'date', u'law_reference', u'publication_date',
+    u'notes' or None (ignored column).
+    """
+    taxipp_names_row = parsed_sheet['taxipp_names_row'] or []
+    labels_rows = parsed_sheet['labels_rows']
+    columns_count = max([len(taxipp_names_row)] + [len(row) for row in labels_rows])
+    roles = []
+    for column_index in range(columns_count):
+        taxipp_name = taxipp_names_row[column_index] if column_index < len(taxipp_names_row) else None
+        label = labels_rows[0][column_index] if labels_rows and column_index < len(labels_rows[0]) else None
+        role = metadata_role_by_slug.get(strings.slugify(taxipp_name)) if taxipp_name else None
+        if role is None and label:
+            role = metadata_role_by_slug.get(strings.slugify(label))
+        if role is None and taxipp_name:
+            role = u'parameter'
+        roles.append(role)
+    return roles
+
+
+def get_merged_cells_tree(sheet):
+    """Map the coordinates of every merged cell to the coordinates of the top-left cell of its range."""
+    merged_cells_tree = {}
+    for row_low, row_high, column_low, column_high in sheet.merged_cells:
+        for row_index in range(row_low, row_high):
+            cell_coordinates_by_merged_column_index = merged_cells_tree.setdefault(
+                row_index, {})
+            for column_index in range(column_low, column_high):
+                cell_coordinates_by_merged_column_index[column_index] = (row_low, column_low)
+    return merged_cells_tree
+
+
+def get_hyperlink(sheet, row_index, column_index):
+    return sheet.hyperlink_map.get((row_index, column_index))
+
+
+def get_sheet_names(book, bareme):
+    return [
+        sheet_name
+        for sheet_name in book.sheet_names()
+        if not sheet_name.startswith((u'Sommaire', u'Outline'))
+            and not sheet_name in forbiden_sheets.get(bareme, [])
+        ]
+
+
+def get_sheet_title_by_name(book, summary_sheet_name):
+    """Return the titles of the sheets by name, from the hyperlinks of a summary ("Sommaire") sheet."""
+    sheet = book.sheet_by_name(summary_sheet_name)
+    merged_cells_tree = get_merged_cells_tree(sheet)
+    sheet_title_by_name = {}
+    for row_index in range(sheet.nrows):
+        linked_sheet_number = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, 2)
+        if isinstance(linked_sheet_number, int):
+            linked_sheet_title = transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, 3)
+            if linked_sheet_title is not None:
+                hyperlink = get_hyperlink(sheet, row_index, 3)
+                if hyperlink is not None and hyperlink.type == u'workbook':
+                    linked_sheet_name = hyperlink.textmark.split(u'!', 1)[0].strip(u'"').strip(u"'")
+                    sheet_title_by_name[linked_sheet_name] = linked_sheet_title
+    return sheet_title_by_name
+
+
+def get_values_rows_dates(bareme, values_rows):
+    check_date_or_year = conv.check(cell_to_date_or_year)
+    return [
+        check_date_or_year(
+            row[1] if bareme == u'Impot Revenu' else row[0],
+            state = conv.default_state,
+            )
+        for row in values_rows
+        ]
+
+
+def get_xf_roles(book):
+    """Return the list of the row roles (u'label', u'value' or None) denoted by the background of each XF of a
+    workbook, by XF index.
+    """
+    xf_roles = xf_roles_by_book.get(book)
+    if xf_roles is None:
+        xf_roles = xf_roles_by_book[book] = [
+            None if xf.background.fill_pattern == 0
+                else u'label' if xf.background.pattern_colour_index in label_colour_indexes
+                else u'value' if xf.background.pattern_colour_index == value_colour_index
+                else None
+            for xf in book.xf_list
+            ]
+    return xf_roles
+
+
+def iter_parameter_series(bareme, sheet_name, parsed_sheet):
+    """Iterate over the parameters of a parsed sheet, as dated series.
+
+    Each row of a series is a tuple (start_date, value, unit, law_reference, publication_date, notes), where the
+    start_date is the exact effective date of the values row.
+    """
+    values_rows = parsed_sheet['values_rows']
+    if not values_rows:
+        return
+    roles = get_column_roles(parsed_sheet)
+    metadata_column_index_by_role = {}
+    for column_index, role in enumerate(roles):
+        if role is not None and role != u'parameter':
+            metadata_column_index_by_role.setdefault(role, column_index)
+    metadata_rows = [
+        tuple(
+            row[metadata_column_index_by_role[role]]
+                if role in metadata_column_index_by_role and metadata_column_index_by_role[role] < len(row)
+                else None
+            for role in (u'law_reference', u'publication_date', u'notes')
+            )
+        for row in values_rows
+        ]
+    dates = get_values_rows_dates(bareme, values_rows)
+    labels_rows = parsed_sheet['labels_rows']
+    taxipp_names_row = parsed_sheet['taxipp_names_row']
+    for column_index, role in enumerate(roles):
+        if role != u'parameter':
+            continue
+        labels = []
+        for labels_row in labels_rows:
+            label = labels_row[column_index] if column_index < len(labels_row) else None
+            if label and label not in labels:
+                labels.append(label)
+        rows = []
+        for date, row, metadata in zip(dates, values_rows, metadata_rows):
+            cell = row[column_index] if column_index < len(row) else None
+            value, unit = cell if isinstance(cell, tuple) else (cell, None)
+            rows.append((date, value, unit) + metadata)
+        yield dict(
+            bareme = bareme,
+            rows = rows,
+            sheet_name = sheet_name,
+            taxipp_name = taxipp_names_row[column_index],
+            title = u' - '.join(labels) or None,
+            )
+
+
+def iter_rows_roles_by_date(book, sheet, merged_cells_tree):
+    """Classify the rows of an IPP sheet from their content, as (role, row index) couples.
+
+    The roles are the row event types of iter_sheet_events. After the TAXIPP names row, the rows are labels rows until
+    the first row whose first cell is a date or a year, then values rows while their first cells are dates or years.
+    The empty rows are skipped. Then come the notes rows (whose first cell is "Notes") and the descriptions rows.
+    """
+    state = 'taxipp_names'
+    for row_index in range(sheet.nrows):
+        if state == 'taxipp_names':
+            yield u'header', row_index
+            state = 'labels'
+            continue
+        if state == 'labels':
+            first_cell_value = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, 0)
+            date_or_year, error = label_cell_to_date_or_year(first_cell_value, state = conv.default_state)
+            if error is not None:
+                # First cell of row is not a date => Assume it is a label.
+                yield u'label', row_index
+                continue
+            state = 'values'
+        if state == 'values':
+            first_cell_value = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, 0)
+            if first_cell_value is None or isinstance(first_cell_value, (int, basestring)):
+                date_or_year, error = cell_to_date_or_year(first_cell_value, state = conv.default_state)
+                if error is None:
+                    # First cell of row is a valid date or year.
+                    if date_or_year is not None:
+                        assert date_or_year.year < 2601, 'Invalid date {} in {} at row {}'.format(date_or_year,
+                            sheet.name, row_index + 1)
+                        yield u'value', row_index
+                        continue
+                    if is_empty_row(book, sheet, merged_cells_tree, row_index):
+                        # If first cell is empty and all other cells in line are also empty, ignore this line.
+                        continue
+                    # First cell has no date and other cells in row are not empty => Assume it is a note.
+            state = 'notes'
+        for role_and_row_index in iter_trailing_rows_roles(book, sheet, merged_cells_tree, row_index):
+            yield role_and_row_index
+        return
+
+
+def iter_rows_roles_by_style(book, sheet, merged_cells_tree):
+    """Classify the rows of an IPP sheet from the background colours of their first cells, as (role, row index)
+    couples.
+
+    Like iter_rows_roles_by_date, but the labels rows are the (dark) blue rows and the values rows are the light blue
+    rows whose first cell is not empty: the rows are classified by looking up the role of the style of their first
+    cell in the table of get_xf_roles, without decoding any cell.
+    """
+    xf_roles = get_xf_roles(book)
+    state = 'taxipp_names'
+    for row_index in range(sheet.nrows):
+        if state == 'taxipp_names':
+            yield u'header', row_index
+            state = 'labels'
+            continue
+        row_role = xf_roles[sheet.cell_xf_index(row_index, 0)] if sheet.row_len(row_index) else None
+        if state == 'labels':
+            if row_role == u'label':
+                yield u'label', row_index
+                continue
+            state = 'values'
+        if state == 'values':
+            if row_role == u'value':
+                first_cell_type = sheet.cell_type(*get_unmerged_cell_coordinates(row_index, 0, merged_cells_tree))
+                if first_cell_type not in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+                    yield u'value', row_index
+                    continue
+            if is_empty_row(book, sheet, merged_cells_tree, row_index):
+                continue
+        for role_and_row_index in iter_trailing_rows_roles(book, sheet, merged_cells_tree, row_index):
+            yield role_and_row_index
+        return
+
+
+def iter_sheet_events(book, sheet_name, column_indexes = None, row_classifier = None, strict_formats = True):
+    """Iterate lazily over the rows of an IPP sheet, as (event type, row index, row) couples.
+
+    The event types come in this order:
+    - u'sheet_start' and u'sheet_end' (without row index nor row) enclose the events of the sheet;
+    - u'header': the row of the TAXIPP names;
+    - u'label': a row of labels of the columns;
+    - u'value': a values row, whose first cell is a date or a year. When column_indexes is given, only these columns
+      are decoded (the others are None);
+    - u'note': a row of notes;
+    - u'description': a row of the description of the sheet.
+
+    The rows are classified by row_classifier (iter_rows_roles_by_date by default, or iter_rows_roles_by_style) and
+    decoded only when they are consumed, so that a consumer can convert a sheet without buffering it. When
+    strict_formats is False, the numbers with an unknown format are decoded as (value, format string) couples, instead
+    of failing (see transform_xls_cell_to_json).
+    """
+    sheet = book.sheet_by_name(sheet_name)
+    merged_cells_tree = get_merged_cells_tree(sheet)
+
+    yield u'sheet_start', None, None
+    for role, row_index in (row_classifier or iter_rows_roles_by_date)(book, sheet, merged_cells_tree):
+        if role == u'value':
+            yield role, row_index, [
+                transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, column_index,
+                    strict_formats = strict_formats)
+                    if column_indexes is None or column_index in column_indexes
+                    else None
+                for column_index in range(sheet.row_len(row_index))
+                ]
+        else:
+            yield role, row_index, [
+                transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, column_index)
+                for column_index in range(sheet.row_len(row_index))
+                ]
+    yield u'sheet_end', None, None
+
+
+def iter_trailing_rows_roles(book, sheet, merged_cells_tree, first_row_index):
+    """Classify the rows following the values rows: notes rows, whose first cell is "Notes", then descriptions rows."""
+    state = 'notes'
+    for row_index in range(first_row_index, sheet.nrows):
+        if state == 'notes':
+            first_cell_value = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, 0)
+            if isinstance(first_cell_value, basestring) and first_cell_value.strip().lower() == 'notes':
+                yield u'note', row_index
+                continue
+            state = 'description'
+        yield u'description', row_index
+
+
+def is_empty_row(book, sheet, merged_cells_tree, row_index):
+    return all(
+        transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, column_index) in (None, u'')
+        for column_index in range(sheet.row_len(row_index))
+        )
+
+
+def parse_sheet(book, sheet_name, column_indexes = None, row_classifier = None):
+    """Split the rows of an IPP sheet into TAXIPP names, labels, values, notes and descriptions rows.
+
+    When column_indexes is given, only these columns of the values rows are decoded (the others are None). The rows
+    are classified by row_classifier (see iter_sheet_events).
+    """
+    return parse_sheet_events(iter_sheet_events(book, sheet_name, column_indexes = column_indexes,
+        row_classifier = row_classifier))
+
+
+def parse_sheet_events(events):
+    """Split the events of iter_sheet_events into the rows of a parsed sheet (see parse_sheet).
+
+    The events may go through a filter first, for example the checks of ipp_tables_validation.
+    """
+    parsed_sheet = dict(
+        descriptions_rows = [],
+        labels_rows = [],
+        notes_rows = [],
+        taxipp_names_row = None,
+        values_rows = [],
+        )
+    for event_type, row_index, row in events:
+        if event_type == u'header':
+            parsed_sheet['taxipp_names_row'] = row
+        elif event_type in rows_key_by_event_type:
+            parsed_sheet[rows_key_by_event_type[event_type]].append(row)
+    return parsed_sheet
+
+
+def transform_cell_value(date, cell_value):
+    if isinstance(cell_value, tuple):
+        value, currency = cell_value
+        if currency == u'FRF':
+            if date < datetime.date(1960, 1, 1):
+                return round(value / (100 * 6.55957), 2)
+            return round(value / 6.55957, 2)
+        return value
+    return cell_value
+
+
+def transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, column_index, strict_formats = True):
+    """Convert an XLS cell (type & value) to an unicode string.
+
+    The numbers formatted as amounts or percentages are returned as (value, unit) couples, the unit being u'EUR',
+    u'FRF' or u'%'. A number with another format fails, unless strict_formats is False: its unit is then its format
+    string.
+
+    Code taken from http://code.activestate.com/recipes/546518-simple-conversion-of-excel-files-into-csv-and-yaml/
+
+    Type Codes:
+    EMPTY   0
+    TEXT    1 a Unicode string
+    NUMBER  2 float
+    DATE    3 float
+    BOOLEAN 4 int; 1 means TRUE, 0 means FALSE
+    ERROR   5
+    """
+    unmerged_cell_coordinates = merged_cells_tree.get(row_index, {}).get(column_index)
+    if unmerged_cell_coordinates is None:
+        unmerged_row_index = row_index
+        unmerged_column_index = column_index
+    else:
+        unmerged_row_index, unmerged_column_index = unmerged_cell_coordinates
+    type = sheet.row_types(unmerged_row_index)[unmerged_column_index]
+    value = sheet.row_values(unmerged_row_index)[unmerged_column_index]
+    if type == 0:
+        value = None
+    elif type == 1:
+        if not value:
+            value = None
+    elif type == 2:
+        # NUMBER
+        value_int = int(value)
+        if value_int == value:
+            value = value_int
+        xf_index = sheet.cell_xf_index(row_index, column_index)
+        xf = book.xf_list[xf_index]  # Get an XF object.
+        format_key = xf.format_key
+        format = book.format_map[format_key]  # Get a Format object.
+        format_str = format.format_str  # This is the "number format string".
+        if format_str in (
+                u'0',
+                u'General',
+                u'GENERAL',
+                u'_-* #,##0\ _€_-;\-* #,##0\ _€_-;_-* \-??\ _€_-;_-@_-',
+                ) or format_str.endswith(u'0.00'):
+            return value
+        if u'€' in format_str:
+            return (value, u'EUR')
+        if u'FRF' in format_str or ur'\F\R\F' in format_str:
+            return (value, u'FRF')
+        if format_str.endswith(u'%'):
+            return (value, u'%')
+        assert not strict_formats, 'Unexpected format "{}" for value: {}'.format(format_str, value)
+        return (value, format_str)
+    elif type == 3:
+        # DATE
+        y, m, d, hh, mm, ss = xlrd.xldate_as_tuple(value, book.datemode)
+        date = u'{0:04d}-{1:02d}-{2:02d}'.format(y, m, d) if any(n != 0 for n in (y, m, d)) else None
+        value = u'T'.join(
+            fragment
+            for fragment in (
+                date,
+                u'{0:02d}:{1:02d}:{2:02d}'.format(hh, mm, ss)
+                    if any(n != 0 for n in (hh, mm, ss)) or date is None
+                    else None,
+                )
+            if fragment is not None
+            )
+    elif type == 4:
+        value = bool(value)
+    elif type == 5:
+        # ERROR
+        value = xlrd.error_text_from_code[value]
+    return value
+
+
+def transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, column_index):
+    cell = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, column_index)
+    assert cell is None or isinstance(cell, basestring), u'Expected a string. Got: {}'.format(cell).encode('utf-8')
+    return cell
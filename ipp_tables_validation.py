@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Checks of IPP's tax benefit tables, computed while the rows of the sheets are parsed.
+
+iter_validated_sheet_events checks the events of iter_sheet_events as they go through, so that the conversion and the
+validation of a sheet share the same read. The issues of each sheet are collected in a sheet validation (a dict
+of picklable lists, that can be checkpointed with the conversion of the sheet); the checks spanning several sheets
+and workbooks are done by get_validation_issues, from the sheet validations only.
+
+The kinds of issues are:
+- duplicated_date: a values row with the same date as the previous one;
+- duplicated_taxipp_name: a TAXIPP name used by several parameters, of the same workbook or not;
+- franc_after_euro: an amount in francs dated after an amount in euros, in the same column;
+- invalid_date: a values row whose date can't be decoded;
+- mixed_units: a column mixing amounts and percentages;
+- non_monotonic_date: a values row breaking the order of the dates of its sheet (most sheets give the most recent
+  dates first, some the oldest first: the order is set by the first two different dates);
+- unknown_format: a number with an unknown format (neither an amount, a percentage nor a plain number), found only
+  when the sheets are decoded with strict_formats = False (the conversion of the tables fails on them).
+"""
+
+
+import collections
+import datetime
+import os
+
+from ipp_tables_parsing import cell_to_date_or_year, conv, get_column_roles
+
+
+known_units = (u'%', u'EUR', u'FRF')
+report_columns = (u'bareme', u'sheet_name', u'row', u'taxipp_name', u'kind', u'message')
+
+
+def create_sheet_validation():
+    return dict(
+        issues = [],
+        taxipp_names = [],
+        )
+
+
+def get_validation_issues(sheet_validation_by_key):
+    """Return the sorted issues of the sheet validations, by (bareme, sheet name), and of their TAXIPP names."""
+    issues = []
+    # The number of uses of each TAXIPP name, by location (bareme, sheet name).
+    count_by_location_by_taxipp_name = collections.OrderedDict()
+    for (bareme, sheet_name), sheet_validation in sheet_validation_by_key.iteritems():
+        issues.extend(sheet_validation['issues'])
+        for taxipp_name in sheet_validation['taxipp_names']:
+            count_by_location = count_by_location_by_taxipp_name.setdefault(taxipp_name, collections.OrderedDict())
+            count_by_location[(bareme, sheet_name)] = count_by_location.get((bareme, sheet_name), 0) + 1
+    for taxipp_name, count_by_location in count_by_location_by_taxipp_name.iteritems():
+        if sum(count_by_location.itervalues()) < 2:
+            continue
+        # A single issue by sheet, whatever the number of uses of the name in the sheet.
+        for (bareme, sheet_name), count in count_by_location.iteritems():
+            other_locations = [
+                other_location
+                for other_location in count_by_location
+                if other_location != (bareme, sheet_name)
+                ]
+            issues.append(dict(
+                bareme = bareme,
+                kind = u'duplicated_taxipp_name',
+                message = u'; '.join(
+                    message
+                    for message in (
+                        u'Name used {} times in the same sheet'.format(count) if count > 1 else None,
+                        u'Name also used in {}'.format(u', '.join(
+                            u'{} / {}'.format(*other_location)
+                            for other_location in other_locations
+                            )) if other_locations else None,
+                        )
+                    if message is not None
+                    ),
+                row = None,
+                sheet_name = sheet_name,
+                taxipp_name = taxipp_name,
+                ))
+    issues.sort(key = lambda issue: (issue['bareme'], issue['sheet_name'], issue['row'], issue['taxipp_name'],
+        issue['kind']))
+    return issues
+
+
+def iter_validated_sheet_events(sheet_validation, bareme, sheet_name, events):
+    """Iterate over the events of a sheet (see iter_sheet_events), adding the issues of its rows to sheet_validation.
+
+    The numbers with an unknown format are detected only when the events are decoded with strict_formats = False.
+    """
+    # The date of the values rows of "Impot Revenu" is in the second column (see get_values_rows_dates).
+    date_column_index = 1 if bareme == u'Impot Revenu' else 0
+    issues = sheet_validation['issues']
+    dates_order = None  # 1 when the dates are increasing, -1 when they are decreasing
+    labels_rows = []
+    parameter_column_indexes = None
+    previous_date = None
+    taxipp_names_row = None
+    # By column: the first unit, the earliest amount in euros and the latest amount in francs, as (date, row number).
+    first_unit_by_column_index = {}
+    earliest_euro_by_column_index = {}
+    latest_franc_by_column_index = {}
+    reported_issue_keys = set()
+
+    def add_issue(kind, row_number, taxipp_name, message):
+        issues.append(dict(
+            bareme = bareme,
+            kind = kind,
+            message = message,
+            row = row_number,
+            sheet_name = sheet_name,
+            taxipp_name = taxipp_name,
+            ))
+
+    for event_type, row_index, row in events:
+        if event_type == u'header':
+            taxipp_names_row = row
+        elif event_type == u'label':
+            labels_rows.append(row)
+        elif event_type == u'value':
+            row_number = row_index + 1
+            if parameter_column_indexes is None:
+                parameter_column_indexes = [
+                    column_index
+                    for column_index, role in enumerate(get_column_roles(dict(
+                        labels_rows = labels_rows,
+                        taxipp_names_row = taxipp_names_row,
+                        )))
+                    if role == u'parameter'
+                    ]
+                sheet_validation['taxipp_names'].extend(
+                    taxipp_names_row[column_index]
+                    for column_index in parameter_column_indexes
+                    )
+            date_cell = row[date_column_index] if date_column_index < len(row) else None
+            date, error = cell_to_date_or_year(date_cell, state = conv.default_state)
+            if error is not None or date is None:
+                add_issue(u'invalid_date', row_number, None, u'Invalid date {!r}: {}'.format(date_cell,
+                    error or u'Missing value'))
+                # The converter returns the invalid value: the amounts of the row are not compared by date.
+                date = None
+            else:
+                if previous_date is not None:
+                    if date == previous_date:
+                        add_issue(u'duplicated_date', row_number, None, u'Same date as previous row: {}'.format(
+                            date))
+                    elif dates_order is None:
+                        dates_order = 1 if date > previous_date else -1
+                    elif (1 if date > previous_date else -1) != dates_order:
+                        add_issue(u'non_monotonic_date', row_number, None, u'Date {} {} {} in a sheet in {} order'
+                            .format(date, u'after' if dates_order < 0 else u'before', previous_date,
+                                u'decreasing' if dates_order < 0 else u'increasing'))
+                previous_date = date
+            for column_index in parameter_column_indexes:
+                cell = row[column_index] if column_index < len(row) else None
+                if not isinstance(cell, tuple):
+                    continue
+                unit = cell[1]
+                taxipp_name = taxipp_names_row[column_index]
+                if unit not in known_units:
+                    add_issue(u'unknown_format', row_number, taxipp_name, u'Unknown format "{}" for value {}'.format(
+                        unit, cell[0]))
+                    continue
+                first_unit = first_unit_by_column_index.setdefault(column_index, unit)
+                if (unit == u'%') != (first_unit == u'%') \
+                        and (column_index, u'mixed_units') not in reported_issue_keys:
+                    reported_issue_keys.add((column_index, u'mixed_units'))
+                    add_issue(u'mixed_units', row_number, taxipp_name, u'Value in {} in a column in {}'.format(unit,
+                        first_unit))
+                if date is None or unit == u'%':
+                    continue
+                if unit == u'EUR':
+                    if date < earliest_euro_by_column_index.get(column_index, (datetime.date.max,))[0]:
+                        earliest_euro_by_column_index[column_index] = (date, row_number)
+                elif date > latest_franc_by_column_index.get(column_index, (datetime.date.min,))[0]:
+                    latest_franc_by_column_index[column_index] = (date, row_number)
+                earliest_euro = earliest_euro_by_column_index.get(column_index)
+                latest_franc = latest_franc_by_column_index.get(column_index)
+                if earliest_euro is not None and latest_franc is not None and latest_franc[0] > earliest_euro[0] \
+                        and (column_index, u'franc_after_euro') not in reported_issue_keys:
+                    reported_issue_keys.add((column_index, u'franc_after_euro'))
+                    add_issue(u'franc_after_euro', row_number, taxipp_name,
+                        u'Amount in FRF at row {} ({}) after an amount in EUR at row {} ({})'.format(latest_franc[1],
+                            latest_franc[0], earliest_euro[1], earliest_euro[0]))
+        yield event_type, row_index, row
+
+
+def write_validation_report(issues, report_path):
+    """Write the CSV report of the validation issues."""
+    temporary_path = report_path + '.tmp'
+    with open(temporary_path, 'wb') as report_file:
+        report_file.write(u','.join(report_columns).encode('utf-8') + b'\n')
+        for issue in issues:
+            report_file.write(u','.join(
+                u'' if issue[column] is None
+                    else unicode(issue[column]) if isinstance(issue[column], int)
+                    else u'"{}"'.format(issue[column].replace(u'"', u'""'))
+                for column in report_columns
+                ).encode('utf-8') + b'\n')
+    os.rename(temporary_path, report_path)
@@ -36,18 +36,22 @@ http://www.ipp.eu/fr/outils/baremes-ipp/
 
 import argparse
 import collections
-import datetime
-import itertools
+import io
+import json
 import logging
+import math
+from multiprocessing.pool import ThreadPool
 import os
 import re
 import sys
 import textwrap
 
-from biryani import baseconv, custom_conv, datetimeconv, states
 from biryani import strings
 import xlrd
 
+import conversion_checkpoints
+from ipp_tables_parsing import conv, get_sheet_title_by_name, iter_sheet_events, lazy_converter
+
 
 app_name = os.path.splitext(os.path.basename(__file__))[0]
 baremes = [
@@ -60,7 +64,6 @@ baremes = [
     # u'Taxation du capital',
     # u'Taxes locales',
     ]
-conv = custom_conv(baseconv, datetimeconv, states)
 forbiden_sheets = {
     # u'Impot Revenu': (u'Barème IGR',),
     u'prelevements sociaux': (
@@ -72,42 +75,15 @@ forbiden_sheets = {
         ),
     # u'Taxation indirecte': (u'TVA par produit',),
     }
-french_date_re = re.compile(ur'(?P<day>0?[1-9]|[12]\d|3[01])/(?P<month>0?[1-9]|1[0-2])/(?P<year>[12]\d{3})$')
 log = logging.getLogger(app_name)
 N_ = lambda message: message
+openfisca_unit_by_unit = {
+    u'%': u'/1',
+    u'EUR': u'currency-EUR',
+    u'FRF': u'currency-FRF',
+    }
 parameters = []
-year_re = re.compile(ur'[12]\d{3}$')
-
-
-def input_to_french_date(value, state = None):
-    if value is None:
-        return None, None
-    if state is None:
-        state = conv.default_state
-    match = french_date_re.match(value)
-    if match is None:
-        return value, state._(u'Invalid french date')
-    return datetime.date(int(match.group('year')), int(match.group('month')), int(match.group('day'))), None
-
-
-cell_to_date = conv.condition(
-    conv.test_isinstance(int),
-    conv.pipe(
-        conv.test_between(1914, 2020),
-        conv.function(lambda year: datetime.date(year, 1, 1)),
-        ),
-    conv.pipe(
-        conv.test_isinstance(basestring),
-        conv.first_match(
-            conv.pipe(
-                conv.test(lambda date: year_re.match(date), error = 'Not a valid year'),
-                conv.function(lambda year: datetime.date(year, 1, 1)),
-                ),
-            input_to_french_date,
-            conv.iso8601_input_to_date,
-            ),
-        ),
-    )
+yaml_plain_key_re = re.compile(ur'[-0-9A-Z_a-z]+$')
 
 
 # currency_converter = conv.first_match(
@@ -139,35 +115,37 @@ cell_to_date = conv.condition(
 #     )
 
 
-currency_or_number_converter = conv.first_match(
-    conv.test_isinstance(float),
-    conv.test_isinstance(int),
-    conv.pipe(
-        conv.test_isinstance(basestring),
-        conv.cleanup_line,
-        conv.test_none(),
-        ),
-    conv.pipe(
-        conv.test_isinstance(tuple),
-        conv.test(lambda couple: len(couple) == 2, error = N_(u"Invalid couple length")),
-        conv.struct(
-            (
-                conv.pipe(
-                    conv.test_isinstance((float, int)),
-                    conv.not_none,
-                    ),
-                conv.pipe(
-                    conv.test_isinstance(basestring),
-                    conv.test_in([
-                        u'%',
-                        u'EUR',
-                        u'FRF',
-                        ]),
+@lazy_converter
+def currency_or_number_converter():
+    return conv.first_match(
+        conv.test_isinstance(float),
+        conv.test_isinstance(int),
+        conv.pipe(
+            conv.test_isinstance(basestring),
+            conv.cleanup_line,
+            conv.test_none(),
+            ),
+        conv.pipe(
+            conv.test_isinstance(tuple),
+            conv.test(lambda couple: len(couple) == 2, error = N_(u"Invalid couple length")),
+            conv.struct(
+                (
+                    conv.pipe(
+                        conv.test_isinstance((float, int)),
+                        conv.not_none,
+                        ),
+                    conv.pipe(
+                        conv.test_isinstance(basestring),
+                        conv.test_in([
+                            u'%',
+                            u'EUR',
+                            u'FRF',
+                            ]),
+                        ),
                     ),
                 ),
             ),
-        ),
-    )
+        )
 
 
 def rename_keys(new_key_by_old_key):
@@ -182,49 +160,289 @@ def rename_keys(new_key_by_old_key):
     return rename_keys_converter
 
 
-values_row_converter = conv.pipe(
-    rename_keys({
-        u"Date d'effet": u"Date d'entrée en vigueur",
-        u"Note": u"Notes",
-        u"Publication au JO": u"Parution au JO",
-        u"Publication  JO": u"Parution au JO",
-        u"Publication JO": u"Parution au JO",
-        u"Référence": u"Références législatives",
-        u"Référence législative": u"Références législatives",
-        u"Références législatives                  (taux d'appel)": u"Références législatives",
-        u"Références législatives                  (taux de cotisation)": u"Références législatives",
-        u"Références législatives ou BOI": u"Références législatives",
-        u"Remarques": u"Notes",
-        }),
-    conv.struct(
-        collections.OrderedDict((
-            (u"Date d'entrée en vigueur", conv.pipe(
-                conv.test_isinstance(basestring),
-                conv.iso8601_input_to_date,
-                conv.not_none,
-                )),
-            (u"Références législatives", conv.pipe(
-                conv.test_isinstance(basestring),
-                conv.cleanup_line,
-                )),
-            (u"Parution au JO", conv.pipe(
-                conv.test_isinstance(basestring),
-                conv.iso8601_input_to_date,
-                conv.date_to_iso8601_str,
-                )),
-            (u"Notes", conv.pipe(
-                conv.test_isinstance(basestring),
-                conv.cleanup_line,
-                )),
-            (None, conv.pipe(
-                conv.test_isinstance(basestring),
-                conv.cleanup_line,
-                conv.test_none(),
-                )),
-            )),
-        default = currency_or_number_converter,
-        ),
-    )
+values_row_label_by_label = {
+    u"Date d'effet": u"Date d'entrée en vigueur",
+    u"Note": u"Notes",
+    u"Publication au JO": u"Parution au JO",
+    u"Publication  JO": u"Parution au JO",
+    u"Publication JO": u"Parution au JO",
+    u"Référence": u"Références législatives",
+    u"Référence législative": u"Références législatives",
+    u"Références législatives                  (taux d'appel)": u"Références législatives",
+    u"Références législatives                  (taux de cotisation)": u"Références législatives",
+    u"Références législatives ou BOI": u"Références législatives",
+    u"Remarques": u"Notes",
+    }
+
+
+values_row_converter_by_label = collections.OrderedDict((
+    (u"Date d'entrée en vigueur", lazy_converter(lambda: conv.pipe(
+        conv.test_isinstance(basestring),
+        conv.iso8601_input_to_date,
+        conv.not_none,
+        ))),
+    (u"Références législatives", lazy_converter(lambda: conv.pipe(
+        conv.test_isinstance(basestring),
+        conv.cleanup_line,
+        ))),
+    (u"Parution au JO", lazy_converter(lambda: conv.pipe(
+        conv.test_isinstance(basestring),
+        conv.iso8601_input_to_date,
+        conv.date_to_iso8601_str,
+        ))),
+    (u"Notes", lazy_converter(lambda: conv.pipe(
+        conv.test_isinstance(basestring),
+        conv.cleanup_line,
+        ))),
+    (None, lazy_converter(lambda: conv.pipe(
+        conv.test_isinstance(basestring),
+        conv.cleanup_line,
+        conv.test_none(),
+        ))),
+    ))
+
+
+@lazy_converter
+def values_row_converter():
+    return conv.pipe(
+        rename_keys(values_row_label_by_label),
+        conv.struct(
+            values_row_converter_by_label,
+            default = currency_or_number_converter,
+            ),
+        )
+
+
+def compile_values_row_converter(labels):
+    """Compile values_row_converter into a converter of the values rows of a sheet whose columns labels are given.
+
+    The mapping of the labels (including their renaming) is resolved once for the sheet, into a plan giving, for
+    each label of the converted row, the index of its column and its converter. The converted rows and the errors
+    are the same as with values_row_converter(collections.OrderedDict(itertools.izip(labels, value_row))).
+    """
+    def compile_plan(columns_count):
+        column_index_by_label = collections.OrderedDict(
+            (label, None)
+            for label in values_row_converter_by_label
+            )
+        for column_index, label in enumerate(labels[:columns_count]):
+            column_index_by_label[values_row_label_by_label.get(label, label)] = column_index
+        return [
+            (label, column_index, values_row_converter_by_label.get(label))
+            for label, column_index in column_index_by_label.iteritems()
+            ]
+
+    plan_by_columns_count = {}
+
+    def compiled_values_row_converter(value_row, state = None):
+        if value_row is None:
+            return value_row, None
+        if state is None:
+            state = conv.default_state
+        columns_count = min(len(labels), len(value_row))
+        plan = plan_by_columns_count.get(columns_count)
+        if plan is None:
+            plan = plan_by_columns_count[columns_count] = compile_plan(columns_count)
+        cell_by_label = collections.OrderedDict()
+        errors = collections.OrderedDict()
+        for label, column_index, converter in plan:
+            value = value_row[column_index] if column_index is not None else None
+            if converter is None:
+                # Amount column: the cells that are already valid numbers or (number, unit) couples are kept as is,
+                # the other ones go through currency_or_number_converter, to report the same errors.
+                value_type = type(value)
+                if value is None or value_type in (float, int, bool) or value_type is tuple and len(value) == 2 \
+                        and type(value[0]) in (float, int) and value[1] in (u'%', u'EUR', u'FRF'):
+                    cell_by_label[label] = value
+                    continue
+                converter = currency_or_number_converter
+            value, error = converter(value, state = state)
+            cell_by_label[label] = value
+            if error is not None:
+                errors[label] = error
+        return cell_by_label, errors or None
+
+    return compiled_values_row_converter
+
+
+def add_variable_nodes(sheet_node, taxipp_names_row, labels_rows):
+    """Add the CODE nodes of the variables of a sheet and return them with the labels of their columns."""
+    variable_nodes_and_labels = []
+    for taxipp_name, labels_column in zip(taxipp_names_row, merge_labels_rows(labels_rows)):
+        if not taxipp_name or taxipp_name in (u'date',):
+            continue
+        variable_node = dict(
+            children = [],
+            name = strings.slugify(taxipp_name, separator = u'_'),
+            title = u' - '.join(labels_column) if isinstance(labels_column, tuple) else labels_column,
+            type = u'CODE',
+            )
+        sheet_node['children'].append(variable_node)
+        variable_nodes_and_labels.append((variable_node, labels_column))
+    return variable_nodes_and_labels
+
+
+def collapse_unchanged_values(value_nodes):
+    """Collapse the runs of consecutive VALUE nodes having the same value & unit into a single node.
+
+    A sheet has a values row each time one of its variables changes, so its other variables get repeated values. The
+    node of a run keeps the earliest start date (and the publication date of its row), and merges the distinct law
+    references and notes of the run, from the earliest to the latest.
+    """
+    collapsed_value_nodes = []
+    run = []
+    for value_node in value_nodes + [None]:
+        if run and value_node is not None and (value_node.value, value_node.unit) == (run[0].value, run[0].unit):
+            run.append(value_node)
+            continue
+        if len(run) == 1:
+            collapsed_value_nodes.append(run[0])
+        elif run:
+            run.sort(key = lambda value_node1: value_node1.metadata.start_date)
+            earliest_metadata = run[0].metadata
+            collapsed_value_nodes.append(ValueNode(
+                RowMetadata(
+                    law_reference = merge_texts(value_node1.metadata.law_reference for value_node1 in run),
+                    notes = merge_texts(value_node1.metadata.notes for value_node1 in run),
+                    publication_date = earliest_metadata.publication_date,
+                    start_date = earliest_metadata.start_date,
+                    ),
+                run[0].value,
+                run[0].unit,
+                ))
+        run = [value_node]
+    return collapsed_value_nodes
+
+
+def merge_labels_rows(labels_rows):
+    """Merge the labels rows of a sheet into the label of each column, a tuple when it spans several rows."""
+    labels = []
+    for labels_row in labels_rows:
+        for column_index, label in enumerate(labels_row):
+            if not label:
+                continue
+            while column_index >= len(labels):
+                labels.append([])
+            labels_column = labels[column_index]
+            if not labels_column or labels_column[-1] != label:
+                labels_column.append(label)
+    return [
+        tuple(labels_column1) if len(labels_column1) > 1 else labels_column1[0]
+        for labels_column1 in labels
+        ]
+
+
+def merge_texts(texts):
+    distinct_texts = []
+    for text in texts:
+        if text and text not in distinct_texts:
+            distinct_texts.append(text)
+    return u' | '.join(distinct_texts) or None
+
+
+class RowMetadata(object):
+    """Metadata of a values row, shared by the VALUE nodes of all the variables of a sheet."""
+    __slots__ = ('law_reference', 'notes', 'publication_date', 'start_date')
+
+    def __init__(self, law_reference = None, notes = None, publication_date = None, start_date = None):
+        self.law_reference = law_reference
+        self.notes = notes
+        self.publication_date = publication_date
+        self.start_date = start_date
+
+
+class ValueNode(object):
+    """VALUE node of the parameters tree: a value and its unit, referencing the metadata of its values row."""
+    __slots__ = ('metadata', 'unit', 'value')
+    type = u'VALUE'
+
+    def __init__(self, metadata, value, unit = None):
+        self.metadata = metadata
+        self.unit = unit
+        self.value = value
+
+    def to_dict(self):
+        metadata = self.metadata
+        return dict(
+            law_reference = metadata.law_reference,
+            notes = metadata.notes,
+            publication_date = metadata.publication_date,
+            start_date = metadata.start_date,
+            type = self.type,
+            unit = self.unit,
+            value = self.value,
+            )
+
+
+def convert_sheet(book, sheet_name, sheet_title_by_name):
+    """Convert a sheet to a NODE.
+
+    For a summary sheet, return instead the titles of the sheets by name. Return None for a sheet without title.
+    """
+    if sheet_name.startswith(u'Sommaire'):
+        linked_sheet_title_by_name = get_sheet_title_by_name(book, sheet_name)
+        book.unload_sheet(sheet_name)
+        return linked_sheet_title_by_name
+
+    sheet_title = sheet_title_by_name.get(sheet_name)
+    if sheet_title is None:
+        log.warning(u"Missing title for sheet {} in summary".format(sheet_name))
+        return None
+
+    sheet_node = dict(
+        children = [],
+        name = strings.slugify(sheet_name, separator = u'_'),
+        text = [],
+        title = sheet_title,
+        type = u'NODE',
+        )
+    descriptions_lines = []
+    labels_rows = []
+    notes_lines = []
+    taxipp_names_row = None
+    # The VALUE nodes are added to the variables as soon as their values rows are read: the rows are not buffered.
+    variable_nodes_and_labels = None
+    for event_type, row_index, row in iter_sheet_events(book, sheet_name):
+        if event_type == u'header':
+            taxipp_names_row = row
+        elif event_type == u'label':
+            labels_rows.append(row)
+        elif event_type == u'value':
+            if variable_nodes_and_labels is None:
+                variable_nodes_and_labels = add_variable_nodes(sheet_node, taxipp_names_row, labels_rows)
+                convert_values_row = compile_values_row_converter(merge_labels_rows(labels_rows))
+            cell_by_label, errors = convert_values_row(row, state = conv.default_state)
+            assert errors is None, "Errors in {}:\n{}".format(cell_by_label, errors)
+            # Metadata of the values rows are stored once per row and shared by the VALUE nodes of all variables.
+            row_metadata = RowMetadata(
+                law_reference = cell_by_label[u'Références législatives'],
+                notes = cell_by_label[u'Notes'],
+                publication_date = cell_by_label[u"Parution au JO"],
+                start_date = cell_by_label[u"Date d'entrée en vigueur"],
+                )
+            for variable_node, labels_column in variable_nodes_and_labels:
+                amount_and_unit = cell_by_label[labels_column]
+                variable_node['children'].append(ValueNode(
+                    row_metadata,
+                    amount_and_unit[0] if isinstance(amount_and_unit, tuple) else amount_and_unit,
+                    amount_and_unit[1] if isinstance(amount_and_unit, tuple) else None,
+                    ))
+        elif event_type == u'note':
+            notes_lines.append(u' | '.join(
+                cell for cell in row
+                if cell
+                ))
+        elif event_type == u'description':
+            descriptions_lines.append(u' | '.join(
+                cell for cell in row
+                if cell
+                ))
+    if variable_nodes_and_labels is None:
+        add_variable_nodes(sheet_node, taxipp_names_row, labels_rows)
+    sheet_node['text'] = notes_lines + [None] + descriptions_lines if notes_lines else descriptions_lines
+
+    book.unload_sheet(sheet_name)
+    return sheet_node
 
 
 def escape_xml(value):
@@ -237,25 +455,99 @@ def escape_xml(value):
     return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
 
 
-def get_hyperlink(sheet, row_index, column_index):
-    return sheet.hyperlink_map.get((row_index, column_index))
+def dump_json(document):
+    return json.dumps(document, ensure_ascii = False, indent = 2, separators = (',', ': ')) + u'\n'
 
 
-def get_unmerged_cell_coordinates(row_index, column_index, merged_cells_tree):
-    unmerged_cell_coordinates = merged_cells_tree.get(row_index, {}).get(column_index)
-    if unmerged_cell_coordinates is None:
-        return row_index, column_index
-    return unmerged_cell_coordinates
+def dump_yaml(document, indent = 0):
+    """Serialize a document made of mappings, lists & scalars to YAML, without requiring a YAML library.
+
+    Strings are written as JSON strings, which are valid YAML double-quoted scalars.
+    """
+    lines = []
+    prefix = u'  ' * indent
+    for key, value in document.iteritems():
+        key = key if yaml_plain_key_re.match(key) else yaml_scalar(key)
+        if isinstance(value, dict):
+            if value:
+                lines.append(u'{}{}:\n'.format(prefix, key))
+                lines.append(dump_yaml(value, indent = indent + 1))
+            else:
+                lines.append(u'{}{}: {{}}\n'.format(prefix, key))
+        elif isinstance(value, list):
+            if value:
+                lines.append(u'{}{}:\n'.format(prefix, key))
+                lines.extend(
+                    u'{}- {}\n'.format(prefix, yaml_scalar(item))
+                    for item in value
+                    )
+            else:
+                lines.append(u'{}{}: []\n'.format(prefix, key))
+        else:
+            lines.append(u'{}{}: {}\n'.format(prefix, key, yaml_scalar(value)))
+    return u''.join(lines)
+
+
+def iter_parameter_documents(root_node):
+    """Iterate over the documents of the OpenFisca parameters files: an index for each sheet and a file per
+    parameter (CODE node).
+    """
+    for sheet_node in root_node['children']:
+        text = u'\n'.join(line or u'' for line in sheet_node.get('text') or []).strip()
+        yield (sheet_node['name'], u'index'), collections.OrderedDict(
+            (key, value)
+            for key, value in (
+                (u'description', sheet_node['title']),
+                (u'documentation', text or None),
+                )
+            if value is not None
+            )
+        for variable_node in sheet_node['children']:
+            values = collections.OrderedDict()
+            for value_node in variable_node['children']:
+                metadata = value_node.metadata
+                start_date = metadata.start_date.isoformat()
+                if start_date in values:
+                    log.warning(u'Ignoring duplicate value at {} for parameter {}/{}'.format(start_date,
+                        sheet_node['name'], variable_node['name']))
+                    continue
+                values[start_date] = collections.OrderedDict(
+                    (key, value)
+                    for key, value in (
+                        (u'value', value_node.value),
+                        (u'unit', openfisca_unit_by_unit.get(value_node.unit, value_node.unit)),
+                        (u'reference', metadata.law_reference),
+                        (u'publication_date', metadata.publication_date),
+                        (u'notes', metadata.notes),
+                        )
+                    if value is not None or key == u'value'
+                    )
+            yield (sheet_node['name'], variable_node['name']), collections.OrderedDict((
+                (u'description', variable_node['title']),
+                (u'values', values),
+                ))
 
 
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--collapse-unchanged', action = 'store_true', default = False,
+        help = 'collapse the consecutive identical values of each parameter into their earliest one')
     parser.add_argument('-d', '--dir', default = 'Baremes_IPP_2015', help = 'path of IPP XLS directory')
+    parser.add_argument('-f', '--format', choices = sorted(node_writer_by_format), default = 'xml',
+        help = 'output format: a single XML document on standard output, or one JSON or YAML file per parameter')
+    parser.add_argument('-o', '--output-dir', default = 'parameters',
+        help = 'path of the directory where to write the JSON or YAML files')
     parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    conversion_checkpoints.add_arguments(parser)
     args = parser.parse_args()
     # args.dir = path
     logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stdout)
 
+    checkpoints_dir = conversion_checkpoints.get_checkpoints_dir(args)
+    # The keys of the checkpoints of the run, removed when it ends without errors.
+    checkpoints_keys = set()
+    errors = [] if args.keep_going else None
+
     root_node = dict(
         children = [],
         name = "root",
@@ -288,7 +580,8 @@ def main():
             log.warning("Skipping file {} that doesn't exist: {}".format(bareme, xls_path))
             continue
         log.info(u'Parsing file {}'.format(bareme))
-        book = xlrd.open_workbook(filename = xls_path, formatting_info = True)
+        book = xlrd.open_workbook(filename = xls_path, formatting_info = True, on_demand = True)
+        stamp = conversion_checkpoints.get_file_stamp(xls_path)
 
         sheet_names = [
             sheet_name
@@ -299,205 +592,26 @@ def main():
         sheet_title_by_name = {}
         for sheet_name in sheet_names:
             log.info(u'  Parsing sheet {}'.format(sheet_name))
-            sheet = book.sheet_by_name(sheet_name)
-
-            # Extract coordinates of merged cells.
-            merged_cells_tree = {}
-            for row_low, row_high, column_low, column_high in sheet.merged_cells:
-                for row_index in range(row_low, row_high):
-                    cell_coordinates_by_merged_column_index = merged_cells_tree.setdefault(
-                        row_index, {})
-                    for column_index in range(column_low, column_high):
-                        cell_coordinates_by_merged_column_index[column_index] = (row_low, column_low)
-
+            checkpoint_key = (app_name, bareme, sheet_name)
+            checkpoints_keys.add(checkpoint_key)
+            sheet_result = conversion_checkpoints.run_step(checkpoints_dir, checkpoint_key, stamp, args.resume, errors,
+                convert_sheet, book, sheet_name, sheet_title_by_name)
             if sheet_name.startswith(u'Sommaire'):
-                # Associate the titles of the sheets to their Excel names.
-                for row_index in range(sheet.nrows):
-                    linked_sheet_number = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, 2)
-                    if isinstance(linked_sheet_number, int):
-                        linked_sheet_title = transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, 3)
-                        if linked_sheet_title is not None:
-                            hyperlink = get_hyperlink(sheet, row_index, 3)
-                            if hyperlink is not None and hyperlink.type == u'workbook':
-                                linked_sheet_name = hyperlink.textmark.split(u'!', 1)[0].strip(u'"').strip(u"'")
-                                sheet_title_by_name[linked_sheet_name] = linked_sheet_title
-                continue
-
-            descriptions_rows = []
-            labels_rows = []
-            notes_rows = []
-            state = 'taxipp_names'
-            taxipp_names_row = None
-            values_rows = []
-            for row_index in range(sheet.nrows):
-                columns_count = len(sheet.row_values(row_index))
-                if state == 'taxipp_names':
-                    taxipp_names_row = [
-                        taxipp_name
-                        for taxipp_name in (
-                            transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, column_index)
-                            for column_index in range(columns_count)
-                            )
-                        ]
-                    state = 'labels'
-                    continue
-                if state == 'labels':
-                    first_cell_value = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, 0)
-                    date_or_year, error = conv.pipe(
-                        conv.test_isinstance((int, basestring)),
-                        cell_to_date,
-                        conv.not_none,
-                        )(first_cell_value, state = conv.default_state)
-                    if error is not None:
-                        # First cell of row is not a date => Assume it is a label.
-                        labels_rows.append([
-                            transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, column_index)
-                            for column_index in range(columns_count)
-                            ])
-                        continue
-                    state = 'values'
-                if state == 'values':
-                    first_cell_value = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, 0)
-                    if first_cell_value is None or isinstance(first_cell_value, (int, basestring)):
-                        date_or_year, error = cell_to_date(first_cell_value, state = conv.default_state)
-                        if error is None:
-                            # First cell of row is a valid date or year.
-                            values_row = [
-                                transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, column_index)
-                                for column_index in range(columns_count)
-                                ]
-                            if date_or_year is not None:
-                                assert date_or_year.year < 2601, 'Invalid date {} in {} at row {}'.format(date_or_year,
-                                    sheet_name, row_index + 1)
-                                values_rows.append(values_row)
-                                continue
-                            if all(value in (None, u'') for value in values_row):
-                                # If first cell is empty and all other cells in line are also empty, ignore this line.
-                                continue
-                            # First cell has no date and other cells in row are not empty => Assume it is a note.
-                    state = 'notes'
-                if state == 'notes':
-                    first_cell_value = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, 0)
-                    if isinstance(first_cell_value, basestring) and first_cell_value.strip().lower() == 'notes':
-                        notes_rows.append([
-                            transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, column_index)
-                            for column_index in range(columns_count)
-                            ])
-                        continue
-                    state = 'description'
-                assert state == 'description'
-                descriptions_rows.append([
-                    transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, column_index)
-                    for column_index in range(columns_count)
-                    ])
-
-            text_lines = []
-            for row in notes_rows:
-                text_lines.append(u' | '.join(
-                    cell for cell in row
-                    if cell
-                    ))
-            if text_lines:
-                text_lines.append(None)
-            for row in descriptions_rows:
-                text_lines.append(u' | '.join(
-                    cell for cell in row
-                    if cell
-                    ))
-
-            sheet_title = sheet_title_by_name.get(sheet_name)
-            if sheet_title is None:
-                log.warning(u"Missing title for sheet {} in summary".format(sheet_name))
-                continue
-            labels = []
-            for labels_row in labels_rows:
-                for column_index, label in enumerate(labels_row):
-                    if not label:
-                        continue
-                    while column_index >= len(labels):
-                        labels.append([])
-                    labels_column = labels[column_index]
-                    if not labels_column or labels_column[-1] != label:
-                        labels_column.append(label)
-            labels = [
-                tuple(labels_column1) if len(labels_column1) > 1 else labels_column1[0]
-                for labels_column1 in labels
-                ]
-
-            cell_by_label_rows = []
-            for value_row in values_rows:
-                cell_by_label = collections.OrderedDict(itertools.izip(labels, value_row))
-                cell_by_label, errors = values_row_converter(cell_by_label, state = conv.default_state)
-                assert errors is None, "Errors in {}:\n{}".format(cell_by_label, errors)
-                cell_by_label_rows.append(cell_by_label)
-
-            sheet_node = dict(
-                children = [],
-                name = strings.slugify(sheet_name, separator = u'_'),
-                text = text_lines,
-                title = sheet_title,
-                type = u'NODE',
-                )
-            root_node['children'].append(sheet_node)
-
-            for taxipp_name, labels_column in zip(taxipp_names_row, labels):
-                if not taxipp_name or taxipp_name in (u'date',):
-                    continue
-                variable_node = dict(
-                    children = [],
-                    name = strings.slugify(taxipp_name, separator = u'_'),
-                    title = u' - '.join(labels_column) if isinstance(labels_column, tuple) else labels_column,
-                    type = u'CODE',
-                    )
-                sheet_node['children'].append(variable_node)
-
-                for cell_by_label in cell_by_label_rows:
-                    amount_and_unit = cell_by_label[labels_column]
-                    variable_node['children'].append(dict(
-                        law_reference = cell_by_label[u'Références législatives'],
-                        notes = cell_by_label[u'Notes'],
-                        publication_date = cell_by_label[u"Parution au JO"],
-                        start_date = cell_by_label[u"Date d'entrée en vigueur"],
-                        type = u'VALUE',
-                        unit = amount_and_unit[1] if isinstance(amount_and_unit, tuple) else None,
-                        value = amount_and_unit[0] if isinstance(amount_and_unit, tuple) else amount_and_unit,
-                        ))
-
-            # dates = [
-            #     conv.check(cell_to_date)(
-            #         row[1] if bareme == u'Impot Revenu' else row[0],
-            #         state = conv.default_state,
-            #         )
-            #     for row in values_rows
-            #     ]
-            # for column_index, taxipp_name in enumerate(taxipp_names_row):
-            #     if taxipp_name and strings.slugify(taxipp_name) not in (
-            #             'date',
-            #             'date-ir',
-            #             'date-rev',
-            #             'note',
-            #             'notes',
-            #             'ref-leg',
-            #             ):
-            #         vector = [
-            #             transform_cell_value(date, row[column_index])
-            #             for date, row in zip(dates, values_rows)
-            #             ]
-            #         vector = [
-            #             cell if not isinstance(cell, basestring) or cell == u'nc' else '-'
-            #             for cell in vector
-            #             ]
-            #         # vector_by_taxipp_name[taxipp_name] = pd.Series(vector, index = dates)
-            #         vector_by_taxipp_name[taxipp_name] = vector
-            #
+                sheet_title_by_name.update(sheet_result or {})
+            elif sheet_result is not None:
+                if args.collapse_unchanged:
+                    for variable_node in sheet_result['children']:
+                        variable_node['children'] = collapse_unchanged_values(variable_node['children'])
+                root_node['children'].append(sheet_result)
+        book.release_resources()
 
-    print_node(root_node)
+    node_writer_by_format[args.format](root_node, args.output_dir)
 
-    return 0
+    return conversion_checkpoints.end_run(checkpoints_dir, checkpoints_keys, errors or [])
 
 
 def print_node(node, indent = 0):
-    attributes = node.copy()
+    attributes = node.to_dict() if isinstance(node, ValueNode) else node.copy()
     children = attributes.pop('children', None)
     text = attributes.pop('text', None)
     if text:
@@ -528,96 +642,62 @@ def print_node(node, indent = 0):
         print u'{}</{}>'.format(u'  ' * indent, type).encode('utf-8')
 
 
-def transform_cell_value(date, cell_value):
-    if isinstance(cell_value, tuple):
-        value, currency = cell_value
-        if currency == u'FRF':
-            if date < datetime.date(1960, 1, 1):
-                return round(value / (100 * 6.55957), 2)
-            return round(value / 6.55957, 2)
-        return value
-    return cell_value
+def write_parameter_files(root_node, output_dir, extension, dump, threads_count = 8):
+    """Write a file per parameter, serializing all the documents first, then writing the files concurrently."""
+    contents_by_path = collections.OrderedDict(
+        (os.path.join(output_dir, *path_fragments) + extension, dump(document))
+        for path_fragments, document in iter_parameter_documents(root_node)
+        )
+    for directory in set(os.path.dirname(path) for path in contents_by_path):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
 
+    def write_file(path_and_content):
+        path, content = path_and_content
+        with io.open(path, 'w', encoding = 'utf-8') as parameter_file:
+            parameter_file.write(content)
 
-def transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, column_index):
-    """Convert an XLS cell (type & value) to an unicode string.
+    pool = ThreadPool(threads_count)
+    try:
+        pool.map(write_file, contents_by_path.iteritems(), chunksize = 64)
+    finally:
+        pool.close()
+        pool.join()
+    log.info(u'{} parameters files written in {}'.format(len(contents_by_path), output_dir))
 
-    Code taken from http://code.activestate.com/recipes/546518-simple-conversion-of-excel-files-into-csv-and-yaml/
 
-    Type Codes:
-    EMPTY   0
-    TEXT    1 a Unicode string
-    NUMBER  2 float
-    DATE    3 float
-    BOOLEAN 4 int; 1 means TRUE, 0 means FALSE
-    ERROR   5
-    """
-    unmerged_cell_coordinates = merged_cells_tree.get(row_index, {}).get(column_index)
-    if unmerged_cell_coordinates is None:
-        unmerged_row_index = row_index
-        unmerged_column_index = column_index
-    else:
-        unmerged_row_index, unmerged_column_index = unmerged_cell_coordinates
-    type = sheet.row_types(unmerged_row_index)[unmerged_column_index]
-    value = sheet.row_values(unmerged_row_index)[unmerged_column_index]
-    if type == 0:
-        value = None
-    elif type == 1:
-        if not value:
-            value = None
-    elif type == 2:
-        # NUMBER
-        value_int = int(value)
-        if value_int == value:
-            value = value_int
-        xf_index = sheet.cell_xf_index(row_index, column_index)
-        xf = book.xf_list[xf_index]  # Get an XF object.
-        format_key = xf.format_key
-        format = book.format_map[format_key]  # Get a Format object.
-        format_str = format.format_str  # This is the "number format string".
-        if format_str in (
-                u'0',
-                u'General',
-                u'GENERAL',
-                u'_-* #,##0\ _€_-;\-* #,##0\ _€_-;_-* \-??\ _€_-;_-@_-',
-                ) or format_str.endswith(u'0.00'):
-            return value
-        if u'€' in format_str:
-            return (value, u'EUR')
-        if u'FRF' in format_str or ur'\F\R\F' in format_str:
-            return (value, u'FRF')
-        assert format_str.endswith(u'%'), 'Unexpected format "{}" for value: {}'.format(format_str, value)
-        return (value, u'%')
-    elif type == 3:
-        # DATE
-        y, m, d, hh, mm, ss = xlrd.xldate_as_tuple(value, book.datemode)
-        date = u'{0:04d}-{1:02d}-{2:02d}'.format(y, m, d) if any(n != 0 for n in (y, m, d)) else None
-        value = u'T'.join(
-            fragment
-            for fragment in (
-                date,
-                (u'{0:02d}:{1:02d}:{2:02d}'.format(hh, mm, ss)
-                    if any(n != 0 for n in (hh, mm, ss)) or date is None
-                    else None),
-                )
-            if fragment is not None
-            )
-    elif type == 4:
-        value = bool(value)
-    elif type == 5:
-        # ERROR
-        value = xlrd.error_text_from_code[value]
-    # elif type == 6:
-    #     TODO
-    # else:
-    #     assert False, str((type, value))
-    return value
-
-
-def transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, column_index):
-    cell = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, column_index)
-    assert cell is None or isinstance(cell, basestring), u'Expected a string. Got: {}'.format(cell).encode('utf-8')
-    return cell
+def write_xml(root_node, output_dir):
+    print_node(root_node)
+
+
+def yaml_scalar(value):
+    if value is None:
+        return u'null'
+    if isinstance(value, bool):
+        return u'true' if value else u'false'
+    if isinstance(value, (int, long)):
+        return unicode(value)
+    if isinstance(value, float):
+        # YAML 1.1 floats need a dot in their mantissa (1e-05 would be read as a string) and spell infinity and NaN
+        # as .inf & .nan.
+        if math.isnan(value):
+            return u'.nan'
+        if math.isinf(value):
+            return u'.inf' if value > 0 else u'-.inf'
+        mantissa, exponent_mark, exponent = repr(value).decode('utf-8').partition(u'e')
+        if u'.' not in mantissa:
+            mantissa += u'.0'
+        return mantissa + exponent_mark + exponent
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+    return json.dumps(unicode(value), ensure_ascii = False)
+
+
+node_writer_by_format = dict(
+    json = lambda root_node, output_dir: write_parameter_files(root_node, output_dir, u'.json', dump_json),
+    xml = write_xml,
+    yaml = lambda root_node, output_dir: write_parameter_files(root_node, output_dir, u'.yaml', dump_yaml),
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Memory-mappable binary store of the aggregated tables of IPP's tax benefit tables.
+
+The store is a single file, meant to be shared by many worker processes: each of them maps it in memory and reads the
+parameters through NumPy views, so that all the workers share the same page-cache copy of the file.
+
+Layout (all offsets are aligned on 64 bytes):
+- magic string "IPPSTORE", format version (uint32) and header length (uint32);
+- UTF-8 JSON header, giving for each bareme its columns (TAXIPP names) and the offsets of its arrays;
+- for each bareme, its dates as int64 days since 1970-01-01, followed by its values as a contiguous float64 array
+  of shape (columns count, dates count): the vector of each parameter is contiguous.
+"""
+
+
+import collections
+import datetime
+import json
+import mmap
+import struct
+
+import numpy as np
+
+
+alignment = 64
+epoch = datetime.date(1970, 1, 1)
+magic = b'IPPSTORE'
+prefix_format = '<8sII'
+version = 1
+
+
+def align(offset):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def get_parameter_vector(store, bareme, taxipp_name):
+    """Return the dates and the values of a parameter, as read-only views on the store."""
+    table = store['tables'][bareme]
+    return table['dates'], table['values'][table['column_index_by_name'][taxipp_name]]
+
+
+def read_parameter_store(file_path):
+    """Map a parameter store in memory.
+
+    No array is copied: the returned tables contain read-only NumPy views on the mapped file.
+    """
+    with open(file_path, 'rb') as store_file:
+        buffer = mmap.mmap(store_file.fileno(), 0, access = mmap.ACCESS_READ)
+    prefix_size = struct.calcsize(prefix_format)
+    file_magic, file_version, header_length = struct.unpack(prefix_format, buffer[:prefix_size])
+    assert file_magic == magic, 'Not a parameter store: {}'.format(file_path)
+    assert file_version == version, 'Unsupported parameter store version {}: {}'.format(file_version, file_path)
+    header = json.loads(buffer[prefix_size:prefix_size + header_length].decode('utf-8'))
+    tables = collections.OrderedDict()
+    for table_header in header['tables']:
+        columns = table_header['columns']
+        dates_count = table_header['dates_count']
+        tables[table_header['bareme']] = dict(
+            column_index_by_name = dict(
+                (taxipp_name, column_index)
+                for column_index, taxipp_name in enumerate(columns)
+                ),
+            columns = columns,
+            dates = np.frombuffer(buffer, dtype = '<i8', count = dates_count,
+                offset = table_header['dates_offset']).view('<M8[D]'),
+            values = np.frombuffer(buffer, dtype = '<f8', count = len(columns) * dates_count,
+                offset = table_header['values_offset']).reshape((len(columns), dates_count)),
+            )
+    return dict(
+        buffer = buffer,
+        tables = tables,
+        )
+
+
+def table_to_arrays(data_frame):
+    """Convert an aggregated table (a DataFrame indexed by dates) to arrays of days and of float64 values.
+
+    "-" (abolished parameter) counts as 0 and any other non numeric value is stored as NaN.
+    """
+    days = np.array(
+        [
+            ((date.date() if isinstance(date, datetime.datetime) else date) - epoch).days
+            for date in data_frame.index
+            ],
+        dtype = '<i8',
+        )
+    values = np.empty((len(data_frame.columns), len(data_frame.index)), dtype = '<f8')
+    for column_index, column in enumerate(data_frame.columns):
+        for date_index, value in enumerate(data_frame[column].values):
+            if value == '-':
+                value = 0.
+            elif not isinstance(value, (bool, float, int, long, np.number)):
+                value = np.nan
+            values[column_index, date_index] = value
+    return days, values
+
+
+def write_parameter_store(file_path, table_by_bareme):
+    """Write the aggregated tables of several baremes in a single memory-mappable file."""
+    arrays_by_bareme = collections.OrderedDict(
+        (bareme, table_to_arrays(data_frame))
+        for bareme, data_frame in table_by_bareme.iteritems()
+        )
+
+    # The header contains the offsets of the arrays, which depend on the header length: reserve enough room for it.
+    tables_header = [
+        collections.OrderedDict((
+            (u'bareme', bareme),
+            (u'columns', [unicode(column) for column in data_frame.columns]),
+            (u'dates_count', len(data_frame.index)),
+            (u'dates_offset', 0),
+            (u'values_offset', 0),
+            ))
+        for bareme, data_frame in table_by_bareme.iteritems()
+        ]
+    prefix_size = struct.calcsize(prefix_format)
+    header_length = len(json.dumps(dict(tables = tables_header)).encode('utf-8')) + 32 * len(tables_header) * 2
+    offset = align(prefix_size + header_length)
+    for table_header, (days, values) in zip(tables_header, arrays_by_bareme.itervalues()):
+        table_header[u'dates_offset'] = offset
+        offset = align(offset + days.nbytes)
+        table_header[u'values_offset'] = offset
+        offset = align(offset + values.nbytes)
+    header = json.dumps(dict(tables = tables_header)).encode('utf-8')
+    assert len(header) <= header_length
+
+    with open(file_path, 'wb') as store_file:
+        store_file.write(struct.pack(prefix_format, magic, version, len(header)))
+        store_file.write(header)
+        for table_header, (days, values) in zip(tables_header, arrays_by_bareme.itervalues()):
+            store_file.write(b'\0' * (table_header[u'dates_offset'] - store_file.tell()))
+            store_file.write(days.tobytes())
+            store_file.write(b'\0' * (table_header[u'values_offset'] - store_file.tell()))
+            store_file.write(np.ascontiguousarray(values).tobytes())
@@ -36,360 +36,223 @@ http://www.ipp.eu/fr/outils/baremes-ipp/
 
 import argparse
 import collections
-import datetime
 import logging
 import os
-import re
 import sys
+import time
 
-from biryani import baseconv, custom_conv, datetimeconv, states
-from biryani import strings
-import numpy as np
-import pandas as pd
 import xlrd
 
+import conversion_checkpoints
+from csv_table_writer import extension_by_compression, write_table_csv
+from ipp_tables_parsing import compute_sheet_fingerprint, get_sheet_names
+
 app_name = os.path.splitext(os.path.basename(__file__))[0]
-conv = custom_conv(baseconv, datetimeconv, states)
-french_date_re = re.compile(ur'(?P<day>0?[1-9]|[12]\d|3[01])/(?P<month>0?[1-9]|1[0-2])/(?P<year>[12]\d{3})$')
+baremes = [
+    u'Prestations',
+    u'Chomage',
+    u'Impot Revenu',
+    u'prelevements sociaux',
+    u'Taxation indirecte',
+    u'Taxation du capital',
+    u'Taxes locales',
+    u'Marche du travail',
+    ]
 log = logging.getLogger(app_name)
-N_ = lambda message: message
 parameters = []
-year_re = re.compile(ur'[12]\d{3}$')
-
-
-def input_to_french_date(value, state = None):
-    if value is None:
-        return None, None
-    if state is None:
-        state = conv.default_state
-    match = french_date_re.match(value)
-    if match is None:
-        return value, state._(u'Invalid french date')
-    return datetime.date(int(match.group('year')), int(match.group('month')), int(match.group('day'))), None
-
-
-cell_to_date_or_year = conv.condition(
-    conv.test_isinstance(int),
-    conv.pipe(
-        conv.test_between(1914, 2020),
-        conv.function(lambda year: datetime.date(year, 1, 1)),
-        ),
-    conv.pipe(
-        conv.test_isinstance(basestring),
-        conv.first_match(
-            conv.pipe(
-                conv.test(lambda date: year_re.match(date), error = 'Not a valid year'),
-                conv.function(lambda year: datetime.date(year, 1, 1)),
-                ),
-            input_to_french_date,
-            conv.iso8601_input_to_date,
-            ),
-        ),
-    )
-
-
-currency_converter = conv.first_match(
-    conv.pipe(
-        conv.test_isinstance(basestring),
-        conv.cleanup_line,
-        conv.test_none(),
-        ),
-    conv.pipe(
-        conv.test_isinstance(tuple),
-        conv.test(lambda couple: len(couple) == 2, error = N_(u"Invalid couple length")),
-        conv.struct(
-            (
-                conv.pipe(
-                    conv.test_isinstance((float, int)),
-                    conv.not_none,
-                    ),
-                conv.pipe(
-                    conv.test_isinstance(basestring),
-                    conv.test_in([
-                        u'EUR',
-                        u'FRF',
-                        ]),
-                    ),
-                ),
-            ),
-        ),
-    )
-
-
-pss_converters = collections.OrderedDict((
-    (u"Date d'effet", conv.pipe(
-        conv.test_isinstance(basestring),
-        conv.iso8601_input_to_date,
-        conv.date_to_iso8601_str,
-        conv.not_none,
-        )),
-    (u'Plafond de la Sécurité sociale (mensuel)', currency_converter),
-    (u'Plafond de la Sécurité sociale (annuel)', currency_converter),
-    (u'Référence législative', conv.pipe(
-        conv.test_isinstance(basestring),
-        conv.cleanup_line,
-        )),
-    (u'Parution au JO', conv.pipe(
-        conv.test_isinstance(basestring),
-        conv.iso8601_input_to_date,
-        conv.date_to_iso8601_str,
-        )),
-    (u'Notes', conv.pipe(
-        conv.test_isinstance(basestring),
-        conv.cleanup_line,
-        )),
-    (None, conv.pipe(
-        conv.test_isinstance(basestring),
-        conv.cleanup_line,
-        conv.test_none(),
-        )),
-    ))
-
-
-def get_unmerged_cell_coordinates(row_index, column_index, merged_cells_tree):
-    unmerged_cell_coordinates = merged_cells_tree.get(row_index, {}).get(column_index)
-    if unmerged_cell_coordinates is None:
-        return row_index, column_index
-    return unmerged_cell_coordinates
 
 
 def main(path, date, option = 'all_months', month = 1):
     parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--compression', choices = sorted(extension_by_compression),
+        help = 'compress the CSV tables (zstd requires the zstandard package)')
     parser.add_argument('-d', '--dir', default = path + date, help = 'path of IPP XLS directory')
+    parser.add_argument('--debounce', default = 0.2, type = float,
+        help = 'in watch mode, delay without any save before converting the saved workbooks (in seconds)')
+    parser.add_argument('-s', '--store', help = 'path of a memory-mappable parameter store where to write the tables')
     parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    parser.add_argument('--validation-report',
+        help = 'path of a CSV report of the issues of the tables (dates, units, formats, duplicated TAXIPP names), '
+            'checked while the sheets are parsed')
+    parser.add_argument('-w', '--watch', action = 'store_true', default = False,
+        help = 'after the conversion, watch the IPP XLS directory and convert again the saved workbooks')
+    conversion_checkpoints.add_arguments(parser)
     args = parser.parse_args()
     # args.dir = path
     logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stdout)
 
-    forbiden_sheets = {
-        u'Impot Revenu': (u'Barème IGR',),
-        u'prelevements sociaux': (u'Abréviations', u'ASSIETTE PU', u'AUBRYI',  u'AUBRYII'),
-        u'Taxation indirecte': (u'TVA par produit',),
-        }
-    baremes = [u'Prestations', u'Chomage', u'Impot Revenu', u'prelevements sociaux', u'Taxation indirecte', u'Taxation du capital', u'Taxes locales', u'Marche du travail']
+    # pandas & NumPy are loaded only once the arguments are parsed, so that --help & argument errors are immediate.
+    from ipp_tables_aggregation import convert_sheet_to_vectors
+
+    directory = args.dir.decode('utf-8')
+    checkpoints_dir = conversion_checkpoints.get_checkpoints_dir(args)
+    # The keys of the checkpoints of the run, removed when it ends without errors.
+    checkpoints_keys = set()
+    # In watch mode, a failing sheet must not stop the watch.
+    errors = [] if args.keep_going or args.watch else None
+    # In watch mode, the converted sheets are kept with the fingerprints of their content, to convert again only the
+    # sheets modified by a save.
+    fingerprint_and_result_by_sheet_key = {}
+    # The issues found while parsing the sheets, by (bareme, sheet name). They are checkpointed with the conversion of
+    # their sheet, so that the report covers also the sheets restored from the checkpoints or from the watch cache.
+    sheet_validation_by_key = collections.OrderedDict() if args.validation_report is not None else None
+
+    def convert_sheet(book, bareme, sheet_name):
+        log.info(u'  Parsing sheet {}'.format(sheet_name))
+        if args.watch:
+            fingerprint = compute_sheet_fingerprint(book, book.sheet_by_name(sheet_name))
+            fingerprint_and_result = fingerprint_and_result_by_sheet_key.get((bareme, sheet_name))
+            if fingerprint_and_result is not None and fingerprint_and_result[0] == fingerprint:
+                book.unload_sheet(sheet_name)
+                sheet_result = fingerprint_and_result[1]
+                if sheet_validation_by_key is not None:
+                    sheet_result, sheet_validation_by_key[(bareme, sheet_name)] = sheet_result
+                return sheet_result
+        if sheet_validation_by_key is None:
+            checkpoint_key = (app_name, bareme, sheet_name)
+            checkpoints_keys.add(checkpoint_key)
+            sheet_result = conversion_checkpoints.run_step(checkpoints_dir, checkpoint_key,
+                conversion_checkpoints.get_file_stamp(get_xls_path(directory, bareme)), args.resume, errors,
+                convert_sheet_to_vectors, book, bareme, sheet_name)
+        else:
+            checkpoint_key = (app_name, bareme, sheet_name, u'validated')
+            checkpoints_keys.add(checkpoint_key)
+            sheet_result = conversion_checkpoints.run_step(checkpoints_dir, checkpoint_key,
+                conversion_checkpoints.get_file_stamp(get_xls_path(directory, bareme)), args.resume, errors,
+                convert_and_validate_sheet, book, bareme, sheet_name)
+        if args.watch and sheet_result is not None:
+            fingerprint_and_result_by_sheet_key[(bareme, sheet_name)] = fingerprint, sheet_result
+        if sheet_validation_by_key is not None and sheet_result is not None:
+            sheet_result, sheet_validation_by_key[(bareme, sheet_name)] = sheet_result
+        return sheet_result
+
+    table_by_name = collections.OrderedDict()
     for bareme in baremes:
-        log.info(u'Parsing file {}'.format(bareme))
-        xls_path = os.path.join(args.dir.decode('utf-8'), u"Baremes IPP - {0}.xls".format(bareme))
-        # xls_path = os.path.join(path, u"Baremes IPP - {0}.xls".format(bareme))
-        book = xlrd.open_workbook(filename = xls_path, formatting_info = True)
-        sheet_names = [
-            sheet_name
-            for sheet_name in book.sheet_names()
-            if not sheet_name.startswith((u'Sommaire', u'Outline'))
-                and not sheet_name in forbiden_sheets.get(bareme, [])
-            ]
-        vector_by_taxipp_name = {}
-        for sheet_name in sheet_names:
-            log.info(u'  Parsing sheet {}'.format(sheet_name))
-            sheet = book.sheet_by_name(sheet_name)
-
-            # Extract coordinates of merged cells.
-            merged_cells_tree = {}
-            for row_low, row_high, column_low, column_high in sheet.merged_cells:
-                for row_index in range(row_low, row_high):
-                    cell_coordinates_by_merged_column_index = merged_cells_tree.setdefault(
-                        row_index, {})
-                    for column_index in range(column_low, column_high):
-                        cell_coordinates_by_merged_column_index[column_index] = (row_low, column_low)
-
-            descriptions_rows = []
-            labels_rows = []
-            notes_rows = []
-            state = 'taxipp_names'
-            taxipp_names_row = None
-            values_rows = []
-            for row_index in range(sheet.nrows):
-                ncols = len(sheet.row_values(row_index))
-                if state == 'taxipp_names':
-                    taxipp_names_row = [
-                        taxipp_name
-                        for taxipp_name in (
-                            transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, column_index)
-                            for column_index in range(ncols)
-                            )
-                        ]
-                    state = 'labels'
-                    continue
-                if state == 'labels':
-                    first_cell_value = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, 0)
-                    date_or_year, error = conv.pipe(
-                        conv.test_isinstance((int, basestring)),
-                        cell_to_date_or_year,
-                        conv.not_none,
-                        )(first_cell_value, state = conv.default_state)
-                    if error is not None:
-                        # First cell of row is not a date => Assume it is a label.
-                        labels_rows.append([
-                            transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, column_index)
-                            for column_index in range(ncols)
-                            ])
-                        continue
-                    state = 'values'
-                if state == 'values':
-                    first_cell_value = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, 0)
-                    if first_cell_value is None or isinstance(first_cell_value, (int, basestring)):
-                        date_or_year, error = cell_to_date_or_year(first_cell_value, state = conv.default_state)
-                        if error is None:
-                            # First cell of row is a valid date or year.
-                            values_row = [
-                                transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, column_index)
-                                for column_index in range(ncols)
-                                ]
-                            if date_or_year is not None:
-                                assert date_or_year.year < 2601, 'Invalid date {} in {} at row {}'.format(date_or_year,
-                                    sheet_name, row_index + 1)
-                                values_rows.append(values_row)
-                                continue
-                            if all(value in (None, u'') for value in values_row):
-                                # If first cell is empty and all other cells in line are also empty, ignore this line.
-                                continue
-                            # First cell has no date and other cells in row are not empty => Assume it is a note.
-                    state = 'notes'
-                if state == 'notes':
-                    first_cell_value = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, 0)
-                    if isinstance(first_cell_value, basestring) and first_cell_value.strip().lower() == 'notes':
-                        notes_rows.append([
-                            transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, column_index)
-                            for column_index in range(ncols)
-                            ])
-                        continue
-                    state = 'description'
-                assert state == 'description'
-                descriptions_rows.append([
-                    transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, column_index)
-                    for column_index in range(ncols)
-                    ])
-
-            dates = [
-                conv.check(cell_to_date_or_year)(
-                    row[1] if bareme == u'Impot Revenu' else row[0],
-                    state = conv.default_state,
-                    ).replace(day = 1)
-                for row in values_rows
-                ]
-            for column_index, taxipp_name in enumerate(taxipp_names_row):
-                if taxipp_name and strings.slugify(taxipp_name) not in ('date', 'date-ir', 'date-rev', 'note', 'ref-leg', 'notes') :
-                    vector = [
-                        transform_cell_value(date, row[column_index])
-                        for date, row in zip(dates, values_rows)
-                        ]
-                    vector = [
-                        cell if not isinstance(cell, basestring) or cell == u'nc' else '-'
-                        for cell in vector
-                        ]
-                    vector_by_taxipp_name[taxipp_name] = pd.Series(vector, index = dates)
-        monthstime = [
-                datetime.datetime(y, m, 1,0,0,0)
-                for y in range(1914, 2021)
-                for m in range(1, 13)
-                ]
-        data_frame = pd.DataFrame(index = monthstime)
-        for taxipp_name, vector in vector_by_taxipp_name.iteritems():
-            data_frame[taxipp_name] = np.nan
-            data_frame.loc[vector.index.values, taxipp_name] = vector.values
-        data_frame.replace(u'nc', np.nan, inplace=True)
-        data_frame.fillna(method = 'pad', inplace = True)
-        data_frame.dropna(axis = 0, how = 'all', inplace = True)
-        if option == 'mean_by_year':
-            data_frame.replace('-', 0, inplace=True)
-            data_frame = data_frame.resample('AS', how='mean')
-        if option == 'which_month_in_year':
-            data_frame =  data_frame.iloc[data_frame.index.month == month]
-        data_frame.to_csv(args.dir + "/"  + bareme + '.csv', encoding = 'utf-8')
+        table_by_name.update(write_bareme_tables(directory, bareme, option, month, args.compression, convert_sheet,
+            keep_tables = args.store is not None))
         print u"Voilà, la table agrégée de {} est créée !".format(bareme)
+    if args.store is not None:
+        write_store(args.store, table_by_name)
+    if sheet_validation_by_key is not None:
+        write_validation_report(args.validation_report, sheet_validation_by_key)
+
+    if args.watch:
+        conversion_checkpoints.end_run(checkpoints_dir, checkpoints_keys, errors)
+        del errors[:]
+        from directory_watcher import iter_changed_files
+        print u"En attente des modifications des barèmes de {}...".format(directory)
+        for filenames in iter_changed_files(directory, [u'Baremes IPP - *.xls'], debounce = args.debounce):
+            start_time = time.time()
+            for bareme in baremes:
+                if os.path.basename(get_xls_path(directory, bareme)) not in filenames:
+                    continue
+                try:
+                    table_by_name.update(write_bareme_tables(directory, bareme, option, month, args.compression,
+                        convert_sheet, keep_tables = args.store is not None))
+                except Exception:
+                    # For example, a workbook that can't be read: the next save will be converted.
+                    log.exception(u'Conversion of {} failed'.format(bareme))
+                    continue
+                print u"Voilà, la table agrégée de {} est mise à jour en {:.2f} s !".format(bareme,
+                    time.time() - start_time)
+            if args.store is not None:
+                write_store(args.store, table_by_name)
+            if sheet_validation_by_key is not None:
+                write_validation_report(args.validation_report, sheet_validation_by_key)
+            conversion_checkpoints.end_run(checkpoints_dir, checkpoints_keys, errors)
+            del errors[:]
+
+    return conversion_checkpoints.end_run(checkpoints_dir, checkpoints_keys, errors or [])
 
-    return 0
 
+def convert_and_validate_sheet(book, bareme, sheet_name):
+    """Convert a sheet like convert_sheet_to_vectors and return its result with the validation of its rows."""
+    from ipp_tables_aggregation import convert_sheet_to_vectors
+    from ipp_tables_validation import create_sheet_validation
+    sheet_validation = create_sheet_validation()
+    return convert_sheet_to_vectors(book, bareme, sheet_name, sheet_validation = sheet_validation), sheet_validation
 
-def transform_cell_value(date, cell_value):
-    if isinstance(cell_value, tuple):
-        value, currency = cell_value
-        if currency == u'FRF':
-            if date < datetime.date(1960, 1, 1):
-                return round(value / (100 * 6.55957), 2)
-            return round(value / 6.55957, 2)
-        return value
-    return cell_value
 
+def get_xls_path(directory, bareme):
+    return os.path.join(directory, u"Baremes IPP - {0}.xls".format(bareme))
 
-def transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, column_index):
-    """Convert an XLS cell (type & value) to an unicode string.
 
-    Code taken from http://code.activestate.com/recipes/546518-simple-conversion-of-excel-files-into-csv-and-yaml/
+def write_bareme_tables(directory, bareme, option, month, compression, convert_sheet, keep_tables = False):
+    """Parse the workbook of a bareme, write its aggregated tables and return them by name.
 
-    Type Codes:
-    EMPTY   0
-    TEXT    1 a Unicode string
-    NUMBER  2 float
-    DATE    3 float
-    BOOLEAN 4 int; 1 means TRUE, 0 means FALSE
-    ERROR   5
+    convert_sheet(book, bareme, sheet_name) returns the result of convert_sheet_to_vectors for a sheet, or None to skip
+    it.
+
+    Unless keep_tables is true, the tables are computed and written by chunks of years (see write_aggregated_tables),
+    without being held in memory, and no table is returned.
     """
-    unmerged_cell_coordinates = merged_cells_tree.get(row_index, {}).get(column_index)
-    if unmerged_cell_coordinates is None:
-        unmerged_row_index = row_index
-        unmerged_column_index = column_index
+    from ipp_tables_aggregation import (build_aggregation_cube, build_monthly_table, get_aggregated_table,
+        write_aggregated_tables)
+
+    log.info(u'Parsing file {}'.format(bareme))
+    book = xlrd.open_workbook(filename = get_xls_path(directory, bareme), formatting_info = True, on_demand = True)
+    series_by_taxipp_name = collections.OrderedDict()
+    vector_by_taxipp_name = {}
+    for sheet_name in get_sheet_names(book, bareme):
+        sheet_result = convert_sheet(book, bareme, sheet_name)
+        if sheet_result is None:
+            continue
+        sheet_series_list, sheet_vectors = sheet_result
+        for series in sheet_series_list:
+            series_by_taxipp_name[series['taxipp_name']] = series
+        for taxipp_name, vector in sheet_vectors:
+            vector_by_taxipp_name[taxipp_name] = vector
+    book.release_resources()
+    if isinstance(option, basestring):
+        option_by_name = collections.OrderedDict([(bareme, option)])
     else:
-        unmerged_row_index, unmerged_column_index = unmerged_cell_coordinates
-    type = sheet.row_types(unmerged_row_index)[unmerged_column_index]
-    value = sheet.row_values(unmerged_row_index)[unmerged_column_index]
-    if type == 0:
-        value = None
-    elif type == 1:
-        if not value:
-            value = None
-    elif type == 2:
-        # NUMBER
-        value_int = int(value)
-        if value_int == value:
-            value = value_int
-        xf_index = sheet.cell_xf_index(row_index, column_index)
-        xf = book.xf_list[xf_index]  # Get an XF object.
-        format_key = xf.format_key
-        format = book.format_map[format_key]  # Get a Format object.
-        format_str = format.format_str  # This is the "number format string".
-        if format_str in (
-                u'0',
-                u'General',
-                u'GENERAL',
-                u'_-* #,##0\ _€_-;\-* #,##0\ _€_-;_-* \-??\ _€_-;_-@_-',
-                ) or format_str.endswith(u'0.00'):
-            return value
-        if u'€' in format_str:
-            return (value, u'EUR')
-        if u'FRF' in format_str or ur'\F\R\F' in format_str:
-            return (value, u'FRF')
-        assert format_str.endswith(u'%'), 'Unexpected format "{}" for value: {}'.format(format_str, value)
-        return (value, u'%')
-    elif type == 3:
-        # DATE
-        y, m, d, hh, mm, ss = xlrd.xldate_as_tuple(value, book.datemode)
-        date = u'{0:04d}-{1:02d}-{2:02d}'.format(y, m, d) if any(n != 0 for n in (y, m, d)) else None
-        value = u'T'.join(
-            fragment
-            for fragment in (
-                date,
-                u'{0:02d}:{1:02d}:{2:02d}'.format(hh, mm, ss)
-                    if any(n != 0 for n in (hh, mm, ss)) or date is None
-                    else None,
-                )
-            if fragment is not None
+        # Several options requested: all the tables are computed from the same monthly table.
+        option_by_name = collections.OrderedDict(
+            (bareme + '_' + option1 + ('_{}'.format(month) if option1 == 'which_month_in_year' else ''), option1)
+            for option1 in option
             )
-    elif type == 4:
-        value = bool(value)
-    elif type == 5:
-        # ERROR
-        value = xlrd.error_text_from_code[value]
-    return value
-
-
-def transform_xls_cell_to_str(book, sheet, merged_cells_tree, row_index, column_index):
-    cell = transform_xls_cell_to_json(book, sheet, merged_cells_tree, row_index, column_index)
-    assert cell is None or isinstance(cell, basestring), u'Expected a string. Got: {}'.format(cell).encode('utf-8')
-    return cell
+    table_by_name = collections.OrderedDict()
+    if not keep_tables:
+        write_aggregated_tables(
+            vector_by_taxipp_name,
+            [
+                (option1, month, os.path.join(directory, name + u'.csv'))
+                for name, option1 in option_by_name.iteritems()
+                ],
+            series_list = series_by_taxipp_name.values(),
+            compression = compression,
+            )
+        return table_by_name
+    cube = build_aggregation_cube(build_monthly_table(vector_by_taxipp_name),
+        series_list = series_by_taxipp_name.values())
+    for name, option1 in option_by_name.iteritems():
+        table_by_name[name] = table = get_aggregated_table(cube, option1, month)
+        write_table_csv(table, os.path.join(directory, name + u'.csv'), compression = compression)
+    return table_by_name
+
+
+def write_validation_report(report_path, sheet_validation_by_key):
+    from ipp_tables_validation import get_validation_issues, write_validation_report as write_report
+    issues = get_validation_issues(sheet_validation_by_key)
+    write_report(issues, report_path)
+    for issue in issues:
+        log.warning(u'{} / {}{}{} [{}]: {}'.format(issue['bareme'], issue['sheet_name'],
+            u', row {}'.format(issue['row']) if issue['row'] is not None else u'',
+            u', {}'.format(issue['taxipp_name']) if issue['taxipp_name'] is not None else u'', issue['kind'],
+            issue['message']))
+    print u"Voilà, le rapport de validation {} est créé ({} problème(s)) !".format(report_path.decode('utf-8'),
+        len(issues))
+
+
+def write_store(store_path, table_by_name):
+    from mmap_parameter_store import write_parameter_store
+    write_parameter_store(store_path, table_by_name)
+    print u"Voilà, le stockage des paramètres {} est créé !".format(store_path.decode('utf-8'))
 
 
 if __name__ == "__main__":
     path = 'Directory of Baremes'
-    # Options possibles : 'which_month_in_year', 'mean_by_year', 'all_months'
+    # Options possibles : 'which_month_in_year', 'mean_by_year', 'time_weighted_mean_by_year', 'all_months', 'year_end',
+    # 'changes_by_year'
+    # (or a list of them, to get several tables from a single aggregation pass)
     sys.exit(main(path, date="28_04", option='mean_by_year', month=5)) # date = quantième et numéro du mois (répertoire des fichiers .xls barèmes)
@@ -0,0 +1,324 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Reform scenarios: declarative overrides of the parameters of IPP's tax benefit tables.
+
+A scenario is a copy-on-write layer over a parent scenario, the root being the baseline loaded from the XLS files.
+Each layer holds only the change points (see get_series_change_points) of the parameters it overrides: the other
+parameters are read from its parents, so that a sweep of hundreds of reforms never copies the baseline. Scenarios can
+be stacked, each override applying to the parameters as modified by the parents.
+
+An override is a dict giving the TAXIPP name (or glob pattern) of the parameter, an optional period (start date
+included, end date excluded, as dates or YYYY-MM-DD strings) and exactly one operation:
+- {"parameter": "txmarg4", "add": 0.01, "start": "2016-01-01"}: raise txmarg4 by 1 point from 2016;
+- {"parameter": "plaf_qf_*", "multiply": 1.1, "start": "2015-01-01", "end": "2017-01-01"};
+- {"parameter": "txmarg1", "set": 0, "start": "2016-01-01"};
+- {"parameter": "plaf_qf_parentisole", "freeze": true, "start": "2013-01-01"}: keep the value in effect at the start
+  of the period until its end.
+
+The scenarios file of the command line is a JSON list of {"name": ..., "parent": ..., "overrides": [...]} scenarios,
+whose parent is the name of a previous scenario (the baseline when missing).
+"""
+
+
+import argparse
+import collections
+import datetime
+import fnmatch
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from csv_table_writer import extension_by_compression, write_table_csv
+from extract_ipp_parameters import extract_parameter_series
+from ipp_tables_aggregation import get_series_change_points, get_values_as_of
+from ipp_tables_parsing import conv, lazy_converter, N_
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+epoch_ordinal = datetime.date(1970, 1, 1).toordinal()
+log = logging.getLogger(app_name)
+operations = ('add', 'freeze', 'multiply', 'set')
+
+
+@lazy_converter
+def override_converter():
+    number_converter = conv.test_isinstance((float, int))
+    date_converter = conv.first_match(
+        conv.test_isinstance(datetime.date),
+        conv.pipe(
+            conv.test_isinstance(basestring),
+            conv.iso8601_input_to_date,
+            ),
+        )
+    return conv.pipe(
+        conv.test_isinstance(dict),
+        conv.struct(
+            dict(
+                add = number_converter,
+                end = date_converter,
+                freeze = conv.pipe(
+                    conv.test_isinstance(bool),
+                    conv.test_equals(True),
+                    ),
+                multiply = number_converter,
+                parameter = conv.pipe(
+                    conv.test_isinstance(basestring),
+                    conv.cleanup_line,
+                    conv.not_none,
+                    ),
+                set = number_converter,
+                start = date_converter,
+                ),
+            ),
+        conv.test(lambda override: sum(override[operation] is not None for operation in operations) == 1,
+            error = N_(u'Exactly one operation expected among: {}').format(u', '.join(operations))),
+        conv.test(lambda override: None in (override['start'], override['end']) or override['start'] < override['end'],
+            error = N_(u'Empty period')),
+        )
+
+
+@lazy_converter
+def scenario_converter():
+    return conv.pipe(
+        conv.test_isinstance(dict),
+        conv.struct(
+            dict(
+                name = conv.pipe(
+                    conv.test_isinstance(basestring),
+                    conv.cleanup_line,
+                    conv.not_none,
+                    # The name is the name of the CSV file of the scenario.
+                    conv.test(lambda name: not any(fragment in name for fragment in (u'/', u'..', os.sep)),
+                        error = N_(u'Name of file expected, without "/" nor ".."')),
+                    ),
+                overrides = conv.pipe(
+                    conv.test_isinstance(list),
+                    conv.uniform_sequence(override_converter),
+                    conv.empty_to_none,
+                    conv.not_none,
+                    ),
+                parent = conv.pipe(
+                    conv.test_isinstance(basestring),
+                    conv.cleanup_line,
+                    ),
+                ),
+            ),
+        )
+
+
+def apply_override(change_points, override):
+    """Return the change points of a series modified by a (converted) override, without modifying the given ones."""
+    ordinals, values = change_points
+    start = override['start'].toordinal() if override['start'] is not None else None
+    end = override['end'].toordinal() if override['end'] is not None else None
+    # The bounds of the period become change points, so that the values outside the period are kept.
+    for ordinal in (start, end):
+        if ordinal is not None:
+            ordinals, values = insert_change_point(ordinals, values, ordinal)
+    in_period = np.ones(len(ordinals), dtype = bool)
+    if start is not None:
+        in_period &= ordinals >= start
+    if end is not None:
+        in_period &= ordinals < end
+    values = values.copy()
+    if override['add'] is not None:
+        values[in_period] += override['add']
+    elif override['multiply'] is not None:
+        values[in_period] *= override['multiply']
+    elif override['set'] is not None:
+        values[in_period] = override['set']
+    else:
+        # Freeze: drop the changes of the period, except the first one.
+        kept = ~in_period
+        kept[np.argmax(in_period)] = True
+        ordinals = ordinals[kept]
+        values = values[kept]
+    return ordinals, values
+
+
+def create_scenario(parent, overrides, name = None):
+    """Create a scenario layer over parent, applying the overrides to the parameters of parent, in order."""
+    overrides = conv.check(conv.uniform_sequence(override_converter))(overrides, state = conv.default_state)
+    change_points_by_name = {}
+    taxipp_names = get_taxipp_names(parent)
+    for override in overrides:
+        matching_names = [
+            taxipp_name
+            for taxipp_name in taxipp_names
+            if fnmatch.fnmatchcase(taxipp_name, override['parameter'])
+            ]
+        if not matching_names:
+            raise KeyError(u'No parameter matches {}'.format(override['parameter']))
+        for taxipp_name in matching_names:
+            change_points = change_points_by_name.get(taxipp_name)
+            if change_points is None:
+                change_points = get_change_points(parent, taxipp_name)
+            change_points_by_name[taxipp_name] = apply_override(change_points, override)
+    return dict(
+        change_points_by_name = change_points_by_name,
+        name = name,
+        overrides = overrides,
+        parent = parent,
+        )
+
+
+def get_change_points(scenario, taxipp_name):
+    """Return the change points of a parameter in a scenario: the ones of the nearest layer overriding it."""
+    while scenario is not None:
+        change_points = scenario['change_points_by_name'].get(taxipp_name)
+        if change_points is not None:
+            return change_points
+        scenario = scenario['parent']
+    raise KeyError(taxipp_name)
+
+
+def get_overridden_names(scenario):
+    """Return the sorted TAXIPP names of the parameters overridden by a scenario or by its parents."""
+    overridden_names = set()
+    while scenario['parent'] is not None:
+        overridden_names.update(scenario['change_points_by_name'])
+        scenario = scenario['parent']
+    return sorted(overridden_names)
+
+
+def get_taxipp_names(scenario):
+    """Return the TAXIPP names of the parameters of a scenario: the ones of its baseline."""
+    while scenario['parent'] is not None:
+        scenario = scenario['parent']
+    return scenario['change_points_by_name'].keys()
+
+
+def insert_change_point(ordinals, values, ordinal):
+    """Return change points having a change point at ordinal, with the value in effect at this date."""
+    index = np.searchsorted(ordinals, ordinal)
+    if index < len(ordinals) and ordinals[index] == ordinal:
+        return ordinals, values
+    return np.insert(ordinals, index, ordinal), np.insert(values, index,
+        get_values_as_of(ordinals, values, np.array([ordinal]))[0])
+
+
+def load_baseline(directory, params = None, sheets = None):
+    """Load the baseline scenario from the IPP XLS directory, optionally limited to some parameters or sheets."""
+    change_points_by_name = collections.OrderedDict()
+    for series in extract_parameter_series(directory, params = params, sheets = sheets):
+        taxipp_name = series['taxipp_name']
+        if taxipp_name in change_points_by_name:
+            log.warning(u'Parameter {} is defined several times: using the one of {} / {}'.format(taxipp_name,
+                series['bareme'], series['sheet_name']))
+        change_points_by_name[taxipp_name] = get_series_change_points(series)
+    return dict(
+        change_points_by_name = change_points_by_name,
+        name = u'baseline',
+        overrides = [],
+        parent = None,
+        )
+
+
+def load_scenarios(baseline, scenarios_json):
+    """Create the scenarios described by a JSON list, and return them by name."""
+    scenario_by_name = collections.OrderedDict()
+    for scenario_json in scenarios_json:
+        scenario_json = conv.check(scenario_converter)(scenario_json, state = conv.default_state)
+        parent_name = scenario_json['parent']
+        if parent_name is not None and parent_name not in scenario_by_name:
+            raise KeyError(u'Unknown parent {} of scenario {}'.format(parent_name, scenario_json['name']))
+        scenario_by_name[scenario_json['name']] = create_scenario(
+            scenario_by_name[parent_name] if parent_name is not None else baseline,
+            scenario_json['overrides'],
+            name = scenario_json['name'],
+            )
+    return scenario_by_name
+
+
+def materialize_scenario(scenario, start_date, end_date, taxipp_names = None):
+    """Return the monthly table of the parameters of a scenario, from the month of start_date to the one of end_date.
+
+    The values are the ones in effect at the first day of each month. Only the parameters named in taxipp_names are
+    computed, when given.
+    """
+    months = pd.date_range(start_date.replace(day = 1), end_date.replace(day = 1), freq = 'MS')
+    query_ordinals = months.values.astype('datetime64[D]').astype(np.int64) + epoch_ordinal
+    if taxipp_names is None:
+        taxipp_names = get_taxipp_names(scenario)
+    return pd.DataFrame(
+        collections.OrderedDict(
+            (taxipp_name, get_values_as_of(*(get_change_points(scenario, taxipp_name) + (query_ordinals,))))
+            for taxipp_name in taxipp_names
+            ),
+        columns = taxipp_names,
+        index = months,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--compression', choices = sorted(extension_by_compression),
+        help = 'compress the CSV tables (zstd requires the zstandard package)')
+    parser.add_argument('-d', '--dir', default = 'Baremes_IPP', help = 'path of IPP XLS directory')
+    parser.add_argument('-e', '--end', default = '2020-12-01', help = 'last month of the tables (YYYY-MM-DD)')
+    parser.add_argument('-o', '--output-dir',
+        help = 'path of the directory where to write a table per scenario, of the parameters it overrides')
+    parser.add_argument('-p', '--params', action = 'append', default = [],
+        help = 'TAXIPP name or glob pattern of the parameters to load (can be repeated, default: all)')
+    parser.add_argument('-s', '--start', default = '1914-01-01', help = 'first month of the tables (YYYY-MM-DD)')
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    parser.add_argument('scenarios', help = 'path of the JSON file of the scenarios')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stderr)
+
+    start_date = datetime.datetime.strptime(args.start, '%Y-%m-%d').date()
+    end_date = datetime.datetime.strptime(args.end, '%Y-%m-%d').date()
+    baseline = load_baseline(args.dir.decode('utf-8'),
+        params = [pattern.decode('utf-8') for pattern in args.params] or None)
+    with open(args.scenarios) as scenarios_file:
+        scenario_by_name = load_scenarios(baseline, json.load(scenarios_file,
+            object_pairs_hook = collections.OrderedDict))
+    if args.output_dir is not None and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    for name, scenario in scenario_by_name.iteritems():
+        overridden_names = get_overridden_names(scenario)
+        table = materialize_scenario(scenario, start_date, end_date, taxipp_names = overridden_names)
+        baseline_table = materialize_scenario(baseline, start_date, end_date, taxipp_names = overridden_names)
+        changed_months_count = (~((table == baseline_table) | (table.isnull() & baseline_table.isnull()))).sum()
+        print u'{}: {}'.format(name, u', '.join(
+            u'{} ({} months changed)'.format(taxipp_name, changed_months_count[taxipp_name])
+            for taxipp_name in overridden_names
+            )).encode('utf-8')
+        if args.output_dir is not None:
+            write_table_csv(table, os.path.join(args.output_dir.decode('utf-8'), name + u'.csv'),
+                compression = args.compression)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Full-text search of the parameters of IPP's tax benefit tables, by keywords or by legal reference.
+
+The searched documents are:
+- the parameters: their TAXIPP names, the labels of their columns and the names & titles of their sheets;
+- the sheets: their notes and descriptions;
+- the legal references of the values rows of each sheet, with the dates of their rows.
+
+The words are normalized with strings.slugify (lower case, without accents nor punctuation), and the numbers joined by
+dashes (like "2013-1290" or "L. 136-8") are also kept as single words, to search the legal references. The inverted
+index (word -> documents) is persisted in the IPP XLS directory and rebuilt only for the workbooks that changed.
+
+A query word ending with "*" is a prefix. The documents are ranked by number of matched query words, then by the
+rarity of these words.
+
+Example: python search_ipp_parameters.py -d Baremes_IPP quotient familial
+"""
+
+
+import argparse
+import bisect
+import collections
+import glob
+import io
+import json
+import logging
+import math
+import os
+import re
+import sys
+import time
+
+from biryani import strings
+import xlrd
+
+from ipp_tables_parsing import (compute_file_fingerprint, get_sheet_names, get_sheet_title_by_name,
+    iter_parameter_series, parse_sheet)
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+dashed_number_re = re.compile(ur'(?<![0-9a-z])\d+(?:-\d+)+(?![0-9a-z])')
+index_file_name = u'ipp_search_index.json'
+log = logging.getLogger(app_name)
+xls_prefix = u'Baremes IPP - '
+
+
+def build_workbook_documents(xls_path, bareme):
+    """Return the searchable documents of a workbook."""
+    book = xlrd.open_workbook(filename = xls_path, formatting_info = True, on_demand = True)
+    sheet_title_by_name = {}
+    for sheet_name in book.sheet_names():
+        if sheet_name.startswith(u'Sommaire'):
+            sheet_title_by_name.update(get_sheet_title_by_name(book, sheet_name))
+            book.unload_sheet(sheet_name)
+    documents = []
+    for sheet_name in get_sheet_names(book, bareme):
+        parsed_sheet = parse_sheet(book, sheet_name)
+        sheet_title = sheet_title_by_name.get(sheet_name)
+        text_lines = [
+            u' | '.join(cell for cell in row if cell)
+            for row in parsed_sheet['notes_rows'] + parsed_sheet['descriptions_rows']
+            ]
+        documents.append(dict(
+            bareme = bareme,
+            kind = u'sheet',
+            sheet_name = sheet_name,
+            sheet_title = sheet_title,
+            text = u'\n'.join(line for line in text_lines if line) or None,
+            ))
+        start_dates_by_law_reference = collections.OrderedDict()
+        for series in iter_parameter_series(bareme, sheet_name, parsed_sheet):
+            documents.append(dict(
+                bareme = bareme,
+                kind = u'parameter',
+                sheet_name = sheet_name,
+                sheet_title = sheet_title,
+                taxipp_name = series['taxipp_name'],
+                text = series['title'],
+                ))
+            # The legal references are the same for all the parameters of a sheet.
+            if not start_dates_by_law_reference:
+                for row in series['rows']:
+                    start_date, law_reference = row[0], row[3]
+                    if isinstance(law_reference, basestring) and law_reference.strip():
+                        start_dates_by_law_reference.setdefault(law_reference.strip(), []).append(
+                            start_date.isoformat())
+        for law_reference, start_dates in start_dates_by_law_reference.iteritems():
+            documents.append(dict(
+                bareme = bareme,
+                kind = u'law_reference',
+                sheet_name = sheet_name,
+                sheet_title = sheet_title,
+                start_dates = sorted(start_dates),
+                text = law_reference,
+                ))
+        book.unload_sheet(sheet_name)
+    book.release_resources()
+    return documents
+
+
+def get_document_words(document):
+    if document['kind'] == u'law_reference':
+        return tokenize(document['text'])
+    return tokenize(u' '.join(
+        text
+        for text in (document.get('taxipp_name'), document['text'], document['sheet_name'], document['sheet_title'])
+        if text
+        ))
+
+
+def load_search_index(directory, rebuild = False):
+    """Load the search index of the IPP XLS directory, updating the entries of the workbooks that changed."""
+    index_path = os.path.join(directory, index_file_name)
+    index = None
+    if not rebuild and os.path.exists(index_path):
+        with io.open(index_path, encoding = 'utf-8') as index_file:
+            index = json.load(index_file)
+    if index is None:
+        index = dict(workbooks = {})
+    changed = False
+    xls_path_by_bareme = dict(
+        (os.path.splitext(os.path.basename(xls_path))[0][len(xls_prefix):], xls_path)
+        for xls_path in glob.glob(os.path.join(directory, u'{}*.xls'.format(xls_prefix)))
+        )
+    for bareme in list(index['workbooks']):
+        if bareme not in xls_path_by_bareme:
+            del index['workbooks'][bareme]
+            changed = True
+    for bareme, xls_path in sorted(xls_path_by_bareme.iteritems()):
+        fingerprint = compute_file_fingerprint(xls_path)
+        workbook_index = index['workbooks'].get(bareme)
+        if workbook_index is not None and workbook_index['fingerprint'] == fingerprint:
+            continue
+        log.info(u'Indexing file {}'.format(bareme))
+        documents = build_workbook_documents(xls_path, bareme)
+        document_indexes_by_word = {}
+        for document_index, document in enumerate(documents):
+            for word in get_document_words(document):
+                document_indexes_by_word.setdefault(word, []).append(document_index)
+        index['workbooks'][bareme] = dict(
+            document_indexes_by_word = document_indexes_by_word,
+            documents = documents,
+            fingerprint = fingerprint,
+            )
+        changed = True
+    if changed:
+        with io.open(index_path, 'w', encoding = 'utf-8') as index_file:
+            index_file.write(unicode(json.dumps(index, ensure_ascii = False, separators = (',', ':'),
+                sort_keys = True)))
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--dir', default = 'Baremes_IPP', help = 'path of IPP XLS directory')
+    parser.add_argument('-k', '--kind', action = 'append', choices = ['law_reference', 'parameter', 'sheet'],
+        dest = 'kinds', help = 'kind of the searched documents (can be repeated, default: all)')
+    parser.add_argument('-n', '--results-count', default = 20, type = int, help = 'maximum number of results')
+    parser.add_argument('-r', '--rebuild-index', action = 'store_true', default = False,
+        help = 'rebuild the search index from scratch')
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    parser.add_argument('query', nargs = '+', help = 'words of the query ("*" at the end of a word for a prefix)')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stderr)
+
+    index = load_search_index(args.dir.decode('utf-8'), rebuild = args.rebuild_index)
+    start_time = time.time()
+    results = search(index, u' '.join(word.decode('utf-8') for word in args.query), kinds = args.kinds)
+    duration = time.time() - start_time
+    for matched_words_count, score, document in results[:args.results_count]:
+        location = u'{} / {}'.format(document['bareme'], document['sheet_name'])
+        if document['kind'] == u'parameter':
+            print u'[parameter] {}: {} ({})'.format(document['taxipp_name'], document['text'] or u'',
+                location).encode('utf-8')
+        elif document['kind'] == u'law_reference':
+            print u'[law_reference] {} ({}, from {})'.format(document['text'].replace(u'\n', u' '), location,
+                document['start_dates'][0]).encode('utf-8')
+        else:
+            print u'[sheet] {}{}'.format(location, u': {}'.format(document['sheet_title'])
+                if document['sheet_title'] else u'').encode('utf-8')
+    print >> sys.stderr, u'{} result(s) in {:.1f} ms'.format(len(results), duration * 1000).encode('utf-8')
+
+    return 0
+
+
+def search(index, query, kinds = None):
+    """Return the (matched words count, score, document) triples of the documents matching query, best first."""
+    documents_count = sum(len(workbook_index['documents']) for workbook_index in index['workbooks'].itervalues())
+    matched_words_by_key = {}
+    score_by_key = {}
+    for query_word in tokenize(query, keep_stars = True):
+        for bareme, workbook_index in index['workbooks'].iteritems():
+            document_indexes_by_word = workbook_index['document_indexes_by_word']
+            if query_word.endswith(u'*'):
+                words = workbook_index.get('sorted_words')
+                if words is None:
+                    words = workbook_index['sorted_words'] = sorted(document_indexes_by_word)
+                prefix = query_word.rstrip(u'*')
+                words = words[bisect.bisect_left(words, prefix):bisect.bisect_left(words, prefix + u'\uffff')]
+            else:
+                words = [query_word] if query_word in document_indexes_by_word else []
+            for word in words:
+                document_indexes = document_indexes_by_word[word]
+                # Rare words weigh more.
+                weight = math.log(1 + float(documents_count) / len(document_indexes))
+                for document_index in document_indexes:
+                    key = (bareme, document_index)
+                    matched_words_by_key.setdefault(key, set()).add(query_word)
+                    score_by_key[key] = score_by_key.get(key, 0) + weight
+    results = [
+        (len(matched_words), score_by_key[matched_key],
+            index['workbooks'][matched_key[0]]['documents'][matched_key[1]])
+        for matched_key, matched_words in matched_words_by_key.iteritems()
+        ]
+    if kinds:
+        results = [result for result in results if result[2]['kind'] in kinds]
+    results.sort(key = lambda result: (-result[0], -result[1], result[2]['bareme'], result[2]['sheet_name'],
+        result[2].get('taxipp_name')))
+    return results
+
+
+def tokenize(text, keep_stars = False):
+    """Return the set of the normalized words of a text, including its numbers joined by dashes.
+
+    When keep_stars is True, the last word of a fragment ending with "*" is kept as a prefix, ending with "*".
+    """
+    if keep_stars:
+        words = set()
+        for fragment in text.split():
+            if fragment.endswith(u'*'):
+                fragment_words = (strings.slugify(fragment) or u'').split(u'-')
+                if fragment_words[-1]:
+                    words.add(fragment_words[-1] + u'*')
+                words.update(tokenize(u' '.join(fragment_words[:-1])))
+            else:
+                words.update(tokenize(fragment))
+        return words
+    slug = strings.slugify(text)
+    if not slug:
+        return set()
+    return set(slug.split(u'-')) | set(dashed_number_re.findall(slug))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Social contributions on wages, from the "prelevements sociaux" table.
+
+The rates of the contributions are the parameters whose TAXIPP name follows the pattern
+<contribution>_<payer>_<low>_<high>, where the payer is "s" (employee) or "p" (employer) and the wage tranche goes from
+low to high times the "Plafond de la Sécurité sociale" (PSS). An empty high bound means no ceiling: for example
+cnav_s_0_1 is the employee rate of CNAV under the PSS and arrco_p_1_3 the employer rate of ARRCO between 1 and 3 PSS.
+
+The rates and the PSS in effect during a period are resolved once per period and cached, so that the contributions of
+successive batches of wages of a period are only array arithmetic.
+
+Some contributions are alternatives (by sector, by size of firm...): the callers choose the ones that apply.
+
+Amounts in FRF are converted to euros.
+"""
+
+
+import argparse
+import collections
+import datetime
+import logging
+import os
+import re
+import sys
+
+import numpy as np
+import xlrd
+
+from extract_ipp_parameters import extract_parameter_series
+from ipp_tables_aggregation import get_series_change_points, get_values_as_of
+from ipp_tables_parsing import conv, parse_sheet, pss_converters, transform_cell_value
+
+
+app_name = os.path.splitext(os.path.basename(__file__))[0]
+bareme = u'prelevements sociaux'
+log = logging.getLogger(app_name)
+tranche_name_re = re.compile(ur'(?P<contribution>[0-9a-z_]+?)_(?P<payer>[ps])_(?P<low>\d+)_(?P<high>\d*)$')
+
+
+def compute_social_contributions(engine, wages, date, annual = False):
+    """Compute the contributions of an array of gross wages, with the rates & PSS in effect at a date.
+
+    The wages are monthly, or annual when annual is True. Return the arrays of the amounts by contribution, named
+    <contribution>_<payer>.
+    """
+    schedule = get_social_contributions_schedule(engine, date)
+    ceiling = schedule['pss_a'] if annual else schedule['pss_m']
+    lows = schedule['lows'] * ceiling
+    highs = schedule['highs'] * ceiling
+    wages = np.asarray(wages, dtype = float)
+    # Part of each wage in each tranche: array of shape (wages count, tranches count).
+    bases = np.clip(wages[:, np.newaxis], lows, highs) - lows
+    amounts = np.add.reduceat(bases * schedule['rates'], schedule['contributions_starts'], axis = 1)
+    return collections.OrderedDict(zip(schedule['contributions'], amounts.T))
+
+
+def get_pss_change_points(parsed_sheet):
+    """Return the change points (as in get_series_change_points) of the monthly and annual PSS.
+
+    The values rows are validated with pss_converters. A missing monthly PSS is the annual one divided by 12.
+    """
+    labels = parsed_sheet['labels_rows'][0]
+    pss_row_converter = conv.struct(pss_converters)
+    pss_by_ordinal = {}
+    for values_row in parsed_sheet['values_rows']:
+        pss_row = conv.check(pss_row_converter)(
+            dict(
+                (label or None, cell)
+                for label, cell in zip(labels, values_row)
+                ),
+            state = conv.default_state,
+            )
+        start_date = pss_row[u"Date d'entrée en vigueur"]
+        annual_pss = pss_row[u'Plafond de la Sécurité sociale (annuel)']
+        monthly_pss = pss_row[u'Plafond de la Sécurité sociale (mensuel)']
+        if annual_pss is None and monthly_pss is None:
+            continue
+        annual_pss = transform_cell_value(start_date, annual_pss) if annual_pss is not None else None
+        monthly_pss = transform_cell_value(start_date, monthly_pss) if monthly_pss is not None else None
+        # When a date is repeated, the last row of the sheet wins, as in get_series_change_points.
+        pss_by_ordinal[start_date.toordinal()] = (
+            monthly_pss if monthly_pss is not None else annual_pss / 12.,
+            annual_pss if annual_pss is not None else monthly_pss * 12,
+            )
+    ordinals = np.array(sorted(pss_by_ordinal), dtype = np.int64)
+    values = np.array([pss_by_ordinal[ordinal] for ordinal in ordinals], dtype = float).reshape(-1, 2)
+    return (ordinals, values[:, 0]), (ordinals, values[:, 1])
+
+
+def get_social_contributions_schedule(engine, date):
+    """Return the tranches, rates & PSS in effect at a date, resolved once per period."""
+    period_index = np.searchsorted(engine['starts'], date.toordinal(), side = 'right') - 1
+    assert period_index >= 0, u'No social contributions at {}'.format(date)
+    schedule = engine['schedule_by_period_index'].get(period_index)
+    if schedule is None:
+        ordinal = engine['starts'][period_index:period_index + 1]
+        rates = np.concatenate([
+            get_values_as_of(ordinals, values, ordinal)
+            for ordinals, values in engine['rates_change_points']
+            ])
+        schedule = engine['schedule_by_period_index'][period_index] = dict(
+            contributions = engine['contributions'],
+            contributions_starts = engine['contributions_starts'],
+            highs = engine['highs'],
+            lows = engine['lows'],
+            pss_a = get_values_as_of(*(engine['pss_a_change_points'] + (ordinal,)))[0],
+            pss_m = get_values_as_of(*(engine['pss_m_change_points'] + (ordinal,)))[0],
+            # A contribution is not due before its first rate.
+            rates = np.nan_to_num(rates),
+            )
+    return schedule
+
+
+def load_social_contributions(directory, contributions = None):
+    """Load the rates & PSS of the social contributions from the IPP XLS directory.
+
+    contributions is a list of TAXIPP names or glob patterns of the rates to load (default: all of them).
+    """
+    tranches_by_contribution = collections.OrderedDict()
+    for series in extract_parameter_series(directory, params = contributions or [u'*_[ps]_*_*']):
+        match = tranche_name_re.match(series['taxipp_name'])
+        if series['bareme'] != bareme or match is None or not any(row[2] == u'%' for row in series['rows']):
+            continue
+        tranches_by_contribution.setdefault(u'{}_{}'.format(match.group('contribution'), match.group('payer')),
+            []).append((
+                int(match.group('low')),
+                int(match.group('high')) if match.group('high') else np.inf,
+                get_series_change_points(series),
+                ))
+    assert tranches_by_contribution, u'No social contribution rate found'
+
+    book = xlrd.open_workbook(filename = os.path.join(directory, u'Baremes IPP - {}.xls'.format(bareme)),
+        formatting_info = True, on_demand = True)
+    pss_m_change_points, pss_a_change_points = get_pss_change_points(parse_sheet(book, u'PSS'))
+    book.release_resources()
+
+    tranches = [
+        tranche
+        for contribution_tranches in tranches_by_contribution.itervalues()
+        for tranche in contribution_tranches
+        ]
+    return dict(
+        contributions = tranches_by_contribution.keys(),
+        contributions_starts = np.cumsum([0] + [
+            len(contribution_tranches)
+            for contribution_tranches in tranches_by_contribution.itervalues()
+            ][:-1]),
+        highs = np.array([high for low, high, change_points in tranches], dtype = float),
+        lows = np.array([low for low, high, change_points in tranches], dtype = float),
+        pss_a_change_points = pss_a_change_points,
+        pss_m_change_points = pss_m_change_points,
+        rates_change_points = [change_points for low, high, change_points in tranches],
+        schedule_by_period_index = {},
+        starts = np.unique(np.concatenate([pss_m_change_points[0]] + [
+            ordinals
+            for low, high, (ordinals, values) in tranches
+            ])),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-a', '--annual', action = 'store_true', default = False,
+        help = 'the wages are annual (default: monthly)')
+    parser.add_argument('-c', '--contributions', action = 'append', default = [],
+        help = 'TAXIPP name or glob pattern of the contribution rates to use (can be repeated, default: all)')
+    parser.add_argument('-d', '--dir', default = 'Baremes_IPP', help = 'path of IPP XLS directory')
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    parser.add_argument('date', help = 'date of the rates (YYYY-MM-DD)')
+    parser.add_argument('wages', nargs = '+', type = float, help = 'gross wages')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.WARNING, stream = sys.stderr)
+
+    date = datetime.datetime.strptime(args.date, '%Y-%m-%d').date()
+    engine = load_social_contributions(args.dir.decode('utf-8'),
+        contributions = [pattern.decode('utf-8') for pattern in args.contributions])
+    schedule = get_social_contributions_schedule(engine, date)
+    print u'PSS: {:.2f} EUR per month, {:.2f} EUR per year'.format(schedule['pss_m'], schedule['pss_a'])
+    amounts_by_contribution = compute_social_contributions(engine, args.wages, date, annual = args.annual)
+    print u'{:<24}{}'.format(u'Wage', u''.join(u'{:>12.2f}'.format(wage) for wage in args.wages))
+    for contribution, amounts in amounts_by_contribution.iteritems():
+        if amounts.any():
+            print u'{:<24}{}'.format(contribution, u''.join(u'{:>12.2f}'.format(amount) for amount in amounts))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
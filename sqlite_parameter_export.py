@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""SQLite export of the parameter series of IPP's tax benefit tables, for ad-hoc SQL queries.
+
+The database has a single table, parameter_values, with a row per values row of each parameter: bareme, sheet,
+taxipp_name, start_date (YYYY-MM-DD), value (a number, or a string like "nc"), unit ("EUR", "FRF", "%" or NULL),
+law_reference, publication_date and notes. The values are those of the sheets: amounts in francs are not converted.
+
+It is indexed on (taxipp_name, start_date) and on start_date. For example, the rates changed in 2013 with their JO
+publication date:
+    SELECT taxipp_name, start_date, value, law_reference, publication_date FROM parameter_values
+    WHERE start_date BETWEEN '2013-01-01' AND '2013-12-31' AND unit = '%' ORDER BY start_date
+"""
+
+
+import itertools
+import os
+import sqlite3
+
+
+batch_size = 10000
+columns = ('bareme', 'sheet', 'taxipp_name', 'start_date', 'value', 'unit', 'law_reference', 'publication_date',
+    'notes')
+
+
+def iter_series_records(series_list):
+    for series in series_list:
+        for row in series['rows']:
+            # The blank cells are decoded as empty strings: they are stored as NULL.
+            yield (series['bareme'], series['sheet_name'], series['taxipp_name'], row[0].isoformat()) + tuple(
+                None if cell == u'' else cell
+                for cell in row[1:]
+                )
+
+
+def write_parameter_database(file_path, series_list):
+    """Write the rows of the parameter series (see iter_parameter_series) to a new SQLite database.
+
+    The rows are inserted by batches in a single transaction, then indexed. The database is written to a temporary
+    file, renamed at the end, so that the readers never see a partial database.
+    """
+    temporary_path = file_path + '.tmp'
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+    connection = sqlite3.connect(temporary_path)
+    try:
+        # The temporary file is discarded on failure: no journal is needed.
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.execute('''
+            CREATE TABLE parameter_values (
+                bareme TEXT NOT NULL,
+                sheet TEXT NOT NULL,
+                taxipp_name TEXT NOT NULL,
+                start_date TEXT NOT NULL,
+                value,
+                unit TEXT,
+                law_reference TEXT,
+                publication_date TEXT,
+                notes TEXT
+                )
+            ''')
+        insert_statement = 'INSERT INTO parameter_values ({}) VALUES ({})'.format(', '.join(columns),
+            ', '.join('?' for column in columns))
+        records = iter_series_records(series_list)
+        with connection:
+            while True:
+                batch = list(itertools.islice(records, batch_size))
+                if not batch:
+                    break
+                connection.executemany(insert_statement, batch)
+        # Indexing once the table is loaded is faster than maintaining the indexes during the inserts.
+        with connection:
+            connection.execute('CREATE INDEX parameter_values_taxipp_name_start_date ON parameter_values '
+                '(taxipp_name, start_date)')
+            connection.execute('CREATE INDEX parameter_values_start_date ON parameter_values (start_date)')
+        connection.execute('ANALYZE')
+    finally:
+        connection.close()
+    os.rename(temporary_path, file_path)
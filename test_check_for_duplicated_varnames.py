@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import xlrd
+
+from check_for_duplicated_varnames import get_sheet_taxipp_names
+
+
+class FakeBook(object):
+    """A workbook read without formatting informations, as the .xlsx workbooks, whose sheets contain only texts."""
+    def __init__(self, sheet):
+        self.sheet = sheet
+
+    def sheet_by_name(self, sheet_name):
+        return self.sheet
+
+
+class FakeSheet(object):
+    def __init__(self, rows, merged_cells = None):
+        self.merged_cells = merged_cells or []
+        self.nrows = len(rows)
+        self.rows = rows
+
+    def cell_type(self, row_index, column_index):
+        return xlrd.XL_CELL_TEXT if self.rows[row_index][column_index] else xlrd.XL_CELL_EMPTY
+
+    def row_len(self, row_index):
+        return len(self.rows[row_index])
+
+    def row_types(self, row_index):
+        return [self.cell_type(row_index, column_index) for column_index in range(self.row_len(row_index))]
+
+    def row_values(self, row_index):
+        return self.rows[row_index]
+
+
+def test_sheet_with_taxipp_names_row():
+    # As Prestations / AEEH
+    sheet = FakeSheet([
+        [u'date', u'aeeh_montant', u'aeeh_majo2', u'aeeh_majo2', u'', u''],
+        [u"Date d'entrée en vigueur", u'Montant (% de BMAF)', u'Majoration - 2e catégorie',
+            u'Majoration - 3e catégorie', u'Références législatives', u'Notes'],
+        [u'2013-04-01', u'', u'', u'', u'Art. L. 541-1 du CSS', u''],
+        ])
+    assert get_sheet_taxipp_names(FakeBook(sheet), u'AEEH') == [u'aeeh_montant', u'aeeh_majo2', u'aeeh_majo2']
+
+
+def test_sheet_with_labels_row():
+    # As Marché du travail / SMIG, whose first row holds merged labels
+    sheet = FakeSheet(
+        [
+            [u'Date', u'Smig brut (horaire)', u'', u'Smig brut (mensuel)', u'Références législatives'],
+            [u'', u'Zone sans abattement', u'Zone abattement maximale', u'pour 173,33h de travail', u''],
+            [u'1969-10-01', u'', u'', u'', u''],
+            ],
+        merged_cells = [(0, 1, 1, 3)],
+        )
+    assert get_sheet_taxipp_names(FakeBook(sheet), u'SMIG') is None
+    # As Retraite / AAD-FP, whose first row begins with a label
+    sheet = FakeSheet([
+        [u"Age d'annulation de la décote", u"Age d'annulation de la décote", u'Références législatives'],
+        [u'Génération', u'Sédentaires', u''],
+        ])
+    assert get_sheet_taxipp_names(FakeBook(sheet), u'AAD-FP') is None
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import multiprocessing
+import os
+import time
+
+from directory_work_queue import (acquire_lock, get_lock_owner, get_queue_status, get_unit_id, publish_units,
+    release_lock, run_worker)
+import directory_work_queue
+
+
+def run_test_unit(queue_dir, unit):
+    """Run a unit of the tests, recording its run, and failing while the file "fail" exists if it is flaky."""
+    with open(os.path.join(queue_dir, 'runs.txt'), 'a') as runs_file:
+        runs_file.write(unit['key'][0].encode('utf-8') + b'\n')
+    time.sleep(unit['args'].get('duration', 0))
+    if unit['args'].get('flaky') and os.path.exists(os.path.join(queue_dir, 'fail')):
+        raise ValueError(u'Unit {} failed'.format(unit['key'][0]))
+    return unit['key'][0]
+
+
+def run_test_worker(worker_args):
+    queue_dir, worker_id = worker_args
+    return run_worker(queue_dir, run_test_unit, lock_timeout = 1, poll_interval = 0.1, worker_id = worker_id)
+
+
+def run_test_workers(queue_dir, workers_count = 2):
+    pool = multiprocessing.Pool(workers_count)
+    try:
+        return pool.map(run_test_worker, [
+            (queue_dir, u'worker-{}'.format(index))
+            for index in range(workers_count)
+            ])
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def read_runs(queue_dir):
+    with open(os.path.join(queue_dir, 'runs.txt')) as runs_file:
+        return runs_file.read().decode('utf-8').split()
+
+
+def test_slow_unit_runs_once(tmpdir):
+    queue_dir = unicode(tmpdir)
+    # The unit runs 3 times longer than the lock timeout: its lock is refreshed meanwhile.
+    publish_units(queue_dir, [dict(after = [], args = dict(duration = 3), key = [u'slow'], kind = u'test')])
+    counts = run_test_workers(queue_dir)
+    assert sorted(counts) == [(0, 0), (1, 0)]
+    assert read_runs(queue_dir) == [u'slow']
+    assert get_queue_status(queue_dir) == dict(done = 1, failed = 0, running = 0, waiting = 0)
+    assert os.listdir(os.path.join(queue_dir, 'locks')) == []
+
+
+def test_stale_lock_is_broken(tmpdir):
+    queue_dir = unicode(tmpdir)
+    publish_units(queue_dir, [dict(after = [], args = {}, key = [u'abandoned'], kind = u'test')])
+    # Lock left by a dead worker
+    lock_path = os.path.join(queue_dir, 'locks', get_unit_id([u'abandoned']) + '.lock')
+    with open(lock_path, 'w') as lock_file:
+        lock_file.write(b'dead-worker')
+    os.utime(lock_path, (time.time() - 10, time.time() - 10))
+    run_test_workers(queue_dir)
+    assert read_runs(queue_dir) == [u'abandoned']
+    assert get_queue_status(queue_dir) == dict(done = 1, failed = 0, running = 0, waiting = 0)
+
+
+def test_lock_created_again_is_not_broken(tmpdir, monkeypatch):
+    queue_dir = unicode(tmpdir)
+    publish_units(queue_dir, [dict(after = [], args = {}, key = [u'unit'], kind = u'test')])
+    unit_id = get_unit_id([u'unit'])
+    lock_path = os.path.join(queue_dir, 'locks', unit_id + '.lock')
+    with open(lock_path, 'w') as lock_file:
+        lock_file.write(b'live-worker')
+    # The lock is seen stale at its first stat, as if it had been broken and created again before the rename.
+    real_time = time.time
+    times = [real_time() + 100]
+    monkeypatch.setattr(directory_work_queue.time, 'time', lambda: times.pop() if times else real_time())
+    assert not acquire_lock(queue_dir, unit_id, u'worker', 10)
+    assert get_lock_owner(lock_path) == u'live-worker'
+    assert os.listdir(os.path.join(queue_dir, 'locks')) == [unit_id + '.lock']
+
+
+def test_foreign_release_keeps_lock(tmpdir):
+    queue_dir = unicode(tmpdir)
+    publish_units(queue_dir, [dict(after = [], args = {}, key = [u'unit'], kind = u'test')])
+    unit_id = get_unit_id([u'unit'])
+    lock_path = os.path.join(queue_dir, 'locks', unit_id + '.lock')
+    assert acquire_lock(queue_dir, unit_id, u'worker-1', 10)
+    assert not acquire_lock(queue_dir, unit_id, u'worker-2', 10)
+    release_lock(lock_path, u'worker-2')
+    assert get_lock_owner(lock_path) == u'worker-1'
+    release_lock(lock_path, u'worker-1')
+    assert get_lock_owner(lock_path) is None
+    # Releasing a lock already removed is harmless.
+    release_lock(lock_path, u'worker-1')
+
+
+def test_republish_reruns_failed_unit(tmpdir):
+    queue_dir = unicode(tmpdir)
+    units = [
+        dict(after = [], args = dict(flaky = True), key = [u'flaky'], kind = u'test'),
+        dict(after = [[u'flaky']], args = {}, key = [u'dependent'], kind = u'test'),
+        ]
+    open(os.path.join(queue_dir, 'fail'), 'w').close()
+    publish_units(queue_dir, units)
+    run_test_workers(queue_dir)
+    # The unit depending on the failed unit fails without being run.
+    assert read_runs(queue_dir) == [u'flaky']
+    assert get_queue_status(queue_dir) == dict(done = 0, failed = 2, running = 0, waiting = 0)
+
+    os.remove(os.path.join(queue_dir, 'fail'))
+    publish_units(queue_dir, units)
+    assert get_queue_status(queue_dir) == dict(done = 0, failed = 0, running = 0, waiting = 2)
+    run_test_workers(queue_dir)
+    assert read_runs(queue_dir) == [u'flaky', u'flaky', u'dependent']
+    assert get_queue_status(queue_dir) == dict(done = 2, failed = 0, running = 0, waiting = 0)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from ipp_tables_validation import create_sheet_validation, iter_validated_sheet_events
+
+
+def validate_sheet(values_rows, bareme = u'Chomage'):
+    events = [
+        (u'sheet_start', None, None),
+        (u'header', 0, [u'date', u'montant']),
+        (u'label', 1, [u"Date d'entrée en vigueur", u'Montant']),
+        ] + [
+        (u'value', row_index + 2, values_row)
+        for row_index, values_row in enumerate(values_rows)
+        ] + [
+        (u'sheet_end', None, None),
+        ]
+    sheet_validation = create_sheet_validation()
+    assert list(iter_validated_sheet_events(sheet_validation, bareme, u'Allocation', iter(events))) == events
+    return sheet_validation
+
+
+def test_invalid_date_followed_by_amounts():
+    sheet_validation = validate_sheet([
+        [u'2002-01-01', (10, u'EUR')],
+        [u'Janvier 2001', (60, u'FRF')],
+        [u'1999-01-01', (50, u'FRF')],
+        ])
+    assert [
+        (issue['kind'], issue['row'])
+        for issue in sheet_validation['issues']
+        ] == [(u'invalid_date', 4)]
+    assert sheet_validation['taxipp_names'] == [u'montant']
+
+
+def test_franc_after_euro():
+    sheet_validation = validate_sheet([
+        [u'2002-01-01', (10, u'EUR')],
+        [u'2001-01-01', (60, u'EUR')],
+        [u'2003-01-01', (50, u'FRF')],
+        ])
+    assert [
+        (issue['kind'], issue['row'], issue['taxipp_name'])
+        for issue in sheet_validation['issues']
+        ] == [(u'non_monotonic_date', 5, None), (u'franc_after_euro', 5, u'montant')]
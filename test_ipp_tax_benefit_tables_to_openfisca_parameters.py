@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import collections
+import datetime
+import math
+
+import yaml
+
+from ipp_tax_benefit_tables_to_openfisca_parameters import dump_yaml
+
+
+def test_dump_yaml_round_trip():
+    values = [0.0, 0.1, -2.5, 3.0, 1e-05, 2.5e-07, 1e+16, -1e+22, 123456.789]
+    document = collections.OrderedDict((
+        (u'description', u'Taux réduit: "1e-05"'),
+        (u'values', collections.OrderedDict(
+            (u'2015-{:02d}-01'.format(index + 1), collections.OrderedDict((
+                (u'value', value),
+                (u'unit', u'/1'),
+                )))
+            for index, value in enumerate(values)
+            )),
+        (u'count', 9),
+        (u'notes', None),
+        ))
+    loaded_document = yaml.safe_load(dump_yaml(document))
+    assert loaded_document[u'description'] == document[u'description']
+    assert loaded_document[u'count'] == 9
+    assert loaded_document[u'notes'] is None
+    # The start dates are plain keys, loaded as dates.
+    for index, value in enumerate(values):
+        loaded_value = loaded_document[u'values'][datetime.date(2015, index + 1, 1)][u'value']
+        assert isinstance(loaded_value, float), (value, loaded_value)
+        assert loaded_value == value
+
+
+def test_dump_yaml_special_floats():
+    loaded_document = yaml.safe_load(dump_yaml(collections.OrderedDict((
+        (u'infinity', float('inf')),
+        (u'minus_infinity', float('-inf')),
+        (u'not_a_number', float('nan')),
+        ))))
+    assert loaded_document[u'infinity'] == float('inf')
+    assert loaded_document[u'minus_infinity'] == float('-inf')
+    assert math.isnan(loaded_document[u'not_a_number'])